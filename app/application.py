@@ -10,6 +10,7 @@ from types import TracebackType
 from typing import Any, AsyncIterator
 
 import uvicorn
+from anyio import to_thread
 from fastapi import Depends, FastAPI, Request
 from fastapi.responses import JSONResponse
 
@@ -20,6 +21,7 @@ from app.config import (
     _PATH,
     get_config,
 )
+from app.dependencies import get_request_db_session
 from app.errors.handlers import (
     log_request_failure,
     register_exceptions,
@@ -167,10 +169,13 @@ def _install_signal_handlers() -> None:
 @asynccontextmanager
 async def _lifespan(_: FastAPI) -> AsyncIterator[None]:
     global _shutdown_reason
+    # Routes are sync, each request in flight takes a thread from this limiter
+    to_thread.current_default_thread_limiter().total_tokens = get_config().app.worker_threads
     _emit_app_started()
     try:
         yield
     finally:
+        container.shutdown()
         if _shutdown_reason != "crash":
             Log.event(
                 logger,
@@ -235,7 +240,7 @@ def setup_fastapi() -> FastAPI:
         fastapi.include_router(router)
 
     for router in routers:
-        fastapi.include_router(router, dependencies=[Depends(get_auth_ctx)])
+        fastapi.include_router(router, dependencies=[Depends(get_auth_ctx), Depends(get_request_db_session)])
 
     register_exceptions(fastapi)
 
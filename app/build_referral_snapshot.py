@@ -0,0 +1,35 @@
+import logging
+import sys
+from time import monotonic
+
+from app import application
+from app.config import get_config
+from app.db.db import Database
+from app.db.repository.referral_repository import ReferralRepository
+from app.services.referral_snapshot import write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def build_referral_snapshot(database: Database, path: str) -> int:
+    """
+    Streams all referrals into a new snapshot file at `path` and returns their number
+    """
+    with database.get_streaming_db_session() as session:
+        repo = session.get_repository(ReferralRepository)
+        # Read before the referrals, so deletions during the build are applied by the workers
+        deleted_since = repo.last_deletion()
+        return write_snapshot(path, repo.stream_index_rows(), deleted_since)
+
+
+if __name__ == "__main__":
+    application.setup_logging()
+
+    config = get_config()
+    snapshot_path = sys.argv[1] if len(sys.argv) > 1 else config.database.referral_snapshot_path
+    if not snapshot_path:
+        sys.exit("Set database.referral_snapshot_path or pass the snapshot path as argument")
+
+    start = monotonic()
+    count = build_referral_snapshot(Database(config_database=config.database), snapshot_path)
+    logger.info("Wrote %d referrals to %s in %.1fs", count, snapshot_path, monotonic() - start)
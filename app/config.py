@@ -4,7 +4,7 @@ import os
 from enum import Enum
 from typing import Any, List
 
-from pydantic import BaseModel, Field, ValidationError, field_validator
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +31,8 @@ class ConfigLogging(BaseModel):
 
 class ConfigApp(BaseModel):
     loglevel: LogLevel = Field(default=LogLevel.info)
+    bundle_concurrency: int = Field(default=1, ge=1)
+    worker_threads: int = Field(default=40, ge=1)
 
 
 class ConfigDatabase(BaseModel):
@@ -41,15 +43,83 @@ class ConfigDatabase(BaseModel):
     max_overflow: int = Field(default=10, ge=0, lt=100)
     pool_pre_ping: bool = Field(default=False)
     pool_recycle: int = Field(default=3600, ge=0)
+    replica_dsns: List[str] = Field(default=[])
+    replica_retry_after: int = Field(default=30, ge=0)
+    read_your_writes_seconds: float = Field(default=5, ge=0)
+    circuit_breaker_failure_threshold: int = Field(default=5, ge=1)
+    circuit_breaker_reset_timeout: float = Field(default=30, ge=0)
+    retry_budget_seconds: float | None = Field(default=5.0, ge=0)
+    delete_chunk_size: int = Field(default=1000, ge=1)
+    background_delete_threshold: int = Field(default=50000, ge=0)
+    active_key_cache_ttl: float = Field(default=60, ge=0)
+    localization_cache_size: int = Field(default=0, ge=0)
+    localization_cache_ttl: float = Field(default=60, gt=0)
+    invalidation_channel: str | None = Field(default=None)
+    pseudonym_filter_capacity: int = Field(default=0, ge=0)
+    pseudonym_filter_fp_rate: float = Field(default=0.01, gt=0, lt=1)
+    pseudonym_filter_rebuild_interval: float = Field(default=3600, gt=0)
+    referral_index_enabled: bool = Field(default=False)
+    referral_index_refresh_interval: float = Field(default=5, gt=0)
+    referral_index_overlap: float = Field(default=60, ge=0)
+    referral_deletion_retention: float = Field(default=86400, gt=0)
+    referral_snapshot_path: str | None = Field(default=None)
+
+    @field_validator("replica_dsns", mode="before")
+    @classmethod
+    def validate_replica_dsns(cls, data: Any) -> List[str]:
+        if isinstance(data, str):
+            return [dsn.strip() for dsn in data.split(",") if dsn.strip()]
+
+        if isinstance(data, list):
+            return data
+
+        raise ValueError("Invalid input on `replica_dsns`, please check config")
+
+    @model_validator(mode="after")
+    def validate_pseudonym_filter(self) -> "ConfigDatabase":
+        if self.pseudonym_filter_capacity > 0 and not self.invalidation_channel:
+            raise ValueError("`pseudonym_filter_capacity` needs an `invalidation_channel`, please check config")
+
+        return self
 
 
 class ConfigCryptoServiceApi(BaseModel):
     enabled: bool = Field(default=True)
     endpoint: str
     timeout: int = Field(default=30, gt=0)
+    connect_timeout: float | None = Field(default=None, gt=0)
     mtls_cert: str | None = None
     mtls_key: str | None = None
     verify_ca: str | bool = Field(default=True)
+    pool_size: int = Field(default=10, gt=0)
+    keep_alive: int = Field(default=60, ge=0)
+    max_retries: int = Field(default=0, ge=0)
+    exchange_batch_size: int = Field(default=100, gt=0)
+    exchange_concurrency: int = Field(default=8, gt=0)
+    hedge_percentile: float | None = Field(default=None, gt=0, lt=100)
+    hedge_min_delay: float = Field(default=0.05, ge=0)
+    hedge_budget_percent: float = Field(default=5, ge=0, le=100)
+    endpoints: List[str] = Field(default=[])
+    eject_after_failures: int = Field(default=3, ge=1)
+    probe_interval: float = Field(default=5, gt=0)
+    circuit_breaker_failure_threshold: int = Field(default=5, ge=1)
+    circuit_breaker_reset_timeout: float = Field(default=30, ge=0)
+    max_in_flight: int = Field(default=20, gt=0)
+    bulkhead_timeout: float = Field(default=0.5, ge=0)
+
+    @field_validator("endpoints", mode="before")
+    @classmethod
+    def validate_endpoints(cls, data: Any) -> List[str]:
+        if isinstance(data, str):
+            return [endpoint.strip() for endpoint in data.split(",") if endpoint.strip()]
+
+        if isinstance(data, list):
+            return data
+
+        raise ValueError("Invalid input on `endpoints`, please check config")
+
+    def all_endpoints(self) -> List[str]:
+        return self.endpoints or [self.endpoint]
 
 
 class ConfigUvicorn(BaseModel):
@@ -8,13 +8,22 @@ from app.config import (
     get_config,
 )
 from app.db.db import Database
+from app.db.invalidation import InvalidationListener
+from app.db.session import setup_circuit_breaker
 from app.debug.crypto_service_api_client_mock import CryptoServiceApiClientMock
 from app.services.auth.header import AuthHeaderService
+from app.services.bulk_delete import BulkDeleteService
 from app.services.crypto_service_api_client import CryptoServiceApiClient
 from app.services.fhir.bundle import BundleService
 from app.services.fhir.localization_list import LocalizationListService
-from app.services.key_info import KeyInfoService
-from app.services.referral_service import ReferralService
+from app.services.key_info import KEY_INFO_INVALIDATION_KIND, KeyInfoService
+from app.services.pseudonym_filter import PseudonymFilter
+from app.services.referral_index import ReferralIndex
+from app.services.referral_service import (
+    REFERRAL_ADDED_INVALIDATION_KIND,
+    REFERRAL_INVALIDATION_KIND,
+    ReferralService,
+)
 from app.utils.load_capability_statement import (
     CapabilityStatement,
     load_capability_statement,
@@ -31,41 +40,148 @@ def container_config(binder: inject.Binder) -> None:
     capability_statement = load_capability_statement()
     binder.bind(CapabilityStatement, capability_statement)
 
+    setup_circuit_breaker(
+        failure_threshold=config.database.circuit_breaker_failure_threshold,
+        reset_timeout=config.database.circuit_breaker_reset_timeout,
+    )
     db = Database(config_database=config.database)
     binder.bind(Database, db)
 
-    referral_service = ReferralService(database=db)
+    invalidation = (
+        InvalidationListener(db.engine, channel=config.database.invalidation_channel)
+        if config.database.invalidation_channel
+        else None
+    )
+
+    pseudonym_filter = (
+        PseudonymFilter(
+            capacity=config.database.pseudonym_filter_capacity,
+            fp_rate=config.database.pseudonym_filter_fp_rate,
+            rebuild_interval=config.database.pseudonym_filter_rebuild_interval,
+        )
+        if config.database.pseudonym_filter_capacity > 0
+        else None
+    )
+
+    referral_index = (
+        ReferralIndex(
+            database=db,
+            refresh_interval=config.database.referral_index_refresh_interval,
+            overlap=config.database.referral_index_overlap,
+            deletion_retention=config.database.referral_deletion_retention,
+            snapshot_path=config.database.referral_snapshot_path or None,
+        )
+        if config.database.referral_index_enabled
+        else None
+    )
+
+    referral_service = ReferralService(
+        database=db,
+        cache_size=config.database.localization_cache_size,
+        cache_ttl=config.database.localization_cache_ttl,
+        invalidation=invalidation,
+        pseudonym_filter=pseudonym_filter,
+        referral_index=referral_index,
+        deletion_retention=config.database.referral_deletion_retention,
+    )
     binder.bind(ReferralService, referral_service)
+    if pseudonym_filter is not None:
+        pseudonym_filter.start(referral_service.stream_pseudonyms)
+    if referral_index is not None:
+        referral_index.start()
 
-    key_info_service = KeyInfoService(database=db)
+    key_info_service = KeyInfoService(
+        database=db, cache_ttl=config.database.active_key_cache_ttl, invalidation=invalidation
+    )
+    key_info_service.warm()
     binder.bind(KeyInfoService, key_info_service)
 
+    if invalidation is not None:
+        subscribe_invalidation(invalidation, referral_service, key_info_service)
+        invalidation.start()
+
     auth_header_service = AuthHeaderService(expected_audiences=config.authorization_headers.expected_audiences)
     binder.bind(AuthHeaderService, auth_header_service)
 
-    crypto_client = create_crypto_service_api_client(config.crypto_service_api)
+    crypto_client = create_crypto_service_api_client(config.crypto_service_api, db)
     binder.bind(CryptoServiceApiClient, crypto_client)
 
+    bulk_delete_service = BulkDeleteService(
+        referral_service=referral_service, chunk_size=config.database.delete_chunk_size
+    )
+    binder.bind(BulkDeleteService, bulk_delete_service)
+
     localization_list_service = LocalizationListService(
         referral_service=referral_service,
         key_info_service=key_info_service,
         crypto_client=crypto_client,
+        delete_chunk_size=config.database.delete_chunk_size,
+        bulk_delete_service=bulk_delete_service,
+        background_delete_threshold=config.database.background_delete_threshold,
     )
     binder.bind(LocalizationListService, localization_list_service)
 
-    bundle_service = BundleService(localization_list_service)
+    bundle_service = BundleService(localization_list_service, concurrency=config.app.bundle_concurrency)
     binder.bind(BundleService, bundle_service)
 
     binder.bind(ConfigCryptoServiceApi, config.crypto_service_api)
 
 
-def create_crypto_service_api_client(
-    config: ConfigCryptoServiceApi,
-) -> CryptoServiceApiClient:
+def subscribe_invalidation(
+    invalidation: InvalidationListener, referral_service: ReferralService, key_info_service: KeyInfoService
+) -> None:
+    """
+    Drops the cache entries that other instances changed
+    """
+    cache = referral_service.cache
+    if cache is not None:
+        invalidation.subscribe(REFERRAL_INVALIDATION_KIND, on_keys=cache.invalidate, on_flush=cache.clear)
+        invalidation.subscribe(REFERRAL_ADDED_INVALIDATION_KIND, on_keys=cache.invalidate, on_flush=cache.clear)
+
+    pseudonym_filter = referral_service.pseudonym_filter
+    if pseudonym_filter is not None:
+        # Rebuilt after a missed window, deletes only leave false positives
+        invalidation.subscribe(
+            REFERRAL_ADDED_INVALIDATION_KIND, on_keys=pseudonym_filter.add, on_flush=pseudonym_filter.invalidate
+        )
+
+    referral_index = referral_service.referral_index
+    if referral_index is not None:
+        # Picks up the writes of other instances now instead of at the next interval
+        for kind in (REFERRAL_INVALIDATION_KIND, REFERRAL_ADDED_INVALIDATION_KIND):
+            invalidation.subscribe(
+                kind, on_keys=lambda _: referral_index.request_refresh(), on_flush=referral_index.request_refresh
+            )
+
+    invalidation.subscribe(
+        KEY_INFO_INVALIDATION_KIND,
+        on_keys=lambda _: key_info_service.invalidate(),
+        on_flush=key_info_service.invalidate,
+    )
+
+
+def create_crypto_service_api_client(config: ConfigCryptoServiceApi, db: Database) -> CryptoServiceApiClient:
     if config.enabled:
-        return CryptoServiceApiClient(config)
+        return CryptoServiceApiClient(config, before_exchange=db.release_request_session)
     return CryptoServiceApiClientMock()
 
 
 def configure() -> None:
     inject.configure(container_config, once=True)
+
+
+def shutdown() -> None:
+    """
+    Releases the pooled connections and worker threads held by the container services
+    """
+    if inject.is_configured():
+        inject.instance(CryptoServiceApiClient).close()
+        inject.instance(BundleService).shutdown()
+        inject.instance(BulkDeleteService).shutdown()
+        referral_service = inject.instance(ReferralService)
+        if referral_service.invalidation is not None:
+            referral_service.invalidation.stop()
+        if referral_service.pseudonym_filter is not None:
+            referral_service.pseudonym_filter.stop()
+        if referral_service.referral_index is not None:
+            referral_service.referral_index.stop()
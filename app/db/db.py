@@ -1,46 +1,75 @@
 import logging
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, Iterator, List
 
-from sqlalchemy import StaticPool, create_engine, text
+from sqlalchemy import Engine, StaticPool, create_engine, text
 from sqlalchemy.orm import Session
 
 from app.config import ConfigDatabase
 from app.db.models.base import Base
-from app.db.session import DbSession
+from app.db.session import DbSession, RetryBudget
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class _RequestSessions:
+    primary: DbSession
+    retry_budget: RetryBudget | None
+    replica: DbSession | None = None
+
+
 class Database:
     _config_database: ConfigDatabase
+    replica_engines: List[Engine]
 
     def __init__(self, config_database: ConfigDatabase):
         self._config_database = config_database
+        # Per instance, so services bound to another Database never pick up this one's request session
+        self._request_sessions: ContextVar[_RequestSessions | None] = ContextVar(
+            f"request_db_sessions_{id(self)}", default=None
+        )
+        self._lock = threading.Lock()
+        self._replica_unhealthy_until: Dict[int, float] = {}
+        self._recent_writes: Dict[str, float] = {}
 
         try:
+            self.engine = self._create_engine(config_database, config_database.dsn)
             if "sqlite://" in config_database.dsn:
-                self.engine = create_engine(
-                    config_database.dsn,
-                    connect_args={
-                        "check_same_thread": False,
-                        "uri": True,
-                    },  # This + static pool is needed for sqlite in-memory tables
-                    poolclass=StaticPool,
-                )
                 with self.engine.connect() as conn:
                     conn.execute(text("PRAGMA foreign_keys=ON"))
-            else:
-                self.engine = create_engine(
-                    config_database.dsn,
-                    echo=False,
-                    pool_pre_ping=config_database.pool_pre_ping,
-                    pool_recycle=config_database.pool_recycle,
-                    pool_size=config_database.pool_size,
-                    max_overflow=config_database.max_overflow,
-                )
+
+            self.replica_engines = [self._create_engine(config_database, dsn) for dsn in config_database.replica_dsns]
         except BaseException:
             logger.exception("Error while connecting to database")
             raise
 
+    @staticmethod
+    def _create_engine(config_database: ConfigDatabase, dsn: str) -> Engine:
+        if "sqlite://" in dsn:
+            return create_engine(
+                dsn,
+                connect_args={
+                    "check_same_thread": False,
+                    "uri": True,
+                },  # This + static pool is needed for sqlite in-memory tables
+                poolclass=StaticPool,
+            )
+
+        return create_engine(
+            dsn,
+            echo=False,
+            pool_pre_ping=config_database.pool_pre_ping,
+            pool_recycle=config_database.pool_recycle,
+            pool_size=config_database.pool_size,
+            max_overflow=config_database.max_overflow,
+        )
+
     def generate_tables(self) -> None:
         logger.info("Generating tables...")
         Base.metadata.create_all(self.engine)
@@ -59,5 +88,118 @@ class Database:
             logger.info("Database is not healthy: %s", e)
             return False
 
-    def get_db_session(self) -> DbSession:
-        return DbSession(self.engine, self._config_database.retry_backoff)
+    def get_db_session(self, retry_backoff: List[float] | None = None) -> DbSession:
+        """
+        Returns the request scoped session when one is active, otherwise a new session
+
+        :param retry_backoff: backoff of a new session instead of the configured one, [] for a single attempt
+        """
+        request_sessions = self._request_sessions.get()
+        if request_sessions is not None:
+            return request_sessions.primary
+
+        return DbSession(self.engine, self._config_database.retry_backoff if retry_backoff is None else retry_backoff)
+
+    def release_request_session(self) -> None:
+        """
+        Returns the connections of the request scoped sessions to the pool, so a request that waits on another
+        service does not hold one idle in a transaction meanwhile
+        """
+        request_sessions = self._request_sessions.get()
+        if request_sessions is None:
+            return
+
+        request_sessions.primary.release()
+        if request_sessions.replica is not None:
+            request_sessions.replica.release()
+
+    def get_read_db_session(self, client_key: str | None = None) -> DbSession:
+        """
+        Returns a session for read-only queries. It is bound to a healthy replica when replicas are
+        configured, and to the primary when there are none, none are healthy, or `client_key` wrote
+        within the read_your_writes_seconds window and must see its own writes.
+        """
+        if not self.replica_engines or (client_key is not None and self._wrote_recently(client_key)):
+            return self.get_db_session()
+
+        request_sessions = self._request_sessions.get()
+        if request_sessions is None:
+            return self._new_read_session()
+
+        if request_sessions.replica is None:
+            request_sessions.replica = self._new_read_session(request_sessions.retry_budget)
+            request_sessions.replica.__enter__()
+
+        return request_sessions.replica
+
+    def get_streaming_db_session(self, client_key: str | None = None, primary: bool = False) -> DbSession:
+        """
+        Returns a new session for a read-only query whose results are streamed, never the request scoped one:
+        a streamed response body is still being produced after the request scope has ended.
+
+        :param primary: read from the primary, for results that must not miss recent writes
+        """
+        if primary or (client_key is not None and self._wrote_recently(client_key)):
+            return DbSession(self.engine, self._config_database.retry_backoff)
+
+        return self._new_read_session()
+
+    def record_write(self, client_key: str) -> None:
+        """
+        Remembers that `client_key` wrote, so its reads go to the primary for read_your_writes_seconds
+        """
+        if not self.replica_engines or self._config_database.read_your_writes_seconds <= 0:
+            return
+
+        now = monotonic()
+        with self._lock:
+            self._recent_writes[client_key] = now + self._config_database.read_your_writes_seconds
+            # Keep the map bounded by the number of clients that wrote within the window
+            if len(self._recent_writes) > 1024:
+                self._recent_writes = {k: v for k, v in self._recent_writes.items() if v > now}
+
+    def _wrote_recently(self, client_key: str) -> bool:
+        return self._recent_writes.get(client_key, 0.0) > monotonic()
+
+    def _new_read_session(self, retry_budget: RetryBudget | None = None) -> DbSession:
+        now = monotonic()
+        healthy = [i for i in range(len(self.replica_engines)) if self._replica_unhealthy_until.get(i, 0.0) <= now]
+        if not healthy:
+            return DbSession(self.engine, self._config_database.retry_backoff, retry_budget=retry_budget)
+
+        index = random.choice(healthy)
+        return DbSession(
+            self.replica_engines[index],
+            self._config_database.retry_backoff,
+            fallback_engine=self.engine,
+            on_failover=lambda: self._mark_replica_unhealthy(index),
+            retry_budget=retry_budget,
+        )
+
+    def _mark_replica_unhealthy(self, index: int) -> None:
+        logger.warning("Database replica %d is unhealthy, reading from the primary", index)
+        with self._lock:
+            self._replica_unhealthy_until[index] = monotonic() + self._config_database.replica_retry_after
+
+    @contextmanager
+    def request_session(self) -> Iterator[DbSession]:
+        """
+        Opens a single DbSession that every get_db_session() call in the current context shares, so a
+        request checks a connection out of the pool once instead of once per service call. A replica
+        session handed out by get_read_db_session() during the request is shared and closed the same way.
+        Both sessions draw on one budget of retry_budget_seconds for the request.
+        """
+        retry_budget_seconds = self._config_database.retry_budget_seconds
+        retry_budget = RetryBudget(retry_budget_seconds) if retry_budget_seconds is not None else None
+        request_sessions = _RequestSessions(
+            primary=DbSession(self.engine, self._config_database.retry_backoff, retry_budget=retry_budget),
+            retry_budget=retry_budget,
+        )
+        token = self._request_sessions.set(request_sessions)
+        try:
+            with request_sessions.primary:
+                yield request_sessions.primary
+        finally:
+            if request_sessions.replica is not None:
+                request_sessions.replica.__exit__(None, None, None)
+            self._request_sessions.reset(token)
@@ -0,0 +1,171 @@
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Sequence
+
+from psycopg import sql
+from sqlalchemy import Engine, text
+
+from app.services.exceptions import DatabaseUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Key that invalidates every cached entry of a kind
+FLUSH_KEY = "*"
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7900
+
+
+@dataclass
+class _Subscription:
+    on_keys: Callable[[List[str]], None]
+    on_flush: Callable[[], None]
+
+
+class InvalidationListener:
+    """
+    Keeps the in-process caches of several NVI instances in step through PostgreSQL LISTEN/NOTIFY. A write publishes
+    the keys it changed, e.g. pseudonyms of referrals, on the channel, and every instance hands them to the callbacks
+    subscribed to that kind of key.
+
+    A dedicated connection, detached from the engine pool, listens in a background thread. Notifications sent while
+    it is not connected are lost, so every subscriber is flushed each time the listener (re)connects.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        channel: str,
+        reconnect_backoff: Sequence[float] = (0.5, 1, 2, 5, 10),
+        poll_interval: float = 1,
+    ) -> None:
+        """
+        :param channel: notification channel shared by all instances
+        :param reconnect_backoff: seconds between reconnect attempts, the last value repeats
+        :param poll_interval: seconds between checks whether the listener has been stopped
+        """
+        self.engine = engine
+        self.channel = channel
+        self.reconnect_backoff = list(reconnect_backoff)
+        self.poll_interval = poll_interval
+        self._subscriptions: Dict[str, List[_Subscription]] = {}
+        self.listening = False
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def supported(self) -> bool:
+        return self.engine.dialect.name == "postgresql"
+
+    def subscribe(self, kind: str, on_keys: Callable[[List[str]], None], on_flush: Callable[[], None]) -> None:
+        """
+        :param on_keys: called with the keys of `kind` another instance (or this one) changed
+        :param on_flush: called when every cached entry of `kind` has to be dropped
+        """
+        self._subscriptions.setdefault(kind, []).append(_Subscription(on_keys, on_flush))
+
+    def publish(self, kind: str, keys: Sequence[str], required: bool = False) -> None:
+        """
+        Notifies all instances of changed keys. Call it after the change is committed. A failure is logged and
+        not raised, the write itself succeeded; other instances then serve the old value until their cache expires.
+
+        :param required: raise a DatabaseUnavailableError on failure instead, for keys other instances must not
+            miss, so the write is not acknowledged and the client retries it
+        """
+        if not self.supported or not keys:
+            return
+
+        try:
+            with self.engine.begin() as conn:
+                for payload in self._payloads(kind, keys):
+                    conn.execute(
+                        text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": payload}
+                    )
+        except Exception:
+            logger.warning("Could not publish the invalidation of %d %s keys", len(keys), kind, exc_info=True)
+            if required:
+                raise DatabaseUnavailableError()
+
+    def start(self) -> None:
+        if not self.supported:
+            logger.warning("Cache invalidation through LISTEN/NOTIFY needs PostgreSQL, it is disabled")
+            return
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="invalidation-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.poll_interval + 1)
+            self._thread = None
+        self.listening = False
+
+    @staticmethod
+    def _payloads(kind: str, keys: Sequence[str]) -> List[str]:
+        payloads: List[str] = []
+        current: List[str] = []
+        size = len(kind)
+        for key in keys:
+            if current and size + len(key) + 1 > MAX_PAYLOAD_BYTES:
+                payloads.append("\n".join([kind, *current]))
+                current, size = [], len(kind)
+            current.append(key)
+            size += len(key) + 1
+        payloads.append("\n".join([kind, *current]))
+        return payloads
+
+    def _run(self) -> None:
+        failures = 0
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                # Back off from the start again after a connection that did work for a while
+                failures = 1 if self.listening else failures + 1
+                self.listening = False
+                delay = self.reconnect_backoff[min(failures, len(self.reconnect_backoff)) - 1]
+                logger.warning("Invalidation listener lost its connection, reconnecting in %ss", delay, exc_info=True)
+                self._stopped.wait(delay)
+
+    def _listen(self) -> None:
+        """
+        Listens until stopped, raises when the connection fails
+        """
+        connection = self.engine.raw_connection()
+        # The connection is dedicated to LISTEN and never goes back to the pool
+        connection.detach()
+        try:
+            driver_connection = connection.driver_connection
+            if driver_connection is None:
+                raise RuntimeError("Invalidation listener connection is closed")
+            driver_connection.autocommit = True
+            driver_connection.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+            self.listening = True
+            # Anything published while not listening was missed
+            self._flush_all()
+            while not self._stopped.is_set():
+                for notify in driver_connection.notifies(timeout=self.poll_interval):
+                    self.dispatch(notify.payload)
+        finally:
+            connection.close()
+
+    def dispatch(self, payload: str) -> None:
+        kind, *keys = payload.split("\n")
+        for subscription in self._subscriptions.get(kind, []):
+            try:
+                if FLUSH_KEY in keys:
+                    subscription.on_flush()
+                else:
+                    subscription.on_keys(keys)
+            except Exception:
+                logger.exception("Invalidation callback for %s failed", kind)
+
+    def _flush_all(self) -> None:
+        for kind, subscriptions in self._subscriptions.items():
+            for subscription in subscriptions:
+                try:
+                    subscription.on_flush()
+                except Exception:
+                    logger.exception("Invalidation flush for %s failed", kind)
@@ -2,7 +2,7 @@ from datetime import datetime
 from typing import TYPE_CHECKING
 from uuid import UUID, uuid4
 
-from sqlalchemy import TIMESTAMP, ForeignKey, String, UniqueConstraint
+from sqlalchemy import DDL, TIMESTAMP, BigInteger, ForeignKey, Index, Integer, String, UniqueConstraint, event, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.types import Uuid
 
@@ -21,6 +21,18 @@ class ReferralEntity(Base):
             "source",
             name="providers_unique_idx",
         ),
+        # Localization looks up on pseudonym only, the unique index above leads with ura_number and
+        # cannot serve that query. The INCLUDE columns allow index-only scans on PostgreSQL.
+        Index(
+            "referrals_pseudonym_idx",
+            "pseudonym",
+            postgresql_include=["ura_number", "source", "created_at"],
+        ),
+        # Keyset pagination and streaming of URA-wide listings walk the referrals of a URA in (created_at, id)
+        # order
+        Index("referrals_ura_created_at_idx", "ura_number", "created_at", "id"),
+        # The referral index picks up new referrals of other instances on created_at
+        Index("referrals_created_at_idx", "created_at"),
     )
 
     id: Mapped[UUID] = mapped_column("id", Uuid, primary_key=True, default=uuid4)
@@ -31,3 +43,55 @@ class ReferralEntity(Base):
     created_at: Mapped[datetime] = mapped_column("created_at", TIMESTAMP, default=datetime.now)
 
     key_info: Mapped["KeyInfoEntity"] = relationship(back_populates="referrals")
+
+
+class ReferralDeletionEntity(Base):
+    """
+    Change log of deleted referrals, filled by a trigger on referrals so every delete path is covered. In-memory
+    referral indexes apply it to drop the referrals other instances deleted.
+    """
+
+    __tablename__ = "referral_deletions"
+    __table_args__ = (Index("referral_deletions_deleted_at_idx", "deleted_at"),)
+
+    seq: Mapped[int] = mapped_column(
+        "seq", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True
+    )
+    referral_id: Mapped[UUID] = mapped_column("referral_id", Uuid)
+    pseudonym: Mapped[str] = mapped_column("pseudonym", String)
+    deleted_at: Mapped[datetime] = mapped_column("deleted_at", TIMESTAMP, server_default=func.now())
+
+
+# Also in sql/028-referral-deletions.sql. A statement level trigger writes the log of a bulk delete in one INSERT.
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(  # type: ignore[no-untyped-call]
+        """
+        CREATE OR REPLACE FUNCTION log_referral_deletions() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO referral_deletions (referral_id, pseudonym) SELECT id, pseudonym FROM deleted_referrals;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER referrals_log_deletions AFTER DELETE ON referrals
+            REFERENCING OLD TABLE AS deleted_referrals
+            FOR EACH STATEMENT EXECUTE FUNCTION log_referral_deletions();
+        """
+    ).execute_if(dialect="postgresql"),
+)
+# deleted_at in the microsecond format SQLAlchemy binds timestamps in on SQLite, so they compare as strings
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(  # type: ignore[no-untyped-call]
+        """
+        CREATE TRIGGER IF NOT EXISTS referrals_log_deletions AFTER DELETE ON referrals
+        BEGIN
+            INSERT INTO referral_deletions (referral_id, pseudonym, deleted_at)
+                VALUES (OLD.id, OLD.pseudonym, strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now') || '000');
+        END
+        """
+    ).execute_if(dialect="sqlite"),
+)
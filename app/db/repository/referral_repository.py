@@ -1,16 +1,114 @@
-from typing import Sequence
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, NamedTuple, Sequence, Tuple, cast
 from uuid import UUID
 
-from sqlalchemy import and_, delete, exists, select
+from sqlalchemy import String, and_, any_, bindparam, delete, exists, func, literal, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import SQLAlchemyError
 
 from app.db.decorator import repository
-from app.db.models.referral import ReferralEntity
+from app.db.models.referral import ReferralDeletionEntity, ReferralEntity
 from app.db.repository.respository_base import RepositoryBase
 
+UNIQUE_INDEX_ELEMENTS = ["ura_number", "pseudonym", "source"]
+# Rows per multi-row INSERT, keeps the number of bound parameters well below the PostgreSQL limit of 65535
+INSERT_CHUNK_SIZE = 1000
+# Rows fetched per round trip when streaming, the server side cursor never holds more than this in memory
+STREAM_YIELD_PER = 500
+
+# (id, pseudonym, ura_number, source, created_at) of a referral
+IndexRow = Tuple[UUID, str, str, str, datetime]
+# (referral_id, pseudonym, deleted_at) of a logged deletion
+DeletionRow = Tuple[UUID, str, datetime]
+
+
+class DeletedReferral(NamedTuple):
+    id: UUID
+    pseudonym: str
+    ura_number: str
+
+
+def delete_returning(*conditions: Any) -> Any:
+    """
+    Returns a single DELETE ... RETURNING id, pseudonym, ura_number statement. The session is not synchronized,
+    so no entities are loaded into the identity map.
+    """
+    return (
+        delete(ReferralEntity)
+        .where(*conditions)
+        .returning(ReferralEntity.id, ReferralEntity.pseudonym, ReferralEntity.ura_number)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def key_conditions(pseudonym: str, ura_number: str, source: str) -> List[Any]:
+    return [
+        ReferralEntity.ura_number == ura_number,
+        ReferralEntity.pseudonym == pseudonym,
+        ReferralEntity.source == source,
+    ]
+
+
+def id_conditions(id: UUID, ura_number: str | None) -> List[Any]:
+    conditions: List[Any] = [ReferralEntity.id == id]
+    if ura_number is not None:
+        conditions.append(ReferralEntity.ura_number == ura_number)
+    return conditions
+
+
+def dialect_insert(dialect: str) -> Any:
+    """
+    Returns a dialect specific INSERT construct, ON CONFLICT is not part of the generic SQLAlchemy insert
+    """
+    if dialect == "postgresql":
+        return postgresql.insert(ReferralEntity)
+    if dialect == "sqlite":
+        return sqlite.insert(ReferralEntity)
+
+    raise NotImplementedError(f"ON CONFLICT inserts are not supported for dialect {dialect}")
+
+
+def pseudonym_in(dialect: str, pseudonyms: Sequence[str]) -> Any:
+    """
+    Returns the condition matching any of the pseudonyms. On PostgreSQL it is `pseudonym = ANY(:pseudonyms)` with one
+    array parameter, so the statement is the same for any number of pseudonyms.
+    """
+    if dialect == "postgresql":
+        return ReferralEntity.pseudonym == any_(
+            bindparam("pseudonyms", list(pseudonyms), type_=postgresql.ARRAY(String))
+        )
+
+    return ReferralEntity.pseudonym.in_(pseudonyms)
+
+
+def map_created_rows(
+    rows: Sequence[Dict[str, Any]], created_referrals: Sequence[ReferralEntity]
+) -> List[ReferralEntity | None]:
+    """
+    Maps the rows returned by an INSERT ... RETURNING back onto the input rows on their unique key,
+    RETURNING order is not guaranteed. Rows that were not created map to None.
+    """
+    created = {(r.ura_number, r.pseudonym, r.source): r for r in created_referrals}
+    return [created.pop((row["ura_number"], row["pseudonym"], row["source"]), None) for row in rows]
+
+
+def to_insert_rows(referral_entities: Sequence[ReferralEntity]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "pseudonym": entity.pseudonym,
+            "ura_number": entity.ura_number,
+            "source": entity.source,
+            "key_id": entity.key_id,
+        }
+        for entity in referral_entities
+    ]
+
 
 @repository(ReferralEntity)
 class ReferralRepository(RepositoryBase):
+    def _insert(self) -> Any:
+        return dialect_insert(self.db_session.session.get_bind().dialect.name)
+
     def find_one(self, pseudonym: str, ura_number: str, source: str) -> ReferralEntity | None:
         stmt = select(ReferralEntity).where(
             ReferralEntity.ura_number == str(ura_number),
@@ -45,6 +143,120 @@ class ReferralRepository(RepositoryBase):
         results = self.db_session.execute(stmt).scalars().all()
         return results
 
+    def find_by_pseudonyms(self, pseudonyms: Sequence[str]) -> Sequence[ReferralEntity]:
+        """
+        Returns the referrals of all URAs for any of the pseudonyms in a single query
+        """
+        if not pseudonyms:
+            return []
+
+        stmt = select(ReferralEntity).where(
+            pseudonym_in(self.db_session.session.get_bind().dialect.name, sorted(set(pseudonyms)))
+        )
+        return self.db_session.execute(stmt).scalars().all()
+
+    def find_page(
+        self,
+        ura_number: str,
+        count: int,
+        source: str | None = None,
+        pseudonym: str | None = None,
+        after: Tuple[datetime, UUID] | None = None,
+    ) -> Sequence[ReferralEntity]:
+        """
+        Returns at most `count` referrals of a URA in (created_at, id) order, starting after the keyset `after`
+        """
+        stmt = self._ura_listing_stmt(ura_number, source, pseudonym)
+        if after is not None:
+            stmt = stmt.where(
+                tuple_(ReferralEntity.created_at, ReferralEntity.id) > tuple_(*(literal(value) for value in after))
+            )
+
+        return self.db_session.execute(stmt.limit(count)).scalars().all()
+
+    def stream_many(
+        self,
+        ura_number: str,
+        source: str | None = None,
+        pseudonym: str | None = None,
+    ) -> Iterator[ReferralEntity]:
+        """
+        Yields the referrals of a URA in (created_at, id) order from a server side cursor, STREAM_YIELD_PER
+        rows at a time
+        """
+        stmt = self._ura_listing_stmt(ura_number, source, pseudonym).execution_options(yield_per=STREAM_YIELD_PER)
+        yield from self.db_session.execute(stmt).scalars()
+
+    def stream_index_rows(self) -> Iterator[IndexRow]:
+        """
+        Yields every referral from a server side cursor, to load the referral index from
+        """
+        stmt = self._index_rows_stmt().execution_options(yield_per=STREAM_YIELD_PER)
+        yield from cast(Iterator[IndexRow], self.db_session.execute(stmt))
+
+    def find_created_since(self, since: datetime) -> Sequence[IndexRow]:
+        """
+        Returns the referrals created at or after `since`
+        """
+        stmt = self._index_rows_stmt().where(ReferralEntity.created_at >= since)
+        return cast(Sequence[IndexRow], self.db_session.execute(stmt).all())
+
+    def find_deletions_since(self, since: datetime | None) -> Sequence[DeletionRow]:
+        """
+        Returns the logged deletions at or after `since`, all when None
+        """
+        stmt: Any = select(
+            ReferralDeletionEntity.referral_id, ReferralDeletionEntity.pseudonym, ReferralDeletionEntity.deleted_at
+        )
+        if since is not None:
+            stmt = stmt.where(ReferralDeletionEntity.deleted_at >= since)
+        return cast(Sequence[DeletionRow], self.db_session.execute(stmt).all())
+
+    def last_deletion(self) -> datetime | None:
+        return self.db_session.execute(select(func.max(ReferralDeletionEntity.deleted_at))).scalar()
+
+    def prune_deletions(self, before: datetime) -> int:
+        """
+        Removes the deletion log entries older than `before`
+        """
+        stmt = delete(ReferralDeletionEntity).where(ReferralDeletionEntity.deleted_at < before)
+        try:
+            result = self.db_session.delete_stmt(stmt)  # type: ignore
+            self.db_session.commit()
+        except SQLAlchemyError as exc:
+            self.db_session.rollback()
+            raise exc
+
+        return result.rowcount  # type: ignore
+
+    def stream_pseudonyms(self) -> Iterator[str]:
+        """
+        Yields the pseudonym of every referral from a server side cursor, STREAM_YIELD_PER rows at a time
+        """
+        stmt = select(ReferralEntity.pseudonym).execution_options(yield_per=STREAM_YIELD_PER)
+        yield from self.db_session.execute(stmt).scalars()
+
+    @staticmethod
+    def _index_rows_stmt() -> Any:
+        return select(
+            ReferralEntity.id,
+            ReferralEntity.pseudonym,
+            ReferralEntity.ura_number,
+            ReferralEntity.source,
+            ReferralEntity.created_at,
+        )
+
+    @staticmethod
+    def _ura_listing_stmt(ura_number: str, source: str | None, pseudonym: str | None) -> Any:
+        stmt = select(ReferralEntity).where(ReferralEntity.ura_number == ura_number)
+        if source is not None:
+            stmt = stmt.where(ReferralEntity.source == source)
+
+        if pseudonym is not None:
+            stmt = stmt.where(ReferralEntity.pseudonym == pseudonym)
+
+        return stmt.order_by(ReferralEntity.created_at, ReferralEntity.id)
+
     def delete_many(
         self,
         ura_number: str,
@@ -69,6 +281,30 @@ class ReferralRepository(RepositoryBase):
 
         return results.rowcount  # type: ignore
 
+    def count(self, ura_number: str, source: str | None = None) -> int:
+        stmt = select(func.count()).select_from(ReferralEntity).where(ReferralEntity.ura_number == ura_number)
+        if source is not None:
+            stmt = stmt.where(ReferralEntity.source == source)
+
+        count: int = self.db_session.execute(stmt).scalar_one()
+        return count
+
+    def delete_chunk(self, ura_number: str, chunk_size: int, source: str | None = None) -> int:
+        """
+        Deletes and commits at most `chunk_size` referrals of a URA, the first ones in (created_at, id) order so
+        the chunk is a contiguous range of the ura_number index. Returns the number of deleted rows.
+        """
+        ids = self._ura_listing_stmt(ura_number, source, None).with_only_columns(ReferralEntity.id).limit(chunk_size)
+        stmt = delete(ReferralEntity).where(ReferralEntity.id.in_(ids))
+        try:
+            result = self.db_session.delete_stmt(stmt)  # type: ignore
+            self.db_session.commit()
+        except SQLAlchemyError as exc:
+            self.db_session.rollback()
+            raise exc
+
+        return result.rowcount  # type: ignore
+
     def add_one(self, referral_entity: ReferralEntity) -> ReferralEntity:
         try:
             self.db_session.add(referral_entity)
@@ -78,6 +314,74 @@ class ReferralRepository(RepositoryBase):
             self.db_session.rollback()
             raise exc
 
+    def insert_one(self, pseudonym: str, ura_number: str, source: str, key_id: UUID) -> ReferralEntity | None:
+        """
+        Inserts a referral in a single INSERT ... ON CONFLICT DO NOTHING RETURNING statement.
+        Returns the new referral, or None when a referral with the same ura_number, pseudonym
+        and source already exists.
+        """
+        stmt = (
+            self._insert()
+            .values(pseudonym=pseudonym, ura_number=ura_number, source=source, key_id=key_id)
+            .on_conflict_do_nothing(index_elements=UNIQUE_INDEX_ELEMENTS)
+            .returning(ReferralEntity)
+        )
+        try:
+            result: ReferralEntity | None = self.db_session.execute(stmt).scalars().first()
+            self.db_session.commit()
+            return result
+        except SQLAlchemyError as exc:
+            self.db_session.rollback()
+            raise exc
+
+    def add_many(self, referral_entities: Sequence[ReferralEntity]) -> List[ReferralEntity | None]:
+        """
+        Inserts a batch of referrals with multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING statements
+        in a single transaction. The returned list follows the order of the input: the new referral when
+        it has been created, or None when it already existed (in the database or earlier in the batch).
+        """
+        rows = to_insert_rows(referral_entities)
+        created: List[ReferralEntity] = []
+        try:
+            for offset in range(0, len(rows), INSERT_CHUNK_SIZE):
+                stmt = (
+                    self._insert()
+                    .values(rows[offset : offset + INSERT_CHUNK_SIZE])
+                    .on_conflict_do_nothing(index_elements=UNIQUE_INDEX_ELEMENTS)
+                    .returning(ReferralEntity)
+                )
+                created.extend(self.db_session.execute(stmt).scalars().all())
+            self.db_session.commit()
+        except SQLAlchemyError as exc:
+            self.db_session.rollback()
+            raise exc
+
+        return map_created_rows(rows, created)
+
+    def delete_by_id(self, id: UUID, ura_number: str | None = None) -> DeletedReferral | None:
+        """
+        Deletes a referral by id, limited to `ura_number` when given, in one round trip.
+        Returns the deleted referral, or None when there was no match.
+        """
+        return self._delete_returning(id_conditions(id, ura_number))
+
+    def delete_by_key(self, pseudonym: str, ura_number: str, source: str) -> DeletedReferral | None:
+        """
+        Deletes a referral by its unique key in one round trip. Returns the deleted referral, or None when there
+        was no match.
+        """
+        return self._delete_returning(key_conditions(pseudonym, ura_number, source))
+
+    def _delete_returning(self, conditions: List[Any]) -> DeletedReferral | None:
+        try:
+            row = self.db_session.execute(delete_returning(*conditions)).first()
+            self.db_session.commit()
+        except SQLAlchemyError as exc:
+            self.db_session.rollback()
+            raise exc
+
+        return DeletedReferral._make(row) if row is not None else None
+
     def delete_one(self, referral_entity: ReferralEntity) -> None:
         try:
             self.db_session.delete(referral_entity)
@@ -1,17 +1,21 @@
 import logging
 import random
 import re
-from time import sleep
-from typing import Any, Callable, List, ParamSpec, Tuple, Type, TypeVar
+import threading
+from enum import Enum
+from time import monotonic, sleep
+from typing import Any, Callable, List, ParamSpec, Tuple, Type, TypeVar, overload
 
-from sqlalchemy import Delete, Engine, Insert, Result
+from sqlalchemy import Delete, Engine, Result
 from sqlalchemy.exc import DatabaseError, DataError, OperationalError, PendingRollbackError
 from sqlalchemy.orm import Session
+from sqlalchemy.sql.base import Executable
 from sqlalchemy.sql.selectable import TypedReturnsRows
 
 from app.db.models.base import Base
 from app.db.repository import respository_base
-from app.logging.events import Log
+from app.logging.events import Log, NVIEvent
+from app.services.exceptions import DatabaseUnavailableError
 
 _VARCHAR_LIMIT_RE = re.compile(r"character varying\((\d+)\)")
 
@@ -90,26 +94,176 @@ P = ParamSpec("P")
 R = TypeVar("R", bound=Tuple[Any, ...])
 
 
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Process wide circuit breaker for database connection errors. After `failure_threshold` consecutive
+    connection failures the circuit opens and calls fail fast with a DatabaseUnavailableError instead of
+    sleeping through the retry ladder. After `reset_timeout` seconds a single trial call is let through
+    (half open); its outcome closes or re-opens the circuit.
+
+    Other dependencies reuse it with their own unavailable error and state change event.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        unavailable_error: Callable[[], Exception] = DatabaseUnavailableError,
+        event: NVIEvent = Log.DB_CIRCUIT_STATE_CHANGED,
+        name: str = "Database",
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._unavailable_error = unavailable_error
+        self._event = event
+        self._name = name
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> CircuitState:
+        return self._state
+
+    def before_call(self) -> None:
+        """
+        Raises the unavailable error when the circuit does not allow a call right now
+        """
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return
+
+            if self._state == CircuitState.OPEN:
+                if monotonic() - self._opened_at < self.reset_timeout:
+                    raise self._unavailable_error()
+                self._transition(CircuitState.HALF_OPEN)
+
+            if self._trial_in_flight:
+                raise self._unavailable_error()
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self._state != CircuitState.CLOSED:
+                self._transition(CircuitState.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == CircuitState.HALF_OPEN or (
+                self._state == CircuitState.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._opened_at = monotonic()
+                self._transition(CircuitState.OPEN)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = CircuitState.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def _transition(self, state: CircuitState) -> None:
+        previous = self._state
+        self._state = state
+        Log.event(
+            logger,
+            self._event,
+            f"{self._name} circuit breaker state changed",
+            previous_state=previous.value,
+            state=state.value,
+            failure_count=self._failures,
+        )
+
+
+_CIRCUIT_BREAKER = CircuitBreaker()
+
+
+def setup_circuit_breaker(failure_threshold: int, reset_timeout: float) -> None:
+    global _CIRCUIT_BREAKER
+    _CIRCUIT_BREAKER = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    return _CIRCUIT_BREAKER
+
+
+class RetryBudget:
+    """
+    Seconds of retry backoff the sessions of one request may spend together
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self._seconds = seconds
+        self._lock = threading.Lock()
+
+    def spend(self, seconds: float) -> bool:
+        """
+        Takes `seconds` from the budget, returns False and takes nothing when less is left
+        """
+        with self._lock:
+            if seconds > self._seconds:
+                return False
+            self._seconds -= seconds
+            return True
+
+
 class DbSession:
     _engine: Engine
     _retry_backoff: List[float]
-
-    def __init__(self, engine: Engine, retry_backoff: List[float]) -> None:
+    _depth: int
+    _fallback_engine: Engine | None
+    _on_failover: Callable[[], None] | None
+
+    def __init__(
+        self,
+        engine: Engine,
+        retry_backoff: List[float],
+        fallback_engine: Engine | None = None,
+        on_failover: Callable[[], None] | None = None,
+        retry_budget: RetryBudget | None = None,
+    ) -> None:
+        """
+        :param fallback_engine: engine to switch to (once) on connection errors instead of retrying, used to
+            fall back from a read replica to the primary
+        :param on_failover: called when switching to the fallback engine
+        :param retry_budget: seconds of retry backoff left, shared with the other sessions of the request,
+            None for no limit
+        """
         self._engine = engine
         self._retry_backoff = retry_backoff
+        self._retry_budget = retry_budget
+        self._depth = 0
+        self._fallback_engine = fallback_engine
+        self._on_failover = on_failover
 
     def __enter__(self) -> "DbSession":
         """
-        Create a new session when entering the context manager
+        Create a new session when entering the context manager. The context manager is re-entrant, so a
+        request scoped DbSession can be shared by services that each open it with a `with` block.
         """
-        self.session = Session(self._engine, expire_on_commit=False)
+        if self._depth == 0:
+            self.session = Session(self._engine, expire_on_commit=False)
+        self._depth += 1
         return self
 
     def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
         """
-        Close the session when exiting the context manager
+        Close the session when exiting the outermost context manager
         """
-        self.session.close()
+        self._depth -= 1
+        if self._depth == 0:
+            self.session.close()
 
     def get_repository(
         self, repository_class: Type["respository_base.TRepositoryBase"]
@@ -148,6 +302,14 @@ class DbSession:
         """
         self._retry(self.session.commit)
 
+    def release(self) -> None:
+        """
+        Ends the open transaction so its connection goes back to the pool, the next query checks one out again.
+        The transaction is committed rather than rolled back so loaded entities are not expired.
+        """
+        if self._depth > 0 and self.session.in_transaction():
+            self.commit()
+
     def rollback(self) -> None:
         """
         Rollback the current transaction
@@ -165,7 +327,14 @@ class DbSession:
         """
         return self._retry(self.session.execute, stmt)
 
-    def execute(self, stmt: TypedReturnsRows[R] | Insert) -> Result[R]:
+    # Statements of SQLAlchemy 2.1 type their rows as a variadic tuple, they match the untyped overload
+    @overload
+    def execute(self, stmt: TypedReturnsRows[R]) -> Result[R]: ...
+
+    @overload
+    def execute(self, stmt: Executable) -> Result[Any]: ...
+
+    def execute(self, stmt: Executable) -> Result[Any]:
         """
         Execute a statement in the current session
 
@@ -182,20 +351,51 @@ class DbSession:
         """
         return self._retry(self.session.begin)
 
+    def _failover(self) -> None:
+        """
+        Replace the session with one on the fallback engine
+        """
+        if self._fallback_engine is None:
+            return
+
+        if self._on_failover is not None:
+            self._on_failover()
+
+        self.session.close()
+        self._engine = self._fallback_engine
+        self._fallback_engine = None
+        self.session = Session(self._engine, expire_on_commit=False)
+
     def _retry(self, f: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
         """
         Retry a function call in case of database errors
         """
+        breaker = get_circuit_breaker()
         backoff = self._retry_backoff
         attempt = 0
 
         while True:
+            breaker.before_call()
             try:
-                return f(*args, **kwargs)
+                result = f(*args, **kwargs)
+                breaker.record_success()
+                return result
             except PendingRollbackError as e:
+                breaker.record_success()
                 logger.warning("Retrying operation due to PendingRollbackError: %s", e)
                 self.session.rollback()
             except OperationalError as e:
+                if self._fallback_engine is not None:
+                    breaker.record_success()
+                    logger.warning("Database connection failed, switching to fallback engine: %s", e)
+                    old_session = self.session
+                    self._failover()
+                    # f is usually a bound method of the session that was just replaced
+                    if getattr(f, "__self__", None) is old_session:
+                        f = getattr(self.session, f.__name__)
+                    continue
+
+                breaker.record_failure()
                 attempt += 1
                 Log.event(
                     logger,
@@ -205,7 +405,10 @@ class DbSession:
                     retry_attempt=attempt,
                     backoff_seconds=backoff[0] if backoff else 0,
                 )
+                if breaker.state == CircuitState.OPEN:
+                    raise DatabaseUnavailableError() from e
             except DataError as e:
+                breaker.record_success()
                 Log.event(
                     logger,
                     Log.DB_SCHEMA_ERROR,
@@ -215,9 +418,11 @@ class DbSession:
                 )
                 raise
             except DatabaseError:
+                breaker.record_success()
                 logger.exception("Database error during operation")
                 raise
             except Exception:
+                breaker.record_success()
                 logger.exception("Unexpected error during operation")
                 raise
 
@@ -225,6 +430,10 @@ class DbSession:
                 logger.error("Operation failed after all retries")
                 raise DatabaseError("Operation failed after all retries", None, BaseException())
 
+            if self._retry_budget is not None and not self._retry_budget.spend(backoff[0]):
+                logger.error("Operation failed, retry budget of the request is exhausted")
+                raise DatabaseUnavailableError()
+
             logger.info("Retrying operation in %s seconds", backoff[0])
             sleep(backoff[0] + random.uniform(0, 0.1))
             backoff = backoff[1:]
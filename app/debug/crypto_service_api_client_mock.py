@@ -1,3 +1,5 @@
+from typing import List, Sequence, Tuple
+
 from app.models.pseudonym import PseudonymResponse
 from app.services.crypto_service_api_client import CryptoServiceApiClient
 
@@ -13,5 +15,13 @@ class CryptoServiceApiClientMock(CryptoServiceApiClient):
             iv="abcdefghijklmnop",
         )
 
+    def exchange_many(
+        self, tokens: Sequence[Tuple[str, str]], label: str, mechanism: str
+    ) -> List[PseudonymResponse | Exception]:
+        return [self.exchange(jwe, blind_factor, label, mechanism) for jwe, blind_factor in tokens]
+
+    def close(self) -> None:
+        pass
+
     def is_healthy(self) -> bool:
         return True
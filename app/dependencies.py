@@ -1,9 +1,11 @@
-from typing import Any
+from typing import Annotated, Any, AsyncIterator
 
 import inject
+from fastapi import Depends
 
 from app.config import Config
 from app.db.db import Database
+from app.db.session import DbSession
 from app.services.auth.header import AuthHeaderService
 from app.services.crypto_service_api_client import CryptoServiceApiClient
 from app.services.fhir.bundle import BundleService
@@ -21,6 +23,18 @@ def get_database() -> Database:
     return inject.instance(Database)
 
 
+async def get_request_db_session(
+    database: Annotated[Database, Depends(get_database)],
+) -> AsyncIterator[DbSession]:
+    """
+    Request scoped unit of work: services share this DbSession for the duration of the request. Its connection
+    is returned to the pool before crypto service exchanges, see Database.release_request_session(). This is an
+    async dependency on purpose, the context variable it sets must be visible to the (threadpool) endpoint.
+    """
+    with database.request_session() as session:
+        yield session
+
+
 def get_referral_service() -> ReferralService:
     return inject.instance(ReferralService)
 
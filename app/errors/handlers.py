@@ -15,6 +15,8 @@ from app.models.fhir.resources.operation_outcome.resource import (
 )
 from app.services.exceptions import (
     ConflictError,
+    CryptoServiceUnavailableError,
+    DatabaseUnavailableError,
     ForbiddedError,
     InvalidHeaderPropertyError,
     InvalidKeyInfoError,
@@ -30,9 +32,11 @@ logger = logging.getLogger(__name__)
 def _failure_event_for(request: Request, status_code: int) -> NVIEvent | None:
     path = request.url.path
     method = request.method
-    if method == "POST" and (path.endswith("/registrations") or path.endswith("/fhir/List")):
+    if method == "POST" and (
+        path.endswith("/registrations") or path.endswith("/registrations/batch") or path.endswith("/fhir/List")
+    ):
         return Log.REFERRAL_REGISTRATION_FAILED
-    localize_failed_rest = method == "POST" and path.endswith("/localize")
+    localize_failed_rest = method == "POST" and (path.endswith("/localize") or path.endswith("/localize/batch"))
     localize_failed_fhir = (
         method == "GET" and path.endswith("/fhir/List") and request.query_params.get(SUBJECT_IDENTIFIER_PARAM)
     )
@@ -128,6 +132,34 @@ def handle_forbidden_error(req: Request, exc: ForbiddedError) -> JSONResponse:
     return JSONResponse(status_code=status_code, content=str(exc))
 
 
+def handle_database_unavailable_error(req: Request, exc: DatabaseUnavailableError) -> JSONResponse:
+    path = req.url.path
+    status_code = 503
+    if "fhir" in path:
+        fhir_error = FHIRError(severity="error", code="transient", msg=str(exc))
+        return JSONResponse(
+            status_code=status_code,
+            content=fhir_error.outcome.model_dump(exclude_none=True),
+            headers=fhir_error.headers,
+        )
+
+    return JSONResponse(status_code=status_code, content=str(exc))
+
+
+def handle_crypto_service_unavailable_error(req: Request, exc: CryptoServiceUnavailableError) -> JSONResponse:
+    path = req.url.path
+    status_code = 503
+    if "fhir" in path:
+        fhir_error = FHIRError(severity="error", code="transient", msg=str(exc))
+        return JSONResponse(
+            status_code=status_code,
+            content=fhir_error.outcome.model_dump(exclude_none=True),
+            headers=fhir_error.headers,
+        )
+
+    return JSONResponse(status_code=status_code, content=str(exc))
+
+
 def handle_invalid_key_info_error(req: Request, exc: InvalidKeyInfoError) -> JSONResponse:
     path = req.url.path
     status_code = 503
@@ -257,6 +289,8 @@ def register_exceptions(app: FastAPI) -> None:
     app.add_exception_handler(PseudonymError, handle_pseudonym_decoding_error)
     app.add_exception_handler(ConflictError, handle_conflict_error)
     app.add_exception_handler(InvalidHeaderPropertyError, handle_invalid_header_property_error)
+    app.add_exception_handler(DatabaseUnavailableError, handle_database_unavailable_error)
+    app.add_exception_handler(CryptoServiceUnavailableError, handle_crypto_service_unavailable_error)
 
     app.add_exception_handler(RequestValidationError, handle_request_validation_exception)
     app.add_exception_handler(ValueError, handle_value_error)
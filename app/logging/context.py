@@ -1,7 +1,21 @@
-from contextvars import ContextVar
+from contextvars import Context, ContextVar
 
 request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
 ip_var: ContextVar[str] = ContextVar("ip", default="-")
 client_trace_id_var: ContextVar[str] = ContextVar("client_trace_id", default="-")
 endpoint_var: ContextVar[str] = ContextVar("endpoint", default="-")
 method_var: ContextVar[str] = ContextVar("method", default="-")
+
+_LOG_CONTEXT_VARS = (request_id_var, ip_var, client_trace_id_var, endpoint_var, method_var)
+
+
+def copy_log_context() -> Context:
+    """
+    Returns a context holding only the log fields of the current one, for work handed to another thread. Unlike
+    contextvars.copy_context() it leaves out the request scoped database session, which must not be shared.
+    """
+    values = [(var, var.get()) for var in _LOG_CONTEXT_VARS]
+    context = Context()
+    for var, value in values:
+        context.run(var.set, value)
+    return context
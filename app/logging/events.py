@@ -1,5 +1,5 @@
 import logging
-from collections.abc import Mapping
+from collections.abc import Iterable, Mapping
 from dataclasses import dataclass, field
 from typing import Any
 
@@ -63,6 +63,18 @@ class Log:
             _APP: ("exception_type", "table", "column", "value_length", "column_limit"),
         },
     )
+    DB_CIRCUIT_STATE_CHANGED = NVIEvent(  # NVI-SYS-006
+        "100606",
+        logging.WARNING,
+        (_APP, _SIEM),
+        {_APP: ("previous_state", "state", "failure_count"), _SIEM: ("previous_state", "state")},
+    )
+    CRYPTO_CIRCUIT_STATE_CHANGED = NVIEvent(  # NVI-SYS-007
+        "100607",
+        logging.WARNING,
+        (_APP, _SIEM),
+        {_APP: ("previous_state", "state", "failure_count"), _SIEM: ("previous_state", "state")},
+    )
 
     ACCESS_REQUEST = NVIEvent(  # NVI-AUTH-101
         "094500",
@@ -186,3 +198,19 @@ class Log:
             extra["field_streams"] = event.fields
         extra.update(fields)
         logger.log(event.level, message, extra=extra, exc_info=exc_info)
+
+    @staticmethod
+    def events(
+        logger: logging.Logger,
+        event: NVIEvent,
+        message: str,
+        records: Iterable[Mapping[str, Any]],
+    ) -> None:
+        """
+        Logs the event once per record, e.g. for every item of a batch request, checking the log level only once
+        """
+        if not logger.isEnabledFor(event.level):
+            return
+
+        for fields in records:
+            Log.event(logger, event, message, **fields)
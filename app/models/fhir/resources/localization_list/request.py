@@ -1,5 +1,7 @@
 import logging
-from typing import Any
+from datetime import datetime
+from typing import Any, Tuple
+from uuid import UUID
 
 from fastapi import Query
 from pydantic import BaseModel, field_validator
@@ -9,6 +11,7 @@ from app.models.fhir.resources.data import (
     DEVICE_SYSTEM,
     PSEUDONYM_SYSTEM,
 )
+from app.utils.fhir import decode_url_safe_token, encode_url_safe_token
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +19,18 @@ logger = logging.getLogger(__name__)
 SUBJECT_IDENTIFIER_PARAM = "subject:identifier"
 DEVICE_IDENTIFIER_PARAM = "source:identifier"
 CODE_PARAM = "code"
+COUNT_PARAM = "_count"
+CURSOR_PARAM = "_cursor"
+MAX_PAGE_COUNT = 1000
+
+
+def encode_cursor(created_at: datetime, id: UUID) -> str:
+    return encode_url_safe_token({"created_at": created_at.isoformat(), "id": str(id)})
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    data = decode_url_safe_token(cursor)
+    return datetime.fromisoformat(data["created_at"]), UUID(data["id"])
 
 
 def _create_openapi_examples(system: str) -> dict[str, Any]:
@@ -52,6 +67,18 @@ class LocalizationListParams(BaseModel):
         openapi_examples=_create_openapi_examples(DEVICE_SYSTEM),
         default=None,
     )
+    count: int | None = Query(
+        alias=COUNT_PARAM,
+        description="Page size, returns a page of the URA-wide listing with a next link instead of streaming it",
+        default=None,
+        ge=1,
+        le=MAX_PAGE_COUNT,
+    )
+    cursor: str | None = Query(
+        alias=CURSOR_PARAM,
+        description="Opaque position in the listing, taken from the next link of the previous page",
+        default=None,
+    )
 
     @field_validator("subject", mode="before")
     @classmethod
@@ -82,6 +109,20 @@ class LocalizationListParams(BaseModel):
             return None
         return identifier.value
 
+    @field_validator("cursor", mode="before")
+    @classmethod
+    def validate_cursor(cls, value: str | None) -> str | None:
+        if value is None:
+            return None
+        try:
+            decode_cursor(value)
+        except Exception:
+            raise ValueError("Invalid cursor")
+        return value
+
+    def after(self) -> Tuple[datetime, UUID] | None:
+        return decode_cursor(self.cursor) if self.cursor is not None else None
+
     def empty(self) -> bool:
         return self.subject is None and self.source is None
 
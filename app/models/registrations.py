@@ -1,7 +1,8 @@
 from datetime import datetime
+from enum import Enum
 from typing import Any, List, Self, Sequence
 
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 
 from app.db.models.referral import ReferralEntity
 from app.models.ura import UraNumber
@@ -20,6 +21,18 @@ class LocalizeRequest(RegistrationQueryParams):
     pass
 
 
+MAX_REGISTRATION_BATCH_SIZE = 10000
+MAX_LOCALIZE_BATCH_SIZE = 10000
+
+
+class CreateRegistrationBatchRequest(BaseModel):
+    registrations: List[CreateRegistrationRequest] = Field(min_length=1, max_length=MAX_REGISTRATION_BATCH_SIZE)
+
+
+class LocalizeBatchRequest(BaseModel):
+    localizations: List[LocalizeRequest] = Field(min_length=1, max_length=MAX_LOCALIZE_BATCH_SIZE)
+
+
 class Registration(BaseModel):
     ura_number: str
     source_id: str
@@ -53,3 +66,61 @@ class RegistrationList(BaseModel):
         data = [Registration.from_entity(r) for r in refrrals]
         total = len(refrrals)
         return cls(registrations=data, total=total)
+
+
+class RegistrationBatchStatus(str, Enum):
+    CREATED = "created"
+    DUPLICATE = "duplicate"
+    INVALID = "invalid"
+
+
+class RegistrationBatchItem(BaseModel):
+    index: int
+    status: RegistrationBatchStatus
+    registration: Registration | None = None
+    error: str | None = None
+
+
+class RegistrationBatchResult(BaseModel):
+    results: List[RegistrationBatchItem]
+    created: int
+    duplicates: int
+    invalid: int
+
+    @classmethod
+    def from_items(cls, items: List[RegistrationBatchItem]) -> Self:
+        return cls(
+            results=items,
+            created=sum(1 for i in items if i.status == RegistrationBatchStatus.CREATED),
+            duplicates=sum(1 for i in items if i.status == RegistrationBatchStatus.DUPLICATE),
+            invalid=sum(1 for i in items if i.status == RegistrationBatchStatus.INVALID),
+        )
+
+
+class LocalizeBatchStatus(str, Enum):
+    FOUND = "found"
+    NO_MATCH = "no-match"
+    INVALID = "invalid"
+
+
+class LocalizeBatchItem(BaseModel):
+    index: int
+    status: LocalizeBatchStatus
+    registrations: List[Registration] = Field(default_factory=list)
+    error: str | None = None
+
+
+class LocalizeBatchResult(BaseModel):
+    results: List[LocalizeBatchItem]
+    found: int
+    no_match: int
+    invalid: int
+
+    @classmethod
+    def from_items(cls, items: List[LocalizeBatchItem]) -> Self:
+        return cls(
+            results=items,
+            found=sum(1 for i in items if i.status == LocalizeBatchStatus.FOUND),
+            no_match=sum(1 for i in items if i.status == LocalizeBatchStatus.NO_MATCH),
+            invalid=sum(1 for i in items if i.status == LocalizeBatchStatus.INVALID),
+        )
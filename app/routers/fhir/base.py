@@ -23,18 +23,10 @@ def register(
     localisation_list_service: BundleService = Depends(get_bundle_service),
 ) -> Any:
     ctx: AuthContext = request.state.auth
-    results_bundle = Bundle[Any](entry=[])
     valid_bundle = localisation_list_service.validate_localization_bundle_structure(data)
     if not valid_bundle:
         raise InvalidModelError("Bundle.entry is invalid")
-    for i, entry in enumerate(data.entry):
-        result = localisation_list_service.process_entry(
-            ctx=ctx,
-            entry=entry,
-            index=i,
-        )
-        results_bundle.entry.append(result)
-    return results_bundle
+    return Bundle[Any](entry=localisation_list_service.process_entries(ctx, data))
 
 
 @router.get(
@@ -5,6 +5,7 @@ from uuid import UUID
 from fastapi import APIRouter, Body, Depends, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.params import Query
+from fastapi.responses import StreamingResponse
 
 from app.dependencies import (
     get_localization_list_service,
@@ -234,7 +235,9 @@ def get(
         f"Retrieves a Bundle containing List resources based on query params. "
         f"Localization for a specific pseudonym can be done by specifying only {SUBJECT_IDENTIFIER_PARAM}. "
         "The code query parameter for data domain is deprecated and ignored by this router. "
-        "Any other combination will return List resource specific to the URA Number of the requester"
+        "Any other combination will return List resource specific to the URA Number of the requester. "
+        "That listing is streamed, unless _count is given: then a page is returned with a next link "
+        "to the following page."
     ),
     response_class=FHIRJSONResponse,
     responses={
@@ -306,7 +309,53 @@ def query(
         raise UnauthorizedScopeError(scopes=ctx.scope, required_scope=AuthorizationScope.LOCALIZE)
 
     authorized_ura = ctx.claims.ura_number
-    return service.query(params, authorized_ura, organization_name=ctx.claims.organization_name)
+    if not params.is_localize_params() and params.count is None:
+        return StreamingResponse(
+            service.query_stream(params, authorized_ura, organization_name=ctx.claims.organization_name),
+            media_type=FHIRJSONResponse.media_type,
+        )
+
+    return service.query(
+        params,
+        authorized_ura,
+        organization_name=ctx.claims.organization_name,
+        base_url=str(request.url.replace(query="")),
+    )
+
+
+@router.get(
+    "/_bulk-delete/{job_id}",
+    name="bulk_delete_status",
+    summary="Get the status of a background delete",
+    description=(
+        "Status of a delete of List resources that runs in the background, returns 202 while it is running. "
+        "The status is kept in memory by the worker that started the delete: it is only found on that worker, "
+        "for an hour after the delete finished, and is lost when the worker restarts. A 404 does not mean the "
+        "delete failed, the remaining resources can be checked with a query."
+    ),
+    response_class=FHIRJSONResponse,
+    responses={
+        200: {"model": OperationOutcome},
+        202: {"model": OperationOutcome},
+        403: {"model": OperationOutcome},
+        404: {"model": OperationOutcome},
+        500: {"model": OperationOutcome},
+    },
+)
+def bulk_delete_status(
+    job_id: UUID,
+    request: Request,
+    service: Annotated[LocalizationListService, Depends(get_localization_list_service)],
+) -> Any:
+    ctx: AuthContext = request.state.auth
+    if AuthorizationScope.DELETE not in ctx.scope:
+        raise UnauthorizedScopeError(scopes=ctx.scope, required_scope=AuthorizationScope.DELETE)
+
+    outcome, status_code = service.bulk_delete_status(job_id, ctx.claims.ura_number)
+    return FHIRJSONResponse(
+        status_code=status_code,
+        content=jsonable_encoder(outcome.model_dump(exclude_none=True)),
+    )
 
 
 @router.delete(
@@ -350,6 +399,10 @@ def delete(
     status_code=201,
     responses={
         201: {"description": "Resources have been deleted successfully"},
+        202: {
+            "description": "Deletion runs in the background, poll the Content-Location url for its status. "
+            "The status is only known to the worker that started the delete, see the status endpoint"
+        },
         400: {"model": OperationOutcome},
         403: {"model": OperationOutcome},
         404: {"model": OperationOutcome},
@@ -372,6 +425,15 @@ def delete_for_query(
         raise UnauthorizedManagingRequestError()
 
     authenticated_ura = ctx.claims.ura_number
+    job = service.schedule_delete_by_query(params, authenticated_ura, organization_name=ctx.claims.organization_name)
+    if job is not None:
+        outcome = OperationOutcome.make_good_outcome(f"Deletion of the resources has been scheduled as job {job.id}")
+        return FHIRJSONResponse(
+            status_code=202,
+            content=jsonable_encoder(outcome.model_dump(exclude_none=True)),
+            headers={"Content-Location": str(request.url_for("bulk_delete_status", job_id=job.id))},
+        )
+
     outcome, status_code = service.delete_by_query(
         params, authenticated_ura, organization_name=ctx.claims.organization_name
     )
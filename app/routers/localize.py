@@ -1,5 +1,5 @@
 import logging
-from typing import Annotated, Any
+from typing import Annotated, Any, Dict, List
 
 from fastapi import APIRouter, Body, Depends, Request
 
@@ -11,8 +11,15 @@ from app.dependencies import (
 from app.logging.events import Log
 from app.models.auth.context import AuthContext
 from app.models.auth.data import AuthorizationScope
-from app.models.pseudonym import EncryptedPseudonym
-from app.models.registrations import LocalizeRequest, Registration
+from app.models.pseudonym import EncryptedPseudonym, PseudonymResponse
+from app.models.registrations import (
+    LocalizeBatchItem,
+    LocalizeBatchRequest,
+    LocalizeBatchResult,
+    LocalizeBatchStatus,
+    LocalizeRequest,
+    Registration,
+)
 from app.services.crypto_service_api_client import CryptoServiceApiClient
 from app.services.exceptions import UnauthorizedScopeError
 from app.services.key_info import KeyInfoService
@@ -43,7 +50,7 @@ def localize(
     )
     encrypted_pseudonym = EncryptedPseudonym.from_response(pseudonym_resp)
 
-    results = referral_service.get_many(encrypted_pseudonym=encrypted_pseudonym)
+    results = referral_service.get_many(encrypted_pseudonym=encrypted_pseudonym, requesting_ura=ctx.claims.ura_number)
 
     ura_number = str(ctx.claims.ura_number)
     if results:
@@ -66,3 +73,71 @@ def localize(
         )
 
     return [Registration.from_entity(r) for r in results]
+
+
+@router.post("/batch")
+def localize_batch(
+    request: Request,
+    data: Annotated[LocalizeBatchRequest, Body()],
+    referral_service: Annotated[ReferralService, Depends(get_referral_service)],
+    crypto_client: Annotated[CryptoServiceApiClient, Depends(get_crypto_service_api_client)],
+    key_info_service: Annotated[KeyInfoService, Depends(get_key_info_service)],
+) -> LocalizeBatchResult:
+    """
+    Localizes many pseudonyms at once with one active key lookup, one batched exchange and one database query.
+    Results are returned per input index.
+    """
+    ctx: AuthContext = request.state.auth
+    if AuthorizationScope.LOCALIZE not in ctx.scope:
+        raise UnauthorizedScopeError(ctx.scope, AuthorizationScope.LOCALIZE)
+
+    active_key = key_info_service.get_active_key()
+    exchanged = crypto_client.exchange_many(
+        [(item.pseudonym, item.oprf_key) for item in data.localizations],
+        label=active_key.label,
+        mechanism=active_key.mechanism,
+    )
+
+    items: Dict[int, LocalizeBatchItem] = {}
+    pseudonyms: Dict[int, PseudonymResponse] = {}
+    for index, result in enumerate(exchanged):
+        if isinstance(result, PseudonymResponse):
+            pseudonyms[index] = result
+        elif isinstance(result, ValueError):
+            items[index] = LocalizeBatchItem(index=index, status=LocalizeBatchStatus.INVALID, error=str(result))
+        else:
+            # The crypto service itself failed, same as for a single localization
+            raise result
+
+    encrypted_pseudonyms = {index: EncryptedPseudonym.from_response(p) for index, p in pseudonyms.items()}
+    referrals = referral_service.get_many_by_pseudonyms(
+        list(encrypted_pseudonyms.values()), requesting_ura=ctx.claims.ura_number
+    )
+
+    ura_number = str(ctx.claims.ura_number)
+    found: List[Dict[str, Any]] = []
+    no_match: List[Dict[str, Any]] = []
+    for index, encrypted_pseudonym in encrypted_pseudonyms.items():
+        results = referrals.get(encrypted_pseudonym.value, [])
+        if results:
+            items[index] = LocalizeBatchItem(
+                index=index,
+                status=LocalizeBatchStatus.FOUND,
+                registrations=[Registration.from_entity(r) for r in results],
+            )
+            found.append(
+                {
+                    "organization": ctx.claims.organization_name,
+                    "ura_number": ura_number,
+                    "pseudonym_hash": str(pseudonyms[index]),
+                    "result_count": len(results),
+                }
+            )
+        else:
+            items[index] = LocalizeBatchItem(index=index, status=LocalizeBatchStatus.NO_MATCH)
+            no_match.append({"ura_number": ura_number, "result_count": 0})
+
+    Log.events(logger, Log.LOCALIZATION_SUCCESS, "Localization succeeded", found)
+    Log.events(logger, Log.LOCALIZATION_NO_MATCH, "Localization returned no match", no_match)
+
+    return LocalizeBatchResult.from_items([items[index] for index in range(len(data.localizations))])
@@ -1,5 +1,5 @@
 import logging
-from typing import Annotated, Any
+from typing import Annotated, Any, List
 
 from fastapi import APIRouter, Body, Depends, Query, Request, Response
 
@@ -13,8 +13,12 @@ from app.models.auth.context import AuthContext
 from app.models.auth.data import AuthorizationScope
 from app.models.pseudonym import EncryptedPseudonym
 from app.models.registrations import (
+    CreateRegistrationBatchRequest,
     CreateRegistrationRequest,
     Registration,
+    RegistrationBatchItem,
+    RegistrationBatchResult,
+    RegistrationBatchStatus,
     RegistrationList,
     RegistrationQueryParams,
 )
@@ -100,6 +104,71 @@ def add_registration(
     return Registration.from_entity(new_referral)
 
 
+@router.post("/batch")
+def add_registration_batch(
+    data: Annotated[CreateRegistrationBatchRequest, Body()],
+    request: Request,
+    referral_service: Annotated[ReferralService, Depends(get_referral_service)],
+    key_info_service: Annotated[KeyInfoService, Depends(get_key_info_service)],
+    crypto_client: Annotated[CryptoServiceApiClient, Depends(get_crypto_service_api_client)],
+) -> RegistrationBatchResult:
+    ctx: AuthContext = request.state.auth
+    if AuthorizationScope.CREATE not in ctx.scope:
+        raise UnauthorizedScopeError(ctx.scope, AuthorizationScope.CREATE)
+
+    if ctx.claims.source_id is None:
+        raise InvalidModelError("source_id is required to complete transaction")
+
+    active_key = key_info_service.get_active_key()
+
+    items: List[RegistrationBatchItem | None] = []
+    exchanged: List[EncryptedPseudonym] = []
+    for index, registration in enumerate(data.registrations):
+        try:
+            pseudonym_resp = crypto_client.exchange(
+                jwe=registration.pseudonym,
+                blind_factor=registration.oprf_key,
+                label=active_key.label,
+                mechanism=active_key.mechanism,
+            )
+        except ValueError as e:
+            items.append(RegistrationBatchItem(index=index, status=RegistrationBatchStatus.INVALID, error=str(e)))
+            continue
+
+        items.append(None)
+        exchanged.append(EncryptedPseudonym.from_response(pseudonym_resp))
+
+    referrals = iter(
+        referral_service.add_many(
+            encrypted_pseudonyms=exchanged,
+            ura_number=ctx.claims.ura_number,
+            source=ctx.claims.source_id,
+            organization_name=ctx.claims.organization_name,
+            key_id=active_key.id,
+        )
+    )
+
+    results: List[RegistrationBatchItem] = []
+    for index, item in enumerate(items):
+        if item is not None:
+            results.append(item)
+            continue
+
+        referral = next(referrals)
+        if referral is None:
+            results.append(RegistrationBatchItem(index=index, status=RegistrationBatchStatus.DUPLICATE))
+        else:
+            results.append(
+                RegistrationBatchItem(
+                    index=index,
+                    status=RegistrationBatchStatus.CREATED,
+                    registration=Registration.from_entity(referral),
+                )
+            )
+
+    return RegistrationBatchResult.from_items(results)
+
+
 @router.delete("")
 def delete_registration(
     params: Annotated[RegistrationQueryParams, Query()],
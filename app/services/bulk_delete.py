@@ -0,0 +1,103 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+from time import monotonic
+from typing import Dict
+from uuid import UUID, uuid4
+
+from app.logging.events import Log
+from app.models.ura import UraNumber
+from app.services.exceptions import NotFoundError
+from app.services.referral_service import ReferralService
+
+logger = logging.getLogger(__name__)
+
+# Seconds a finished job stays available for polling
+FINISHED_JOB_RETENTION = 3600
+
+
+class BulkDeleteStatus(str, Enum):
+    IN_PROGRESS = "in-progress"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+@dataclass
+class BulkDeleteJob:
+    id: UUID
+    ura_number: UraNumber
+    source: str | None
+    status: BulkDeleteStatus = BulkDeleteStatus.IN_PROGRESS
+    deleted_count: int = 0
+    finished_at: float | None = None
+
+
+class BulkDeleteService:
+    """
+    Runs chunked deletes of all referrals of a URA in the background. Jobs are kept in memory, so their status
+    can only be polled on the worker that started them.
+    """
+
+    def __init__(self, referral_service: ReferralService, chunk_size: int, max_workers: int = 1) -> None:
+        self.referral_service = referral_service
+        self.chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bulk-delete")
+        self._jobs: Dict[UUID, BulkDeleteJob] = {}
+        self._lock = threading.Lock()
+
+    def start(self, ura_number: UraNumber, organization_name: str, source: str | None = None) -> BulkDeleteJob:
+        job = BulkDeleteJob(id=uuid4(), ura_number=ura_number, source=source)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, organization_name)
+        return job
+
+    def get(self, id: UUID, ura_number: UraNumber) -> BulkDeleteJob:
+        """
+        Returns the job, a job of another URA is reported as not found
+        """
+        job = self._jobs.get(id)
+        if job is None or job.ura_number != ura_number:
+            raise NotFoundError()
+
+        return job
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: BulkDeleteJob, organization_name: str) -> None:
+        def on_progress(deleted_count: int) -> None:
+            job.deleted_count = deleted_count
+
+        try:
+            self.referral_service.delete_many_chunked(
+                ura_number=job.ura_number,
+                chunk_size=self.chunk_size,
+                source=job.source,
+                on_progress=on_progress,
+            )
+            job.status = BulkDeleteStatus.COMPLETED
+        except Exception:
+            logger.exception("Background delete %s failed after %d referrals", job.id, job.deleted_count)
+            job.status = BulkDeleteStatus.FAILED
+        finally:
+            job.finished_at = monotonic()
+
+        if job.deleted_count > 0:
+            Log.event(
+                logger,
+                Log.ALL_URA_REFERRALS_DELETED,
+                "All URA referrals deleted",
+                organization=organization_name,
+                ura_number=str(job.ura_number),
+                deleted_count=job.deleted_count,
+            )
+
+    def _prune(self) -> None:
+        expired = monotonic() - FINISHED_JOB_RETENTION
+        for id in [id for id, job in self._jobs.items() if job.finished_at is not None and job.finished_at < expired]:
+            del self._jobs[id]
@@ -1,30 +1,174 @@
 import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from json import JSONDecodeError
+from time import monotonic
+from typing import Any, Callable, List, Sequence, Tuple
 
+from requests import Response
 from requests.exceptions import ConnectionError, HTTPError, Timeout
 
 from app.config import ConfigCryptoServiceApi
+from app.db.session import CircuitBreaker
+from app.logging.events import Log
 from app.models.pseudonym import PseudonymResponse
+from app.services.exceptions import CryptoServiceUnavailableError
+from app.services.hedging import HedgePolicy
 from app.services.http import HttpService
+from app.stats import get_stats
 
 logger = logging.getLogger(__name__)
 
+# Responses of a crypto service without batch support to a multi-item request
+BATCH_UNSUPPORTED_STATUS = (404, 405, 415)
+# Response to a batch the crypto service could not validate, its items are exchanged one by one instead
+BATCH_INVALID_STATUS = 422
+# Seconds before batches are tried again after the crypto service did not support them, it may have been upgraded
+BATCH_RETRY_INTERVAL = 300
+
 
 class CryptoServiceApiClient:
-    def __init__(self, config: ConfigCryptoServiceApi) -> None:
+    """
+    Exchanges go through a circuit breaker, which fails fast with a CryptoServiceUnavailableError after
+    consecutive failed requests, and a bulkhead of max_in_flight concurrent requests, so a slow crypto service
+    cannot hold every worker thread
+    """
+
+    _hedge: HedgePolicy | None = None
+    _breaker: CircuitBreaker | None = None
+    _bulkhead: threading.BoundedSemaphore | None = None
+    _bulkhead_timeout = 0.0
+    _hedge_executor: ThreadPoolExecutor | None = None
+    _before_exchange: Callable[[], None] | None = None
+
+    def __init__(self, config: ConfigCryptoServiceApi, before_exchange: Callable[[], None] | None = None) -> None:
+        """
+        :param before_exchange: called before the requests of an exchange are sent, to release the database
+            connection of the request while it waits on the crypto service
+        """
+        self._before_exchange = before_exchange
         self._http = HttpService(
-            endpoint=config.endpoint,
+            endpoint=config.all_endpoints(),
             timeout=config.timeout,
+            connect_timeout=config.connect_timeout,
             mtls_cert=config.mtls_cert,
             mtls_key=config.mtls_key,
             verify_ca=config.verify_ca,
+            pool_size=config.pool_size,
+            keep_alive=config.keep_alive,
+            max_retries=config.max_retries,
+            eject_after_failures=config.eject_after_failures,
+            health_route="health",
+            probe_interval=config.probe_interval,
+        )
+        self._breaker = CircuitBreaker(
+            failure_threshold=config.circuit_breaker_failure_threshold,
+            reset_timeout=config.circuit_breaker_reset_timeout,
+            unavailable_error=CryptoServiceUnavailableError,
+            event=Log.CRYPTO_CIRCUIT_STATE_CHANGED,
+            name="Crypto service",
+        )
+        self._bulkhead = threading.BoundedSemaphore(config.max_in_flight)
+        self._bulkhead_timeout = config.bulkhead_timeout
+        self._batch_size = config.exchange_batch_size
+        self._batches_disabled_until = 0.0
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.exchange_concurrency, thread_name_prefix="crypto-exchange"
         )
+        if config.hedge_percentile is not None:
+            self._hedge = HedgePolicy(
+                percentile=config.hedge_percentile,
+                min_delay=config.hedge_min_delay,
+                budget_percent=config.hedge_budget_percent,
+            )
+            # Both requests of a hedged exchange run here, the bulkhead bounds how many are in flight
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=config.max_in_flight, thread_name_prefix="crypto-hedge"
+            )
 
     def exchange(self, jwe: str, blind_factor: str, label: str, mechanism: str) -> PseudonymResponse:
+        if self._before_exchange is not None:
+            self._before_exchange()
+        if self._hedge is None or self._hedge_executor is None:
+            return self._exchange_once(jwe, blind_factor, label, mechanism)
+
+        return self._exchange_hedged(self._hedge, self._hedge_executor, jwe, blind_factor, label, mechanism)
+
+    def _exchange_hedged(
+        self,
+        hedge: HedgePolicy,
+        executor: ThreadPoolExecutor,
+        jwe: str,
+        blind_factor: str,
+        label: str,
+        mechanism: str,
+    ) -> PseudonymResponse:
+        """
+        Sends the request and, when it has not answered within the hedge delay, a duplicate. The first successful
+        answer is used, the other request is left to finish in the background. Raises the error of the first
+        request when both fail.
+        """
+        hedge.record_request()
+
+        def timed_exchange() -> PseudonymResponse:
+            start = monotonic()
+            result = self._exchange_once(jwe, blind_factor, label, mechanism)
+            hedge.record_latency(monotonic() - start)
+            return result
+
+        primary = executor.submit(timed_exchange)
+        done, _ = wait([primary], timeout=hedge.delay())
+        if done or not hedge.try_acquire():
+            return primary.result()
+
+        get_stats().inc("crypto_service_api.hedge.fired")
+        secondary = executor.submit(timed_exchange)
+        done, _ = wait([primary, secondary], return_when=FIRST_COMPLETED)
+        first, other = (primary, secondary) if primary in done else (secondary, primary)
+        if first.exception() is None:
+            if first is secondary:
+                get_stats().inc("crypto_service_api.hedge.won")
+            return first.result()
+
+        if other.exception() is None:
+            return other.result()
+        return primary.result()
+
+    def _process(self, data: dict[str, Any] | list[Any]) -> Response:
+        """
+        Posts to the process route within the bulkhead and the circuit breaker. A client error counts as a
+        working crypto service.
+        """
+        bulkhead, breaker = self._bulkhead, self._breaker
+        if bulkhead is None or breaker is None:
+            return self._http.do_request(method="POST", sub_route="process", data=data)
+
+        if not bulkhead.acquire(timeout=self._bulkhead_timeout):
+            get_stats().inc("crypto_service_api.bulkhead.rejected")
+            raise CryptoServiceUnavailableError()
+
         try:
-            response = self._http.do_request(
-                method="POST",
-                sub_route="process",
+            breaker.before_call()
+            try:
+                response = self._http.do_request(method="POST", sub_route="process", data=data)
+            except HTTPError as e:
+                if e.response is not None and e.response.status_code < 500:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                raise
+            except Exception:
+                breaker.record_failure()
+                raise
+
+            breaker.record_success()
+            return response
+        finally:
+            bulkhead.release()
+
+    def _exchange_once(self, jwe: str, blind_factor: str, label: str, mechanism: str) -> PseudonymResponse:
+        try:
+            response = self._process(
                 data={
                     "jwe": jwe,
                     "blind_factor": blind_factor,
@@ -43,6 +187,105 @@ class CryptoServiceApiClient:
             logger.exception("Unexpected response from Crypto Service API")
             raise RuntimeError("Unexpected response from the Crypto Service API")
 
+    def exchange_many(
+        self, tokens: Sequence[Tuple[str, str]], label: str, mechanism: str
+    ) -> List[PseudonymResponse | Exception]:
+        """
+        Exchanges (jwe, blind_factor) pairs with multi-item requests to the process route. Falls back to single
+        exchanges, at most exchange_concurrency in parallel, when the crypto service does not support batches.
+
+        :return: a result per token in input order, the exception of a failed exchange instead of raising it
+        """
+        if self._before_exchange is not None:
+            self._before_exchange()
+        results: List[PseudonymResponse | Exception] = []
+        for offset in range(0, len(tokens), self._batch_size):
+            chunk = tokens[offset : offset + self._batch_size]
+            batch = (
+                self._exchange_batch(chunk, label, mechanism) if self._batch_supported() and len(chunk) > 1 else None
+            )
+            results.extend(batch if batch is not None else self._exchange_parallel(chunk, label, mechanism))
+
+        return results
+
+    def _exchange_batch(
+        self, chunk: Sequence[Tuple[str, str]], label: str, mechanism: str
+    ) -> List[PseudonymResponse | Exception] | None:
+        """
+        Returns None when the chunk has to be exchanged with single requests instead
+        """
+        try:
+            response = self._process(
+                data=[
+                    {"jwe": jwe, "blind_factor": blind_factor, "label": label, "mechanism": mechanism}
+                    for jwe, blind_factor in chunk
+                ],
+            )
+            data = response.json()
+        except CryptoServiceUnavailableError as e:
+            return [e for _ in chunk]
+        except (ConnectionError, Timeout):
+            logger.exception("Error during request to Crypto Service API")
+            return [ConnectionError("Failed to connect to the Crypto Service API") for _ in chunk]
+        except HTTPError as e:
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code in BATCH_UNSUPPORTED_STATUS:
+                self._disable_batches()
+                return None
+            if status_code == BATCH_INVALID_STATUS:
+                # One bad item fails the whole batch, exchanged on their own only that item fails
+                return None
+            if status_code is not None and status_code < 500:
+                return [ValueError("Invalid pseudonym or oprf_key") for _ in chunk]
+            # Sending every item again on its own would multiply the load on a failing crypto service
+            logger.exception("Error during request to Crypto Service API")
+            return [ConnectionError("The Crypto Service API failed to process the batch") for _ in chunk]
+        except JSONDecodeError:
+            self._disable_batches()
+            return None
+
+        if not isinstance(data, list) or len(data) != len(chunk):
+            self._disable_batches()
+            return None
+
+        return [self._batch_item(item) for item in data]
+
+    def _batch_supported(self) -> bool:
+        return monotonic() >= self._batches_disabled_until
+
+    def _disable_batches(self) -> None:
+        logger.warning(
+            "Crypto Service API does not support batch exchanges, using single exchanges for %d seconds",
+            BATCH_RETRY_INTERVAL,
+        )
+        self._batches_disabled_until = monotonic() + BATCH_RETRY_INTERVAL
+
+    @staticmethod
+    def _batch_item(item: Any) -> PseudonymResponse | Exception:
+        if isinstance(item, dict) and "error" in item:
+            return ValueError("Invalid pseudonym or oprf_key")
+        try:
+            return PseudonymResponse(**item)
+        except (TypeError, ValueError):
+            return RuntimeError("Unexpected response from the Crypto Service API")
+
+    def _exchange_parallel(
+        self, chunk: Sequence[Tuple[str, str]], label: str, mechanism: str
+    ) -> List[PseudonymResponse | Exception]:
+        def exchange_one(token: Tuple[str, str]) -> PseudonymResponse | Exception:
+            try:
+                return self.exchange(token[0], token[1], label, mechanism)
+            except Exception as e:
+                return e
+
+        return list(self._executor.map(exchange_one, chunk))
+
+    def close(self) -> None:
+        self._http.close()
+        self._executor.shutdown(wait=False)
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+
     def is_healthy(self) -> bool:
         try:
             response = self._http.do_request(method="GET", sub_route="health")
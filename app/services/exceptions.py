@@ -30,6 +30,16 @@ class KeyInfoPropertyError(Exception):
         super().__init__("property `has_referrals` cannot be accessed outside a database Session")
 
 
+class DatabaseUnavailableError(Exception):
+    def __init__(self) -> None:
+        super().__init__("Database temporarily unavailable")
+
+
+class CryptoServiceUnavailableError(Exception):
+    def __init__(self) -> None:
+        super().__init__("Crypto service temporarily unavailable")
+
+
 class UnauthorizedError(Exception):
     pass
 
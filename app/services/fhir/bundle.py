@@ -1,12 +1,15 @@
 import logging
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Set
 
+from app.logging.context import copy_log_context
 from app.logging.events import Log
 from app.models.auth.context import AuthContext
 from app.models.auth.data import AuthorizationScope
 from app.models.fhir.bundle import Bundle, BundleEntry, EntryRequestDto, EntryResponse
 from app.models.fhir.resources.localization_list.request import LocalizationListParams
 from app.models.fhir.resources.localization_list.resource import LocalizationList
+from app.models.pseudonym import EncryptedPseudonym, PseudonymResponse
 from app.services.auth.auth_context import AuthContextService
 from app.services.exceptions import (
     ConflictError,
@@ -25,10 +28,211 @@ class BundleService:
     def __init__(
         self,
         localisation_list_service: LocalizationListService,
+        concurrency: int = 1,
     ) -> None:
+        """
+        :param concurrency: entries processed in parallel, 1 processes them one after the other
+        """
         self.localizaton_list_service = localisation_list_service
+        self._executor = (
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bundle-entry") if concurrency > 1 else None
+        )
+
+    def process_entries(self, ctx: AuthContext, bundle: Bundle[Any]) -> List[BundleEntry[Any]]:
+        """
+        Processes all entries of the bundle and returns their results in entry order. With a concurrency above 1
+        independent entries run in parallel, see lanes() for which entries are kept in order.
+        """
+        pseudonyms = self.exchange_entries(ctx, bundle.entry)
+        queried = self.query_entries(ctx, bundle.entry, pseudonyms)
+        if self._executor is None or len(bundle.entry) < 2:
+            return [
+                self.process_entry(ctx, entry, index, pseudonyms[index], queried.get(index))
+                for index, entry in enumerate(bundle.entry)
+            ]
+
+        results: List[BundleEntry[Any] | None] = [None] * len(bundle.entry)
+        for stage in self.lanes(bundle, pseudonyms):
+            futures = [
+                self._executor.submit(
+                    copy_log_context().run, self._process_lane, ctx, bundle, lane, pseudonyms, queried, results
+                )
+                for lane in stage
+            ]
+            for future in futures:
+                future.result()
+
+        return [result for result in results if result is not None]
+
+    @staticmethod
+    def lanes(
+        bundle: Bundle[Any], pseudonyms: Sequence[PseudonymResponse | PseudonymError | None]
+    ) -> List[List[List[int]]]:
+        """
+        Splits the entry indexes into stages that run one after the other, each holding lanes that run in parallel.
+        Entries of a transaction on the same pseudonym share a lane so they keep their order, and an entry with no
+        known pseudonym (by id or on the whole URA) runs on its own between the entries before and after it, as it
+        may read or write the referrals of any of them.
+        Entries of other bundle types are independent and each get their own lane.
+        """
+        if bundle.type != "transaction":
+            return [[[index] for index in range(len(bundle.entry))]]
+
+        stages: List[List[List[int]]] = []
+        lanes: Dict[str, List[int]] = {}
+        for index, entry in enumerate(bundle.entry):
+            pseudonym = pseudonyms[index]
+            if isinstance(pseudonym, PseudonymResponse):
+                lanes.setdefault(EncryptedPseudonym.from_response(pseudonym).value, []).append(index)
+            else:
+                if lanes:
+                    stages.append(list(lanes.values()))
+                    lanes = {}
+                stages.append([[index]])
+
+        if lanes:
+            stages.append(list(lanes.values()))
+
+        return stages
+
+    def _process_lane(
+        self,
+        ctx: AuthContext,
+        bundle: Bundle[Any],
+        lane: List[int],
+        pseudonyms: Sequence[PseudonymResponse | PseudonymError | None],
+        queried: Dict[int, Bundle[LocalizationList]],
+        results: List[BundleEntry[Any] | None],
+    ) -> None:
+        for index in lane:
+            try:
+                results[index] = self.process_entry(
+                    ctx, bundle.entry[index], index, pseudonyms[index], queried.get(index)
+                )
+            except Exception as e:
+                logger.exception("Error while processing Bundle.entry.%d", index)
+                results[index] = BundleEntry(
+                    response=EntryResponse.make_error_response(msg=f"Bundle.entry.{index}: {e}", status=str(500))
+                )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def exchange_entries(
+        self, ctx: AuthContext, entries: Sequence[BundleEntry[Any]]
+    ) -> List[PseudonymResponse | PseudonymError | None]:
+        """
+        Exchanges the pseudonym tokens of all entries in one batched call to the crypto service, so
+        process_entry() does not call it once per entry. Returns a result per entry, None for an entry
+        without a token or one that will be rejected before its token is used.
+        """
+        tokens: Dict[int, str] = {}
+        for index, entry in enumerate(entries):
+            token = self._entry_token(ctx, entry, index)
+            if token is not None:
+                tokens[index] = token
+
+        results: List[PseudonymResponse | PseudonymError | None] = [None] * len(entries)
+        if not tokens:
+            return results
+
+        exchanged = self.localizaton_list_service.exchange_tokens(list(tokens.values()))
+        for index, result in zip(tokens.keys(), exchanged):
+            results[index] = result
+
+        return results
+
+    def query_entries(
+        self,
+        ctx: AuthContext,
+        entries: Sequence[BundleEntry[Any]],
+        pseudonyms: Sequence[PseudonymResponse | PseudonymError | None],
+    ) -> Dict[int, Bundle[LocalizationList]]:
+        """
+        Runs the localization searches (a GET with only a subject) of all entries as one grouped query, so a large
+        bundle costs one database round trip instead of one per entry. A search that follows a write on the same
+        pseudonym, or a DELETE with no known pseudonym, is left to process_entry() so it sees that write.
+        Returns the searchset bundle per entry index.
+        """
+        searches: Dict[int, PseudonymResponse] = {}
+        written: Set[str] = set()
+        unknown_delete = False
+        for index, entry in enumerate(entries):
+            if entry.request is None:
+                continue
+
+            pseudonym = pseudonyms[index]
+            if not isinstance(pseudonym, PseudonymResponse):
+                unknown_delete = unknown_delete or entry.request.method == "DELETE"
+                continue
+
+            key = EncryptedPseudonym.from_response(pseudonym).value
+            if entry.request.method in ("POST", "DELETE"):
+                written.add(key)
+            elif key not in written and not unknown_delete and self._is_localize_search(entry.request.url):
+                searches[index] = pseudonym
+
+        if len(searches) < 2:
+            return {}
+
+        bundles = self.localizaton_list_service.query_many(
+            list(searches.values()),
+            ctx.claims.ura_number,
+            organization_name=ctx.claims.organization_name,
+        )
+        return dict(zip(searches.keys(), bundles))
 
-    def process_entry(self, ctx: AuthContext, entry: BundleEntry[Any], index: int) -> BundleEntry[Any]:
+    @staticmethod
+    def _is_localize_search(url: str) -> bool:
+        try:
+            request_dto = EntryRequestDto.from_url(url)
+            return (
+                request_dto.id is None
+                and LocalizationListParams.model_validate(request_dto.params).is_localize_params()
+            )
+        except ValueError:
+            return False
+
+    def _entry_token(self, ctx: AuthContext, entry: BundleEntry[Any], index: int) -> str | None:
+        if entry.request is None or entry.request.method is None:
+            return None
+
+        method = entry.request.method
+        resolved_url = self.resolve_request_url(entry.request.url, index)
+        if isinstance(resolved_url, BundleEntry):
+            return None
+
+        required_scope = self.required_scope(method, resolved_url)
+        if required_scope is not None and required_scope not in ctx.scope:
+            return None
+
+        if self.requires_managing_request(method, resolved_url) and not AuthContextService.is_managing_request(ctx):
+            return None
+
+        try:
+            if method == "POST" and isinstance(entry.resource, LocalizationList):
+                return entry.resource.get_encoded_pseudonym()
+            if method in ("GET", "DELETE") and resolved_url.id is None:
+                return LocalizationListParams.model_validate(resolved_url.params).subject
+        except ValueError:
+            # Left to process_entry(), which reports the invalid entry
+            pass
+
+        return None
+
+    def process_entry(
+        self,
+        ctx: AuthContext,
+        entry: BundleEntry[Any],
+        index: int,
+        pseudonym: PseudonymResponse | PseudonymError | None = None,
+        query_result: Bundle[LocalizationList] | None = None,
+    ) -> BundleEntry[Any]:
+        """
+        :param pseudonym: the pseudonym of the entry, when already exchanged with exchange_entries()
+        :param query_result: the searchset of the entry, when already queried with query_entries()
+        """
         authenticated_ura = ctx.claims.ura_number
         organization_name = ctx.claims.organization_name
 
@@ -100,8 +304,12 @@ class BundleService:
                     )
 
                 try:
-                    query_results = self.localizaton_list_service.query(
-                        params, authenticated_ura, organization_name=organization_name
+                    query_results = (
+                        query_result
+                        if query_result is not None
+                        else self.localizaton_list_service.query(
+                            params, authenticated_ura, organization_name=organization_name, pseudonym=pseudonym
+                        )
                     )
                     return BundleEntry(
                         resource=query_results,
@@ -156,7 +364,7 @@ class BundleService:
 
                 try:
                     results = self.localizaton_list_service.create(
-                        resource, authenticated_ura, organization_name=organization_name
+                        resource, authenticated_ura, organization_name=organization_name, pseudonym=pseudonym
                     )
                     return BundleEntry(
                         resource=resource,
@@ -207,9 +415,17 @@ class BundleService:
                             f"Bundle.entry.{index}.request: invalid url parameter"
                         )
                     )
-                outcome, status_code = self.localizaton_list_service.delete_by_query(
-                    params, authenticated_ura, organization_name=organization_name
-                )
+                try:
+                    outcome, status_code = self.localizaton_list_service.delete_by_query(
+                        params, authenticated_ura, organization_name=organization_name, pseudonym=pseudonym
+                    )
+                except PseudonymError as e:
+                    return BundleEntry(
+                        response=EntryResponse.make_error_response(
+                            msg=f"Bundle.entry.{index}: {str(e)}",
+                            status=str(400),
+                        )
+                    )
 
                 return BundleEntry(response=EntryResponse(status=str(status_code), outcome=outcome))
 
@@ -1,19 +1,29 @@
 import logging
-from typing import Tuple
+from itertools import chain
+from typing import Dict, Iterator, List, Sequence, Tuple
+from urllib.parse import urlencode
 from uuid import UUID
 
+from app.db.models.referral import ReferralEntity
 from app.logging.events import Log
-from app.models.fhir.bundle import Bundle, BundleEntry
+from app.models.fhir.bundle import Bundle, BundleEntry, BundleLink
+from app.models.fhir.resources.data import DEVICE_SYSTEM, PSEUDONYM_SYSTEM
 from app.models.fhir.resources.localization_list.request import (
+    COUNT_PARAM,
+    CURSOR_PARAM,
+    DEVICE_IDENTIFIER_PARAM,
     SUBJECT_IDENTIFIER_PARAM,
     LocalizationListParams,
+    encode_cursor,
 )
 from app.models.fhir.resources.localization_list.resource import LocalizationList
 from app.models.fhir.resources.operation_outcome.resource import OperationOutcome
 from app.models.pseudonym import EncryptedPseudonym, PseudonymResponse
 from app.models.ura import UraNumber
+from app.services.bulk_delete import BulkDeleteJob, BulkDeleteService, BulkDeleteStatus
 from app.services.crypto_service_api_client import CryptoServiceApiClient
 from app.services.exceptions import (
+    CryptoServiceUnavailableError,
     NotFoundError,
     PseudonymError,
     UnauthorizedUraError,
@@ -24,6 +34,9 @@ from app.utils.fhir import decode_url_safe_token
 
 logger = logging.getLogger(__name__)
 
+# Bundle entries serialized per chunk of a streamed response
+STREAM_CHUNK_ENTRIES = 100
+
 
 class LocalizationListService:
     def __init__(
@@ -31,10 +44,21 @@ class LocalizationListService:
         referral_service: ReferralService,
         crypto_client: CryptoServiceApiClient,
         key_info_service: KeyInfoService,
+        delete_chunk_size: int = 1000,
+        bulk_delete_service: BulkDeleteService | None = None,
+        background_delete_threshold: int = 0,
     ) -> None:
+        """
+        :param delete_chunk_size: referrals deleted per transaction when deleting all referrals of a URA
+        :param bulk_delete_service: runs those deletes in the background when there are more than
+            `background_delete_threshold` referrals, they always run in the request when not given
+        """
         self.referral_service = referral_service
         self.key_info_service = key_info_service
         self._crypto_client = crypto_client
+        self.delete_chunk_size = delete_chunk_size
+        self.bulk_delete_service = bulk_delete_service
+        self.background_delete_threshold = background_delete_threshold
 
     def _token_to_pseudonym(self, token: str, label: str, mechanism: str) -> PseudonymResponse:
         try:
@@ -45,16 +69,62 @@ class LocalizationListService:
                 label=label,
                 mechanism=mechanism,
             )
+        except CryptoServiceUnavailableError:
+            raise
         except Exception:
             logger.exception("Error occurred while decoding pseudonym token")
             raise PseudonymError(f"Invalid pseudonym in {SUBJECT_IDENTIFIER_PARAM}")
 
+    def exchange_tokens(self, tokens: Sequence[str]) -> List[PseudonymResponse | PseudonymError]:
+        """
+        Exchanges the pseudonym tokens of many requests with one batched call to the crypto service.
+        Returns a result per token in input order, a PseudonymError for a token that could not be exchanged.
+        Raises CryptoServiceUnavailableError when the crypto service is not taking exchanges.
+        """
+        results: List[PseudonymResponse | PseudonymError] = [
+            PseudonymError(f"Invalid pseudonym in {SUBJECT_IDENTIFIER_PARAM}") for _ in tokens
+        ]
+        decoded: List[Tuple[int, Tuple[str, str]]] = []
+        for index, token in enumerate(tokens):
+            try:
+                data = decode_url_safe_token(token)
+                decoded.append((index, (data["evaluated_output"], data["blind_factor"])))
+            except Exception:
+                logger.exception("Error occurred while decoding pseudonym token")
+
+        if not decoded:
+            return results
+
+        active_key = self.key_info_service.get_active_key()
+        exchanged = self._crypto_client.exchange_many(
+            [token for _, token in decoded], label=active_key.label, mechanism=active_key.mechanism
+        )
+        for (index, _), result in zip(decoded, exchanged):
+            if isinstance(result, PseudonymResponse):
+                results[index] = result
+            elif isinstance(result, CryptoServiceUnavailableError):
+                raise result
+            else:
+                logger.error("Error occurred while exchanging pseudonym token: %s", result)
+
+        return results
+
+    @staticmethod
+    def _pre_exchanged(pseudonym: PseudonymResponse | PseudonymError | None) -> PseudonymResponse | None:
+        if isinstance(pseudonym, PseudonymError):
+            raise pseudonym
+        return pseudonym
+
     def create(
         self,
         data: LocalizationList,
         authenticated_ura: UraNumber,
         organization_name: str,
+        pseudonym: PseudonymResponse | PseudonymError | None = None,
     ) -> LocalizationList:
+        """
+        :param pseudonym: the pseudonym of the List, when already exchanged with exchange_tokens()
+        """
         ura_number = data.get_ura()
         device = data.get_device()
 
@@ -69,7 +139,7 @@ class LocalizationListService:
             raise UnauthorizedUraError("Registration not linked to the authorized URA")
 
         active_key = self.key_info_service.get_active_key()
-        pseudonym_resp = self._token_to_pseudonym(
+        pseudonym_resp = self._pre_exchanged(pseudonym) or self._token_to_pseudonym(
             token=data.get_encoded_pseudonym(),
             label=active_key.label,
             mechanism=active_key.mechanism,
@@ -88,7 +158,7 @@ class LocalizationListService:
         return LocalizationList.from_referral(new_referral)
 
     def get(self, id: UUID, authenticated_ura: UraNumber, organization_name: str) -> LocalizationList:
-        referral = self.referral_service.get_by_id(id)
+        referral = self.referral_service.get_by_id(id, requesting_ura=authenticated_ura)
         Log.event(
             logger,
             Log.REFERRAL_SEARCHED_ON_ID,
@@ -109,33 +179,82 @@ class LocalizationListService:
 
         return LocalizationList.from_referral(referral)
 
+    def _subject_to_pseudonym(
+        self, params: LocalizationListParams, pseudonym: PseudonymResponse | PseudonymError | None = None
+    ) -> PseudonymResponse | None:
+        if not params.subject:
+            return None
+
+        if pseudonym is not None:
+            return self._pre_exchanged(pseudonym)
+
+        active_key = self.key_info_service.get_active_key()
+        return self._token_to_pseudonym(
+            token=params.subject,
+            label=active_key.label,
+            mechanism=active_key.mechanism,
+        )
+
     def query(
         self,
         params: LocalizationListParams,
         authenticated_ura: UraNumber,
         organization_name: str,
+        base_url: str = "List",
+        pseudonym: PseudonymResponse | PseudonymError | None = None,
     ) -> Bundle[LocalizationList]:
+        """
+        :param base_url: url of the List endpoint, used for the links of a paginated result
+        :param pseudonym: the subject pseudonym, when already exchanged with exchange_tokens()
+        """
         ura_number: UraNumber | None = None
 
         is_localize = params.is_localize_params()
         if params.empty() or is_localize is False:
             ura_number = authenticated_ura
 
-        pseudonym_resp: None | PseudonymResponse = None
-        if params.subject:
-            active_key = self.key_info_service.get_active_key()
-            pseudonym_resp = self._token_to_pseudonym(
-                token=params.subject,
-                label=active_key.label,
-                mechanism=active_key.mechanism,
-            )
+        pseudonym_resp = self._subject_to_pseudonym(params, pseudonym)
+
+        if ura_number is not None and params.count is not None:
+            return self._query_page(params, ura_number, pseudonym_resp, base_url)
 
         referrals = self.referral_service.get_many(
             encrypted_pseudonym=(EncryptedPseudonym.from_response(pseudonym_resp) if pseudonym_resp else None),
             source=params.source,
             ura_number=ura_number,
+            requesting_ura=authenticated_ura,
         )
 
+        return self._query_result(referrals, is_localize, pseudonym_resp, authenticated_ura, organization_name)
+
+    def query_many(
+        self,
+        pseudonyms: Sequence[PseudonymResponse],
+        authenticated_ura: UraNumber,
+        organization_name: str,
+    ) -> List[Bundle[LocalizationList]]:
+        """
+        Localizes many subjects with a single query, the grouped form of query() with only a subject parameter.
+        Returns a searchset bundle per pseudonym in input order.
+        """
+        encrypted_pseudonyms = [EncryptedPseudonym.from_response(p) for p in pseudonyms]
+        referrals = self.referral_service.get_many_by_pseudonyms(encrypted_pseudonyms, requesting_ura=authenticated_ura)
+
+        return [
+            self._query_result(
+                referrals.get(encrypted.value, []), True, pseudonym, authenticated_ura, organization_name
+            )
+            for pseudonym, encrypted in zip(pseudonyms, encrypted_pseudonyms)
+        ]
+
+    def _query_result(
+        self,
+        referrals: Sequence[ReferralEntity],
+        is_localize: bool,
+        pseudonym_resp: PseudonymResponse | None,
+        authenticated_ura: UraNumber,
+        organization_name: str,
+    ) -> Bundle[LocalizationList]:
         if is_localize:
             if referrals:
                 Log.event(
@@ -172,50 +291,161 @@ class LocalizationListService:
 
         return bundle
 
-    def delete(self, id: UUID, authenticated_ura: UraNumber, organization_name: str) -> Tuple[OperationOutcome, int]:
-        target = self.referral_service.get_by_id(id)
-        affected_rows = self.referral_service.delete_many(ura_number=authenticated_ura, id=id)
-        if affected_rows > 0:
+    def _query_page(
+        self,
+        params: LocalizationListParams,
+        ura_number: UraNumber,
+        pseudonym_resp: PseudonymResponse | None,
+        base_url: str,
+    ) -> Bundle[LocalizationList]:
+        count = params.count or 0
+        # One extra row tells whether there is a next page
+        referrals = self.referral_service.get_page(
+            ura_number=ura_number,
+            count=count + 1,
+            encrypted_pseudonym=(EncryptedPseudonym.from_response(pseudonym_resp) if pseudonym_resp else None),
+            source=params.source,
+            after=params.after(),
+        )
+        page: Sequence[ReferralEntity] = referrals[:count]
+
+        Log.event(
+            logger,
+            Log.REFERRALS_QUERIED,
+            "Referrals queried",
+            ura_number=str(ura_number),
+            result_count=len(page),
+        )
+
+        links = [BundleLink(relation="self", url=self._page_url(base_url, params, params.cursor))]
+        if len(referrals) > count:
+            last = page[-1]
+            links.append(
+                BundleLink(
+                    relation="next", url=self._page_url(base_url, params, encode_cursor(last.created_at, last.id))
+                )
+            )
+
+        return Bundle(
+            type="searchset",
+            link=links,
+            entry=[BundleEntry(resource=LocalizationList.from_referral(r)) for r in page],
+        )
+
+    @staticmethod
+    def _page_url(base_url: str, params: LocalizationListParams, cursor: str | None) -> str:
+        query: Dict[str, str] = {}
+        if params.subject:
+            query[SUBJECT_IDENTIFIER_PARAM] = f"{PSEUDONYM_SYSTEM}|{params.subject}"
+        if params.source:
+            query[DEVICE_IDENTIFIER_PARAM] = f"{DEVICE_SYSTEM}|{params.source}"
+        query[COUNT_PARAM] = str(params.count)
+        if cursor is not None:
+            query[CURSOR_PARAM] = cursor
+
+        return f"{base_url}?{urlencode(query)}"
+
+    def query_stream(
+        self,
+        params: LocalizationListParams,
+        authenticated_ura: UraNumber,
+        organization_name: str,
+    ) -> Iterator[str]:
+        """
+        Returns the URA-wide listing as chunks of a searchset Bundle JSON document, produced while the rows
+        arrive from the database. The pseudonym exchange and the query are done up front, so their errors
+        surface before the response starts.
+        """
+        pseudonym_resp = self._subject_to_pseudonym(params)
+        referrals = self.referral_service.stream_many(
+            ura_number=authenticated_ura,
+            encrypted_pseudonym=(EncryptedPseudonym.from_response(pseudonym_resp) if pseudonym_resp else None),
+            source=params.source,
+        )
+        first = next(referrals, None)
+        return self._stream_bundle(authenticated_ura, first, referrals)
+
+    def _stream_bundle(
+        self,
+        ura_number: UraNumber,
+        first: ReferralEntity | None,
+        referrals: Iterator[ReferralEntity],
+    ) -> Iterator[str]:
+        total = 0
+        try:
+            yield '{"resourceType":"Bundle","type":"searchset","entry":['
+
+            chunk: List[str] = []
+            for referral in chain([first] if first is not None else [], referrals):
+                entry = BundleEntry(resource=LocalizationList.from_referral(referral))
+                chunk.append(entry.model_dump_json(by_alias=True, exclude_none=True))
+                total += 1
+                if len(chunk) == STREAM_CHUNK_ENTRIES:
+                    yield ("," if total > len(chunk) else "") + ",".join(chunk)
+                    chunk = []
+            if chunk:
+                yield ("," if total > len(chunk) else "") + ",".join(chunk)
+
+            # total comes last, it is only known once all rows have been read
+            yield f'],"total":{total}}}'
+        finally:
+            # Also when the client went away or a later fetch failed, result_count is then what was sent
             Log.event(
                 logger,
-                Log.REFERRAL_DELETED,
-                "Referral deleted",
-                organization=organization_name,
-                ura_number=str(authenticated_ura),
-                pseudonym_hash=target.pseudonym if target else None,
-            )
-            return (
-                OperationOutcome.make_good_outcome(f"Resource {id} has been deleted successfully"),
-                201,
+                Log.REFERRALS_QUERIED,
+                "Referrals queried",
+                ura_number=str(ura_number),
+                result_count=total,
             )
-        else:
+
+    def delete(self, id: UUID, authenticated_ura: UraNumber, organization_name: str) -> Tuple[OperationOutcome, int]:
+        try:
+            deleted = self.referral_service.delete_by_id(id, ura_number=authenticated_ura)
+        except NotFoundError:
             return (
                 OperationOutcome.make_error_outcome(code="warning", msg=f"Resource {id} does not exist"),
                 404,
             )
 
+        Log.event(
+            logger,
+            Log.REFERRAL_DELETED,
+            "Referral deleted",
+            organization=organization_name,
+            ura_number=str(authenticated_ura),
+            pseudonym_hash=deleted.pseudonym,
+        )
+        return (
+            OperationOutcome.make_good_outcome(f"Resource {id} has been deleted successfully"),
+            201,
+        )
+
     def delete_by_query(
         self,
         params: LocalizationListParams,
         authenticated_ura: UraNumber,
         organization_name: str,
+        pseudonym: PseudonymResponse | PseudonymError | None = None,
     ) -> Tuple[OperationOutcome, int]:
+        """
+        :param pseudonym: the subject pseudonym, when already exchanged with exchange_tokens()
+        """
         ura_number = authenticated_ura
 
-        pseudonym_resp: PseudonymResponse | None = None
-        if params.subject:
-            active_token = self.key_info_service.get_active_key()
-            pseudonym_resp = self._token_to_pseudonym(
-                token=params.subject,
-                label=active_token.label,
-                mechanism=active_token.label,
-            )
+        pseudonym_resp = self._subject_to_pseudonym(params, pseudonym)
 
-        deleted_count = self.referral_service.delete_many(
-            encrypted_pseudonym=(EncryptedPseudonym.from_response(pseudonym_resp) if pseudonym_resp else None),
-            source=params.source,
-            ura_number=ura_number,
-        )
+        if pseudonym_resp is None:
+            deleted_count = self.referral_service.delete_many_chunked(
+                ura_number=ura_number,
+                chunk_size=self.delete_chunk_size,
+                source=params.source,
+            )
+        else:
+            deleted_count = self.referral_service.delete_many(
+                encrypted_pseudonym=EncryptedPseudonym.from_response(pseudonym_resp),
+                source=params.source,
+                ura_number=ura_number,
+            )
 
         if deleted_count > 0:
             if pseudonym_resp is not None:
@@ -242,3 +472,52 @@ class LocalizationListService:
             OperationOutcome.make_good_outcome("Resources have been deleted successfully"),
             201,
         )
+
+    def schedule_delete_by_query(
+        self,
+        params: LocalizationListParams,
+        authenticated_ura: UraNumber,
+        organization_name: str,
+    ) -> BulkDeleteJob | None:
+        """
+        Starts a background job for a delete of all referrals (of a source) of the URA when there are more than
+        background_delete_threshold of them. Returns None when the delete should run in the request instead.
+        """
+        if self.bulk_delete_service is None or params.subject:
+            return None
+
+        if self.referral_service.count(authenticated_ura, source=params.source) <= self.background_delete_threshold:
+            return None
+
+        return self.bulk_delete_service.start(
+            ura_number=authenticated_ura,
+            organization_name=organization_name,
+            source=params.source,
+        )
+
+    def bulk_delete_status(self, id: UUID, authenticated_ura: UraNumber) -> Tuple[OperationOutcome, int]:
+        if self.bulk_delete_service is None:
+            raise NotFoundError()
+
+        job = self.bulk_delete_service.get(id, authenticated_ura)
+        match job.status:
+            case BulkDeleteStatus.IN_PROGRESS:
+                return (
+                    OperationOutcome.make_good_outcome(
+                        f"Deletion in progress, {job.deleted_count} resources have been deleted so far"
+                    ),
+                    202,
+                )
+            case BulkDeleteStatus.COMPLETED:
+                return (
+                    OperationOutcome.make_good_outcome(f"{job.deleted_count} resources have been deleted successfully"),
+                    200,
+                )
+            case _:
+                return (
+                    OperationOutcome.make_error_outcome(
+                        code="exception",
+                        msg=f"Deletion failed after {job.deleted_count} resources have been deleted",
+                    ),
+                    500,
+                )
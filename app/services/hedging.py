@@ -0,0 +1,67 @@
+import threading
+from collections import deque
+from typing import Deque
+
+# Latencies needed before the percentile is used instead of the minimum delay
+MIN_SAMPLES = 20
+# The percentile is recomputed after this many new latencies instead of on every request
+RECOMPUTE_EVERY = 50
+# Unused hedges that can be saved up for a burst of slow requests
+MAX_BURST = 10.0
+
+
+class HedgePolicy:
+    """
+    Decides when a duplicate (hedge) request is sent. The delay is a percentile of recently observed latencies, so
+    only the slowest requests are hedged. Every request earns budget_percent / 100 of a hedge, so the extra load
+    stays below budget_percent of the requests.
+    """
+
+    def __init__(self, percentile: float, min_delay: float, budget_percent: float, window: int = 1000) -> None:
+        """
+        :param percentile: latency percentile after which a request is hedged, e.g. 95
+        :param min_delay: seconds to wait at least before hedging, also used until enough latencies are known
+        :param budget_percent: maximum extra requests, as a percentage of all requests
+        :param window: number of recent latencies the percentile is computed over
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget_ratio = budget_percent / 100
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._new_samples = 0
+        self._delay = min_delay
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        """
+        Seconds to wait for the first response before hedging
+        """
+        return self._delay
+
+    def record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self._new_samples += 1
+            if len(self._latencies) == MIN_SAMPLES or (
+                len(self._latencies) > MIN_SAMPLES and self._new_samples >= RECOMPUTE_EVERY
+            ):
+                ordered = sorted(self._latencies)
+                index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+                self._delay = max(self.min_delay, ordered[index])
+                self._new_samples = 0
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._tokens = min(MAX_BURST, self._tokens + self.budget_ratio)
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a hedge from the budget, returns False when it is used up
+        """
+        with self._lock:
+            # Small tolerance, adding up fractions like 0.1 ten times stays just below 1
+            if self._tokens < 1 - 1e-9:
+                return False
+            self._tokens = max(0.0, self._tokens - 1)
+            return True
@@ -1,60 +1,220 @@
 import logging
-from typing import Any, Literal
+import random
+import socket
+import threading
+from dataclasses import dataclass
+from typing import Any, List, Literal, Sequence, Tuple
 
-from requests import HTTPError, Response, request
+from requests import HTTPError, Response, Session
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
 
+def _keep_alive_socket_options(keep_alive: int) -> List[Tuple[int, int, int]]:
+    """
+    TCP keep-alive probes after `keep_alive` idle seconds, so idle pooled connections are not silently dropped
+    by firewalls or load balancers in between
+    """
+    options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keep_alive))
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, keep_alive))
+    return options
+
+
+class _PoolAdapter(HTTPAdapter):
+    def __init__(self, keep_alive: int, **kwargs: Any) -> None:
+        self._keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        if self._keep_alive > 0:
+            kwargs["socket_options"] = _keep_alive_socket_options(self._keep_alive)
+        super().init_poolmanager(*args, **kwargs)
+
+
+@dataclass
+class _Endpoint:
+    url: str
+    outstanding: int = 0
+    failures: int = 0
+    ejected: bool = False
+
+
 class HttpService:
+    """
+    HTTP client with a long-lived session, so (mTLS) connections are pooled and reused between requests instead
+    of doing a handshake per request. The session is shared by all threads, only its thread safe connection
+    pool changes after construction.
+
+    With several endpoints every request goes to the one with the fewest outstanding requests of two picked at
+    random (power of two choices). An endpoint that fails eject_after_failures requests in a row gets no traffic
+    until a GET on its health_route succeeds, which a background thread probes every probe_interval seconds.
+    """
+
     def __init__(
         self,
-        endpoint: str,
+        endpoint: str | Sequence[str],
         timeout: int,
         mtls_cert: str | None,
         mtls_key: str | None,
         verify_ca: str | bool,
+        pool_size: int = 10,
+        keep_alive: int = 60,
+        max_retries: int = 0,
+        eject_after_failures: int = 3,
+        health_route: str = "",
+        probe_interval: float = 5,
+        connect_timeout: float | None = None,
     ):
-        self._endpoint = endpoint
-        self._timeout = timeout
-        self._mtls_cert = mtls_cert
-        self._mtls_key = mtls_key
-        self._verify_ca = verify_ca
+        """
+        :param endpoint: base url, or the base urls of several instances of the same service
+        :param pool_size: maximum number of connections kept open to each endpoint
+        :param keep_alive: idle seconds before TCP keep-alive probes are sent, 0 closes connections after
+            every request
+        :param max_retries: retries of requests that failed to connect
+        :param eject_after_failures: consecutive failures after which an endpoint is ejected, when there are several
+        :param health_route: sub route probed to bring an ejected endpoint back
+        :param probe_interval: seconds between probes of ejected endpoints
+        :param connect_timeout: seconds to set up a connection, `timeout` then only bounds the wait for the
+            response. Both bound the whole request when None
+        """
+        urls = [endpoint] if isinstance(endpoint, str) else list(endpoint)
+        if not urls:
+            raise ValueError("At least one endpoint is required")
+
+        self._endpoints = [_Endpoint(url) for url in urls]
+        self._timeout: float | Tuple[float, float] = timeout if connect_timeout is None else (connect_timeout, timeout)
+        self._eject_after_failures = eject_after_failures
+        self._health_route = health_route
+        self._probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._prober: threading.Thread | None = None
+
+        # Passed with every request: settings on the Session itself give way to REQUESTS_CA_BUNDLE and
+        # CURL_CA_BUNDLE from the environment
+        self._verify = verify_ca
+        self._cert = (mtls_cert, mtls_key) if mtls_cert and mtls_key else None
+        self._session = Session()
+        if keep_alive <= 0:
+            self._session.headers["Connection"] = "close"
+
+        adapter = _PoolAdapter(
+            keep_alive=keep_alive,
+            pool_connections=len(urls),
+            pool_maxsize=pool_size,
+            # Only connect errors are retried, an exchange that reached the server is never sent twice
+            max_retries=Retry(total=max_retries, read=False, status=0, backoff_factor=0.1),
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._session.close()
+
+    def _pick(self) -> _Endpoint:
+        with self._lock:
+            candidates = [e for e in self._endpoints if not e.ejected] or self._endpoints
+            if len(candidates) == 1:
+                endpoint = candidates[0]
+            else:
+                first, second = random.sample(candidates, 2)
+                endpoint = first if first.outstanding <= second.outstanding else second
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _release(self, endpoint: _Endpoint, failed: bool) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+            if not failed:
+                endpoint.failures = 0
+                return
+
+            endpoint.failures += 1
+            if endpoint.ejected or endpoint.failures < self._eject_after_failures or len(self._endpoints) == 1:
+                return
+
+            endpoint.ejected = True
+            logger.warning("Ejected endpoint %s after %d failed requests", endpoint.url, endpoint.failures)
+            if self._prober is None:
+                self._prober = threading.Thread(target=self._probe_ejected, name="http-probe", daemon=True)
+                self._prober.start()
+
+    def _probe_ejected(self) -> None:
+        while not self._closed.wait(self._probe_interval):
+            with self._lock:
+                ejected = [e for e in self._endpoints if e.ejected]
+                if not ejected:
+                    self._prober = None
+                    return
+
+            for endpoint in ejected:
+                if self._probe(endpoint):
+                    with self._lock:
+                        endpoint.ejected = False
+                        endpoint.failures = 0
+                    logger.info("Endpoint %s is healthy again", endpoint.url)
+
+    def _probe(self, endpoint: _Endpoint) -> bool:
+        try:
+            response = self._session.get(
+                self._url(endpoint, self._health_route), timeout=self._timeout, verify=self._verify, cert=self._cert
+            )
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    @staticmethod
+    def _url(endpoint: _Endpoint, sub_route: str) -> str:
+        return f"{endpoint.url}/{sub_route}" if sub_route else endpoint.url
 
     def do_request(
         self,
         method: Literal["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"],
         sub_route: str = "",
-        data: dict[str, Any] | None = None,
+        data: dict[str, Any] | list[Any] | None = None,
         params: dict[str, Any] | None = None,
         headers: dict[str, Any] | None = None,
         form_data: dict[str, Any] | None = None,
     ) -> Response:
         try:
-            cert = (self._mtls_cert, self._mtls_key) if self._mtls_cert and self._mtls_key else None
-
             if data is not None and form_data is not None:
                 raise ValueError("Cannot provide both 'data' and 'form_data' in the same request.")
 
-            data_args = {}
+            data_args: dict[str, Any] = {}
             if form_data is not None:
                 data_args["data"] = form_data
             elif data is not None:
                 data_args["json"] = data
 
-            response = request(
-                method=method,
-                url=f"{self._endpoint}/{sub_route}" if sub_route else self._endpoint,
-                params=params,
-                headers=headers,
-                timeout=self._timeout,
-                cert=cert,
-                verify=self._verify_ca,
-                **data_args,  # type: ignore
-            )
-
-            response.raise_for_status()
+            endpoint = self._pick()
+            failed = True
+            try:
+                response = self._session.request(
+                    method=method,
+                    url=self._url(endpoint, sub_route),
+                    params=params,
+                    headers=headers,
+                    timeout=self._timeout,
+                    verify=self._verify,
+                    cert=self._cert,
+                    **data_args,
+                )
+                try:
+                    response.raise_for_status()
+                except HTTPError as e:
+                    # A client error is about the request, not about the health of the endpoint
+                    failed = e.response is None or e.response.status_code >= 500
+                    raise
+                failed = False
+            finally:
+                self._release(endpoint, failed)
 
             return response
         except (ConnectionError, Timeout):
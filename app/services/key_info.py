@@ -1,10 +1,15 @@
 import logging
+import threading
 from datetime import datetime
+from time import monotonic
 from typing import List
+from uuid import UUID
 
 from app.db.db import Database
+from app.db.invalidation import InvalidationListener
 from app.db.models.key_info import KeyInfoEntity
 from app.db.repository.key_info_repository import KeyInfoRepository
+from app.db.session import DbSession
 from app.services.exceptions import (
     ConflictError,
     ForbiddedError,
@@ -14,10 +19,27 @@ from app.services.exceptions import (
 
 logger = logging.Logger(__name__)
 
+# Kind of the keys, key ids, published to other instances on a key write
+KEY_INFO_INVALIDATION_KIND = "key_info"
+
 
 class KeyInfoService:
-    def __init__(self, database: Database) -> None:
+    def __init__(
+        self, database: Database, cache_ttl: float = 0, invalidation: InvalidationListener | None = None
+    ) -> None:
+        """
+        :param cache_ttl: seconds the active key is served from memory, 0 reads it from the database on every call.
+            Other workers see a changed key after at most this long, or sooner when invalidate() is called.
+        :param invalidation: publishes the ids of changed keys, so other instances drop their cached active key
+        """
         self.database = database
+        self.cache_ttl = cache_ttl
+        self.invalidation = invalidation
+        self._active_key: KeyInfoEntity | None = None
+        self._active_key_expires_at = 0.0
+        # Bumped by invalidate(), so a read that raced with it does not cache the old key
+        self._generation = 0
+        self._lock = threading.Lock()
 
     def get_one(self, label: str) -> KeyInfoEntity:
         with self.database.get_db_session() as session:
@@ -30,14 +52,82 @@ class KeyInfoService:
             return key_info
 
     def get_active_key(self) -> KeyInfoEntity:
-        with self.database.get_db_session() as session:
-            repo = session.get_repository(KeyInfoRepository)
-            active_key_info = repo.find_active()
-            if len(active_key_info) != 1:
-                logger.debug("Only one active KeyInfo is allowed, check database to fix issue")
-                raise InvalidKeyInfoError()
-
-            return active_key_info[0]
+        active_key = self._active_key
+        if active_key is not None and monotonic() < self._active_key_expires_at:
+            return active_key
+
+        generation = self._generation
+        with self._read_session() as session:
+            active_key = self._find_active_key(session)
+
+        self._cache(active_key, generation)
+        return active_key
+
+    def _read_session(self) -> DbSession:
+        """
+        A key that is cached is read from the primary: a lagging replica could still return the key that was just
+        replaced and invalidated, which the cache would then serve for cache_ttl
+        """
+        if self.cache_ttl > 0:
+            return self.database.get_db_session()
+        return self.database.get_read_db_session()
+
+    @staticmethod
+    def _find_active_key(session: DbSession) -> KeyInfoEntity:
+        repo = session.get_repository(KeyInfoRepository)
+        active_key_info = repo.find_active()
+        if len(active_key_info) != 1:
+            logger.debug("Only one active KeyInfo is allowed, check database to fix issue")
+            raise InvalidKeyInfoError()
+
+        return active_key_info[0]
+
+    def _cache(self, active_key: KeyInfoEntity, generation: int) -> None:
+        if self.cache_ttl > 0:
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self._active_key = self._detached_copy(active_key)
+                self._active_key_expires_at = monotonic() + self.cache_ttl
+
+    def invalidate(self) -> None:
+        """
+        Drops the cached active key, so the next get_active_key() reads it from the database again
+        """
+        with self._lock:
+            self._generation += 1
+            self._active_key = None
+            self._active_key_expires_at = 0.0
+
+    def warm(self) -> None:
+        """
+        Loads the active key into the cache, so the first requests do not wait for it. It is a single attempt, an
+        unavailable database must not hold up the startup.
+        """
+        if self.cache_ttl <= 0:
+            return
+
+        try:
+            generation = self._generation
+            with self.database.get_db_session(retry_backoff=[]) as session:
+                active_key = self._find_active_key(session)
+            self._cache(active_key, generation)
+        except Exception as e:
+            logger.warning("Could not load the active key at startup: %s", e)
+
+    @staticmethod
+    def _detached_copy(key_info: KeyInfoEntity) -> KeyInfoEntity:
+        """
+        A copy bound to no session, so a rollback or close of the session that loaded it cannot expire the cached key
+        """
+        return KeyInfoEntity(
+            id=key_info.id,
+            label=key_info.label,
+            mechanism=key_info.mechanism,
+            active=key_info.active,
+            created_at=key_info.created_at,
+            deleted_at=key_info.deleted_at,
+        )
 
     def get_many(self, mechanism: str | None = None) -> List[KeyInfoEntity]:
         with self.database.get_db_session() as session:
@@ -52,7 +142,9 @@ class KeyInfoService:
 
             new_key_info = repo.add_one(KeyInfoEntity(label=label, mechanism=mechanism))
 
-            return new_key_info
+        self.invalidate()
+        self._publish(new_key_info.id)
+        return new_key_info
 
     def delete_one(self, label: str) -> None:
         with self.database.get_db_session() as session:
@@ -68,3 +160,11 @@ class KeyInfoService:
             target.deleted_at = datetime.now()
             session.add(target)
             session.commit()
+            target_id = target.id
+
+        self.invalidate()
+        self._publish(target_id)
+
+    def _publish(self, key_id: UUID) -> None:
+        if self.invalidation is not None:
+            self.invalidation.publish(KEY_INFO_INVALIDATION_KIND, [str(key_id)])
@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from time import monotonic
+from typing import List, NamedTuple, Sequence, Tuple
+from uuid import UUID
+
+from app.db.models.referral import ReferralEntity
+from app.stats import get_stats
+
+
+class CachedReferral(NamedTuple):
+    id: UUID
+    ura_number: str
+    source: str
+    created_at: datetime
+
+
+class LocalizationCache:
+    """
+    Bounded LRU cache of the referrals of a pseudonym, with a time to live per entry. Only the columns a
+    localization result needs are kept, not the ORM entities.
+
+    Writers call invalidate() once their change is committed. A read that started before an invalidation does not
+    cache its (possibly stale) result, so pass the generation() taken before the database read to put().
+    """
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        """
+        :param max_entries: pseudonyms kept, the least recently used one is evicted beyond this
+        :param ttl: seconds an entry is served, other workers see a change after at most this long
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, Tuple[float, Tuple[CachedReferral, ...]]] = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, pseudonym: str) -> List[ReferralEntity] | None:
+        """
+        Returns the cached referrals of the pseudonym as transient entities, None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(pseudonym)
+            if entry is not None and entry[0] <= monotonic():
+                del self._entries[pseudonym]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(pseudonym)
+
+        if entry is None:
+            get_stats().inc("referral_service.localization_cache.miss")
+            return None
+
+        get_stats().inc("referral_service.localization_cache.hit")
+        return [
+            ReferralEntity(
+                id=row.id,
+                pseudonym=pseudonym,
+                ura_number=row.ura_number,
+                source=row.source,
+                created_at=row.created_at,
+            )
+            for row in entry[1]
+        ]
+
+    def put(self, pseudonym: str, referrals: Sequence[ReferralEntity], generation: int) -> None:
+        rows = tuple(CachedReferral(r.id, r.ura_number, r.source, r.created_at) for r in referrals)
+        evicted = 0
+        with self._lock:
+            if generation != self._generation:
+                return
+
+            self._entries[pseudonym] = (monotonic() + self.ttl, rows)
+            self._entries.move_to_end(pseudonym)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+
+        if evicted:
+            get_stats().inc("referral_service.localization_cache.eviction", evicted)
+
+    def invalidate(self, pseudonyms: Sequence[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            for pseudonym in pseudonyms:
+                self._entries.pop(pseudonym, None)
+
+    def clear(self) -> None:
+        """
+        Drops every entry, for writes of which the affected pseudonyms are not known
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
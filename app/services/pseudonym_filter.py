@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import math
+import threading
+from time import monotonic
+from typing import Callable, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# Headroom on the number of pseudonyms seen by the last build when sizing the next one
+GROWTH_FACTOR = 1.2
+# Seconds before a failed build is retried
+RETRY_INTERVAL = 60
+
+
+class BloomFilter:
+    """
+    Set membership with false positives but no false negatives, in about 10 bits per item at a 1% false positive
+    rate. Positions are derived from one blake2b digest with double hashing.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float) -> None:
+        """
+        :param capacity: items after which the false positive rate rises above fp_rate
+        :param fp_rate: false positive rate at capacity, e.g. 0.01
+        """
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str) -> List[int]:
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value: str) -> None:
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class PseudonymFilter:
+    """
+    Bloom filter of the pseudonyms that have referrals, so a localization of an unknown pseudonym is answered
+    without a database query. It is built in a background thread from `load` and rebuilt every rebuild_interval
+    seconds to drop the pseudonyms of deleted referrals. Until the first build has finished every pseudonym might
+    be present.
+
+    Added pseudonyms must be passed to add(), also those written by other instances; a missed one is reported as
+    absent until the next rebuild. Other instances learn of them through LISTEN/NOTIFY: a registration fails when
+    its notification cannot be sent, and a listener that lost its connection invalidates the filter. What remains
+    is the delivery delay of a notification, usually milliseconds, during which another instance can answer a
+    localization of the new pseudonym without a match.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float, rebuild_interval: float) -> None:
+        """
+        :param capacity: expected number of pseudonyms, a rebuild grows it when there are more
+        :param fp_rate: target false positive rate
+        :param rebuild_interval: seconds between rebuilds
+        """
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.rebuild_interval = rebuild_interval
+        self._filter: BloomFilter | None = None
+        # Pseudonyms added while a build streams, applied to the new filter before it replaces the old one
+        self._pending: List[str] | None = None
+        # Bumped by invalidate(), so a build that started before it is not used
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._rebuild = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def might_contain(self, pseudonym: str) -> bool:
+        bloom_filter = self._filter
+        return bloom_filter is None or pseudonym in bloom_filter
+
+    def add(self, pseudonyms: Iterable[str]) -> None:
+        with self._lock:
+            for pseudonym in pseudonyms:
+                if self._filter is not None:
+                    self._filter.add(pseudonym)
+                if self._pending is not None:
+                    self._pending.append(pseudonym)
+
+    def build(self, load: Callable[[], Iterable[str]]) -> None:
+        """
+        Builds a new filter from all pseudonyms returned by load and replaces the current one
+        """
+        start = monotonic()
+        with self._lock:
+            self._pending = []
+            generation = self._generation
+        try:
+            bloom_filter = BloomFilter(self.capacity, self.fp_rate)
+            for pseudonym in load():
+                bloom_filter.add(pseudonym)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            for pseudonym in self._pending or []:
+                bloom_filter.add(pseudonym)
+            self._pending = None
+            if generation != self._generation:
+                return
+            self._filter = bloom_filter
+
+        if bloom_filter.count > self.capacity:
+            self.capacity = math.ceil(bloom_filter.count * GROWTH_FACTOR)
+            logger.warning("Pseudonym filter is over capacity, sizing the next build for %d pseudonyms", self.capacity)
+        logger.info("Built the pseudonym filter of %d pseudonyms in %.1fs", bloom_filter.count, monotonic() - start)
+
+    def invalidate(self) -> None:
+        """
+        Stops answering from the filter until it has been rebuilt, for when added pseudonyms may have been missed
+        """
+        with self._lock:
+            self._generation += 1
+            self._filter = None
+        self._rebuild.set()
+
+    def start(self, load: Callable[[], Iterable[str]]) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(load,), name="pseudonym-filter", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._rebuild.set()
+
+    def _run(self, load: Callable[[], Iterable[str]]) -> None:
+        while not self._stopped.is_set():
+            self._rebuild.clear()
+            try:
+                self.build(load)
+                interval = self.rebuild_interval
+            except Exception:
+                logger.exception("Could not build the pseudonym filter")
+                interval = min(self.rebuild_interval, RETRY_INTERVAL)
+
+            self._rebuild.wait(interval)
@@ -0,0 +1,404 @@
+import logging
+import os
+import threading
+from array import array
+from datetime import datetime, timedelta
+from time import monotonic, time
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+from uuid import UUID
+
+from app.db.db import Database
+from app.db.models.referral import ReferralEntity
+from app.db.repository.referral_repository import DeletedReferral, IndexRow, ReferralRepository
+from app.services.referral_snapshot import ReferralSnapshot, pseudonym_digest
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Empty hash slot and end of a chain of rows
+NO_ROW = -1
+# Pseudonyms per hash slot at most, the slots double beyond this
+MAX_LOAD = 0.75
+# Seconds before a failed initial load is retried
+RETRY_INTERVAL = 60
+
+
+def _digest(pseudonym: str) -> Tuple[int, int]:
+    digest = pseudonym_digest(pseudonym)
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+
+class ReferralTable:
+    """
+    The referrals needed for localization in flat columns instead of ORM entities, about 60 bytes per referral.
+    A pseudonym is kept as its 128 bit blake2b digest, URA numbers as integers and sources as codes into a
+    dictionary. An open addressing hash table on the digest points at the newest row of a pseudonym, rows of the
+    same pseudonym are chained. Removed rows stay as tombstones until the table is reloaded.
+
+    Readers do not lock, a row is complete before it is linked into the table. Writers are serialized.
+    """
+
+    def __init__(self, capacity: int = 0) -> None:
+        """
+        :param capacity: expected number of pseudonyms, sizes the hash table so loading does not have to grow it
+        """
+        self._digests = array("Q")
+        self._ids = bytearray()
+        self._ura_numbers = array("I")
+        self._sources = array("I")
+        self._created_at = array("q")
+        self._next = array("i")
+        self._deleted = bytearray()
+        self._source_names: List[str] = []
+        self._source_codes: Dict[str, int] = {}
+        size = 16
+        while size * MAX_LOAD < capacity:
+            size *= 2
+        self._slots = array("i", [NO_ROW]) * size
+        self._pseudonyms = 0
+        self._live = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._live
+
+    def nbytes(self) -> int:
+        """
+        Bytes used by the columns and the hash table
+        """
+        columns = (self._digests, self._ura_numbers, self._sources, self._created_at, self._next, self._slots)
+        return sum(len(column) * column.itemsize for column in columns) + len(self._ids) + len(self._deleted)
+
+    def get(self, pseudonym: str) -> List[ReferralEntity]:
+        """
+        Returns the referrals of the pseudonym as transient entities
+        """
+        referrals: List[ReferralEntity] = []
+        row = self._head(*_digest(pseudonym))[1]
+        while row != NO_ROW:
+            if not self._deleted[row]:
+                referrals.append(
+                    ReferralEntity(
+                        id=UUID(bytes=bytes(self._ids[row * 16 : row * 16 + 16])),
+                        pseudonym=pseudonym,
+                        ura_number=f"{self._ura_numbers[row]:08d}",
+                        source=self._source_names[self._sources[row]],
+                        created_at=EPOCH + self._created_at[row] * MICROSECOND,
+                    )
+                )
+            row = self._next[row]
+        return referrals
+
+    def add(self, id: UUID, pseudonym: str, ura_number: str, source: str, created_at: datetime) -> bool:
+        """
+        Adds a referral, returns False when its id is already present (or was removed)
+        """
+        high, low = _digest(pseudonym)
+        id_bytes = id.bytes
+        with self._lock:
+            slot, head = self._head(high, low)
+            if self._find(head, id_bytes) != NO_ROW:
+                return False
+
+            source_code = self._source_codes.get(source)
+            if source_code is None:
+                source_code = self._source_codes[source] = len(self._source_names)
+                self._source_names.append(source)
+
+            row = len(self._next)
+            self._digests.append(high)
+            self._digests.append(low)
+            self._ids += id_bytes
+            self._ura_numbers.append(int(ura_number))
+            self._sources.append(source_code)
+            self._created_at.append((created_at - EPOCH) // MICROSECOND)
+            self._deleted.append(0)
+            self._next.append(head)
+            self._slots[slot] = row
+            self._live += 1
+            if head == NO_ROW:
+                self._pseudonyms += 1
+                if self._pseudonyms > len(self._slots) * MAX_LOAD:
+                    self._grow()
+            return True
+
+    def remove(self, id: UUID, pseudonym: str) -> bool:
+        """
+        Marks a referral as removed, returns False when it is not present
+        """
+        high, low = _digest(pseudonym)
+        with self._lock:
+            row = self._find(self._head(high, low)[1], id.bytes)
+            if row == NO_ROW or self._deleted[row]:
+                return False
+
+            self._deleted[row] = 1
+            self._live -= 1
+            return True
+
+    def _head(self, high: int, low: int) -> Tuple[int, int]:
+        """
+        Returns the hash slot of the digest and the newest row in it, NO_ROW when the pseudonym is not present
+        """
+        slots = self._slots
+        digests = self._digests
+        mask = len(slots) - 1
+        slot = low & mask
+        while True:
+            row = slots[slot]
+            if row == NO_ROW or (digests[row * 2] == high and digests[row * 2 + 1] == low):
+                return slot, row
+            slot = (slot + 1) & mask
+
+    def _find(self, row: int, id_bytes: bytes) -> int:
+        while row != NO_ROW and self._ids[row * 16 : row * 16 + 16] != id_bytes:
+            row = self._next[row]
+        return row
+
+    def _grow(self) -> None:
+        slots = array("i", [NO_ROW]) * (len(self._slots) * 2)
+        mask = len(slots) - 1
+        for row in self._slots:
+            if row == NO_ROW:
+                continue
+            slot = self._digests[row * 2 + 1] & mask
+            while slots[slot] != NO_ROW:
+                slot = (slot + 1) & mask
+            slots[slot] = row
+        # Readers still probing the old slots find the same rows
+        self._slots = slots
+
+
+class _IndexState(NamedTuple):
+    # Referrals added after the snapshot, or all referrals when there is none
+    table: ReferralTable
+    snapshot: ReferralSnapshot | None
+    # Ids of snapshot referrals deleted after the snapshot was built
+    removed: Set[bytes]
+
+
+class ReferralIndex:
+    """
+    Answers localizations from memory instead of the database. It is loaded in a background thread and refreshed
+    every refresh_interval seconds: referrals created since the previous refresh are added on created_at and the
+    referrals in the deletion log, filled by a trigger, are removed. Both are re-read with `overlap` seconds of
+    margin for clock skew, replica lag and late commits, which is harmless as adding and removing are idempotent.
+    Until the first load has finished get() returns None.
+
+    With a snapshot_path the index maps a snapshot file written by write_snapshot() instead of loading every
+    referral in a ReferralTable of its own. The table then only holds the delta, the referrals created after the
+    snapshot was built, so all workers on a host share one copy through the page cache. A newer snapshot file is
+    picked up on the next refresh.
+
+    Writes of this instance are passed to add() and remove() so they are visible at once.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        refresh_interval: float,
+        overlap: float,
+        deletion_retention: float,
+        snapshot_path: str | None = None,
+    ) -> None:
+        """
+        :param refresh_interval: seconds between refreshes, writes of other instances are seen after at most this
+        :param overlap: seconds re-read before the newest created_at and deleted_at seen
+        :param deletion_retention: seconds deletion log entries are kept (ReferralService prunes the log), an
+            index that could not refresh for half of this is reloaded and an older snapshot is not used
+        :param snapshot_path: snapshot file to map instead of loading all referrals from the database
+        """
+        self.database = database
+        self.refresh_interval = refresh_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.deletion_retention = deletion_retention
+        self.snapshot_path = snapshot_path
+        # (inode, mtime) of the snapshot file when it was last opened, a replaced file is opened again
+        self._snapshot_file_id: Tuple[int, int] | None = None
+        self._state: _IndexState | None = None
+        self._created_since: datetime | None = None
+        self._deleted_since: datetime | None = None
+        self._refreshed_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self._state is not None
+
+    def __len__(self) -> int:
+        state = self._state
+        if state is None:
+            return 0
+        return len(state.table) + (len(state.snapshot) - len(state.removed) if state.snapshot is not None else 0)
+
+    def nbytes(self) -> int:
+        """
+        Bytes of the in-process table, without the shared snapshot mapping
+        """
+        return self._state.table.nbytes() if self._state is not None else 0
+
+    def get(self, pseudonym: str) -> List[ReferralEntity] | None:
+        state = self._state
+        if state is None:
+            return None
+
+        referrals = state.table.get(pseudonym)
+        if state.snapshot is not None:
+            referrals.extend(r for r in state.snapshot.get(pseudonym) if r.id.bytes not in state.removed)
+        return referrals
+
+    def add(self, referrals: Iterable[ReferralEntity]) -> None:
+        state = self._state
+        if state is not None:
+            for r in referrals:
+                self._add(state, (r.id, r.pseudonym, r.ura_number, r.source, r.created_at))
+
+    def remove(self, referrals: Iterable[DeletedReferral]) -> None:
+        state = self._state
+        if state is not None:
+            for r in referrals:
+                self._remove(state, r.id, r.pseudonym)
+
+    def refresh(self) -> None:
+        """
+        Applies the referrals created and deleted by any instance since the previous refresh, nothing when the
+        index has not been loaded yet
+        """
+        with self._refresh_lock:
+            state = self._state
+            if state is None:
+                return
+
+            with self.database.get_db_session() as session:
+                repo = session.get_repository(ReferralRepository)
+                created = repo.find_created_since(
+                    self._created_since - self.overlap if self._created_since is not None else datetime.min
+                )
+                deletions = repo.find_deletions_since(
+                    self._deleted_since - self.overlap if self._deleted_since is not None else None
+                )
+                for row in created:
+                    self._add(state, row)
+                    self._created_since = max(row[4], self._created_since or row[4])
+                for referral_id, pseudonym, deleted_at in deletions:
+                    self._remove(state, referral_id, pseudonym)
+                    self._deleted_since = max(deleted_at, self._deleted_since or deleted_at)
+
+            self._refreshed_at = monotonic()
+
+    def request_refresh(self) -> None:
+        """
+        Refreshes in the background now instead of after refresh_interval, e.g. when another instance wrote
+        """
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="referral-index", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+
+    def load(self) -> None:
+        """
+        Maps the snapshot file when there is a recent one, loads all referrals from the database otherwise.
+        Replaces the current state.
+        """
+        self._snapshot_file_id = self._current_snapshot_file_id()
+        snapshot = self._open_snapshot()
+        if snapshot is not None:
+            self._replace(_IndexState(ReferralTable(), snapshot, set()), snapshot.created_since, snapshot.deleted_since)
+            logger.info("Mapped the referral snapshot %s of %d referrals", snapshot.path, len(snapshot))
+            return
+
+        start = monotonic()
+        previous = self._state
+        table = ReferralTable(len(previous.table) if previous is not None and previous.snapshot is None else 0)
+        created_since: datetime | None = None
+        with self.database.get_streaming_db_session() as session:
+            repo = session.get_repository(ReferralRepository)
+            # Read before the referrals, deletions during the load are applied by the refresh that follows
+            deleted_since = repo.last_deletion()
+            for row in repo.stream_index_rows():
+                table.add(*row)
+                if created_since is None or row[4] > created_since:
+                    created_since = row[4]
+
+        self._replace(_IndexState(table, None, set()), created_since, deleted_since)
+        logger.info(
+            "Loaded the referral index of %d referrals, %d bytes, in %.1fs",
+            len(table),
+            table.nbytes(),
+            monotonic() - start,
+        )
+
+    def _replace(self, state: _IndexState, created_since: datetime | None, deleted_since: datetime | None) -> None:
+        with self._refresh_lock:
+            self._state = state
+            self._created_since = created_since
+            self._deleted_since = deleted_since
+            self._refreshed_at = monotonic()
+
+    def _open_snapshot(self) -> ReferralSnapshot | None:
+        if self.snapshot_path is None:
+            return None
+
+        try:
+            snapshot = ReferralSnapshot(self.snapshot_path)
+        except (OSError, ValueError):
+            logger.warning("Could not open the referral snapshot %s", self.snapshot_path, exc_info=True)
+            return None
+
+        # Deletions pruned from the log since the snapshot was built can no longer be applied to it
+        if time() - snapshot.built_at > self.deletion_retention / 2:
+            logger.warning("The referral snapshot %s is too old to be used, rebuild it", self.snapshot_path)
+            return None
+        return snapshot
+
+    def _current_snapshot_file_id(self) -> Tuple[int, int] | None:
+        if self.snapshot_path is None:
+            return None
+
+        try:
+            stat = os.stat(self.snapshot_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _snapshot_replaced(self) -> bool:
+        file_id = self._current_snapshot_file_id()
+        return file_id is not None and file_id != self._snapshot_file_id
+
+    @staticmethod
+    def _add(state: _IndexState, row: IndexRow) -> None:
+        if state.snapshot is None or not state.snapshot.contains(row[0], row[1]):
+            state.table.add(*row)
+
+    @staticmethod
+    def _remove(state: _IndexState, id: UUID, pseudonym: str) -> None:
+        if not state.table.remove(id, pseudonym) and state.snapshot is not None:
+            if state.snapshot.contains(id, pseudonym):
+                state.removed.add(id.bytes)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                # Deletions that have been pruned from the log before this instance applied them are lost
+                if (
+                    not self.ready
+                    or monotonic() - self._refreshed_at > self.deletion_retention / 2
+                    or self._snapshot_replaced()
+                ):
+                    self.load()
+                self.refresh()
+            except Exception:
+                logger.exception("Could not refresh the referral index")
+
+            self._wake.wait(self.refresh_interval if self.ready else RETRY_INTERVAL)
@@ -1,10 +1,14 @@
 import logging
-from typing import Sequence
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
 from uuid import UUID
 
 from app.db.db import Database
+from app.db.invalidation import FLUSH_KEY, InvalidationListener
 from app.db.models.referral import ReferralEntity
-from app.db.repository.referral_repository import ReferralRepository
+from app.db.repository.referral_repository import DeletedReferral, ReferralRepository
+from app.db.session import DbSession
 from app.logging.events import Log
 from app.models.pseudonym import EncryptedPseudonym
 from app.models.ura import UraNumber
@@ -12,16 +16,78 @@ from app.services.exceptions import (
     ConflictError,
     NotFoundError,
 )
+from app.services.localization_cache import LocalizationCache
+from app.services.pseudonym_filter import PseudonymFilter
+from app.services.referral_index import ReferralIndex
+from app.stats import get_stats
 
 logger = logging.getLogger(__name__)
 
+# Kinds of the keys, encrypted pseudonym values, published to other instances on a referral write. Added
+# pseudonyms have their own kind, a pseudonym filter only needs to follow those.
+REFERRAL_INVALIDATION_KIND = "referral"
+REFERRAL_ADDED_INVALIDATION_KIND = "referral_added"
+# Seconds between removals of old entries from the deletion log by one instance
+PRUNE_INTERVAL = 3600
+
+
+def _log_idempotent_registration(ura_number: UraNumber) -> None:
+    Log.event(
+        logger,
+        Log.IDEMPOTENT_REGISTRATION,
+        "Idempotent referral registration",
+        ura_number=str(ura_number),
+    )
+
+
+def _log_registered_referral(
+    organization_name: str, ura_number: UraNumber, encrypted_pseudonym: EncryptedPseudonym
+) -> None:
+    Log.event(
+        logger,
+        Log.REGISTERED_REFERRAL,
+        "Referral registered",
+        organization=organization_name,
+        ura_number=str(ura_number),
+        pseudonym_hash=str(encrypted_pseudonym),
+    )
+
 
 class ReferralService:
-    def __init__(self, database: Database) -> None:
+    def __init__(
+        self,
+        database: Database,
+        cache_size: int = 0,
+        cache_ttl: float = 60,
+        invalidation: InvalidationListener | None = None,
+        pseudonym_filter: PseudonymFilter | None = None,
+        referral_index: ReferralIndex | None = None,
+        deletion_retention: float = 86400,
+    ) -> None:
+        """
+        :param cache_size: pseudonyms of which the localization result is cached in memory, 0 disables the cache
+        :param cache_ttl: seconds a cached localization result is served, other workers see a change after at
+            most this long
+        :param invalidation: publishes the pseudonyms of writes, so other instances drop them from their cache
+        :param pseudonym_filter: answers lookups of pseudonyms without referrals without a query, see
+            stream_pseudonyms() to build it
+        :param referral_index: answers lookups on pseudonym from memory once it has been loaded
+        :param deletion_retention: seconds entries are kept in the deletion log, which deletes prune
+        """
         self.database = database
+        self.cache = LocalizationCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.invalidation = invalidation
+        self.pseudonym_filter = pseudonym_filter
+        self.referral_index = referral_index
+        self.deletion_retention = deletion_retention
+        self._pruned_at: float | None = None
 
-    def get_by_id(self, id: UUID) -> ReferralEntity:
-        with self.database.get_db_session() as session:
+    def get_by_id(self, id: UUID, requesting_ura: UraNumber | None = None) -> ReferralEntity:
+        """
+        :param requesting_ura: client doing the read, lets it see its own recent writes when reading from replicas
+        """
+        client_key = str(requesting_ura) if requesting_ura else None
+        with self.database.get_read_db_session(client_key) as session:
             repo = session.get_repository(ReferralRepository)
             referral = repo.find_by_id(id)
 
@@ -44,37 +110,60 @@ class ReferralService:
         with self.database.get_db_session() as session:
             referral_repository = session.get_repository(ReferralRepository)
 
-            if referral_repository.exists(
+            new_referral = referral_repository.insert_one(
                 pseudonym=encrypted_pseudonym.value,
                 ura_number=str(ura_number),
                 source=source,
-            ):
-                Log.event(
-                    logger,
-                    Log.IDEMPOTENT_REGISTRATION,
-                    "Idempotent referral registration",
-                    ura_number=str(ura_number),
-                )
+                key_id=key_id,
+            )
+            if new_referral is None:
+                _log_idempotent_registration(ura_number)
+                if self.pseudonym_filter is not None:
+                    # This can be the retry of a registration of which the publish failed, publish it again
+                    self._added([encrypted_pseudonym.value], [])
                 raise ConflictError()
 
-            new_referral: ReferralEntity = referral_repository.add_one(
-                ReferralEntity(
-                    pseudonym=encrypted_pseudonym.value,
-                    ura_number=str(ura_number),
-                    source=source,
-                    key_id=key_id,
-                )
-            )
+        self._added([encrypted_pseudonym.value], [new_referral])
+        self.database.record_write(str(ura_number))
+        _log_registered_referral(organization_name, ura_number, encrypted_pseudonym)
+        return new_referral
 
-            Log.event(
-                logger,
-                Log.REGISTERED_REFERRAL,
-                "Referral registered",
-                organization=organization_name,
-                ura_number=str(ura_number),
-                pseudonym_hash=str(encrypted_pseudonym),
+    def add_many(
+        self,
+        encrypted_pseudonyms: Sequence[EncryptedPseudonym],
+        ura_number: UraNumber,
+        source: str,
+        organization_name: str,
+        key_id: UUID,
+    ) -> List[ReferralEntity | None]:
+        """
+        Method that adds a batch of referrals to the database in one transaction. Returns per input
+        item the new referral, or None when the referral already existed.
+        """
+        with self.database.get_db_session() as session:
+            referral_repository = session.get_repository(ReferralRepository)
+            results = referral_repository.add_many(
+                [
+                    ReferralEntity(
+                        pseudonym=encrypted_pseudonym.value,
+                        ura_number=str(ura_number),
+                        source=source,
+                        key_id=key_id,
+                    )
+                    for encrypted_pseudonym in encrypted_pseudonyms
+                ]
             )
-            return new_referral
+
+        self._added([p.value for p in encrypted_pseudonyms], [r for r in results if r is not None])
+        self.database.record_write(str(ura_number))
+        for encrypted_pseudonym, referral in zip(encrypted_pseudonyms, results):
+            if referral is None:
+                _log_idempotent_registration(ura_number)
+                continue
+
+            _log_registered_referral(organization_name, ura_number, encrypted_pseudonym)
+
+        return results
 
     def get_one(
         self,
@@ -97,8 +186,34 @@ class ReferralService:
         ura_number: UraNumber | None = None,
         encrypted_pseudonym: EncryptedPseudonym | None = None,
         source: str | None = None,
+        requesting_ura: UraNumber | None = None,
     ) -> Sequence[ReferralEntity]:
-        with self.database.get_db_session() as session:
+        """
+        :param requesting_ura: client doing the read, lets it see its own recent writes when reading from replicas
+        """
+        if encrypted_pseudonym is not None and not self._might_exist(encrypted_pseudonym.value):
+            return []
+
+        if encrypted_pseudonym is not None and self.referral_index is not None:
+            indexed = self.referral_index.get(encrypted_pseudonym.value)
+            if indexed is not None:
+                return [
+                    r
+                    for r in indexed
+                    if (ura_number is None or r.ura_number == str(ura_number))
+                    and (source is None or r.source == source)
+                ]
+
+        # Only a localization, a lookup on the pseudonym alone, is cached
+        cache = self.cache if encrypted_pseudonym and ura_number is None and source is None else None
+        if cache is not None and encrypted_pseudonym is not None:
+            cached = cache.get(encrypted_pseudonym.value)
+            if cached is not None:
+                return cached
+            generation = cache.generation()
+
+        client = requesting_ura or ura_number
+        with self._read_session(str(client) if client else None, cache is not None) as session:
             repo = session.get_repository(ReferralRepository)
             referrals = repo.find_many(
                 ura_number=str(ura_number) if ura_number else None,
@@ -106,8 +221,100 @@ class ReferralService:
                 source=source,
             )
 
+        if cache is not None and encrypted_pseudonym is not None:
+            cache.put(encrypted_pseudonym.value, referrals, generation)
         return referrals
 
+    def get_many_by_pseudonyms(
+        self,
+        encrypted_pseudonyms: Sequence[EncryptedPseudonym],
+        requesting_ura: UraNumber | None = None,
+    ) -> Dict[str, List[ReferralEntity]]:
+        """
+        Returns the referrals of all URAs for many pseudonyms with a single query, grouped by pseudonym value.
+        A pseudonym without referrals is left out.
+
+        :param requesting_ura: client doing the read, lets it see its own recent writes when reading from replicas
+        """
+        grouped: Dict[str, List[ReferralEntity]] = {}
+        candidates = [p for p in encrypted_pseudonyms if self._might_exist(p.value)]
+        if self.referral_index is not None and self.referral_index.ready:
+            for encrypted_pseudonym in candidates:
+                indexed = self.referral_index.get(encrypted_pseudonym.value) or []
+                if indexed:
+                    grouped[encrypted_pseudonym.value] = indexed
+            return grouped
+
+        missing = [p.value for p in candidates]
+        if self.cache is not None:
+            missing = []
+            for encrypted_pseudonym in candidates:
+                cached = self.cache.get(encrypted_pseudonym.value)
+                if cached is None:
+                    missing.append(encrypted_pseudonym.value)
+                elif cached:
+                    grouped[encrypted_pseudonym.value] = cached
+            generation = self.cache.generation()
+
+        if not missing:
+            return grouped
+
+        with self._read_session(str(requesting_ura) if requesting_ura else None, self.cache is not None) as session:
+            repo = session.get_repository(ReferralRepository)
+            referrals = repo.find_by_pseudonyms(missing)
+
+        found: Dict[str, List[ReferralEntity]] = {}
+        for referral in referrals:
+            found.setdefault(referral.pseudonym, []).append(referral)
+
+        if self.cache is not None:
+            for pseudonym in missing:
+                self.cache.put(pseudonym, found.get(pseudonym, []), generation)
+
+        grouped.update(found)
+        return grouped
+
+    def get_page(
+        self,
+        ura_number: UraNumber,
+        count: int,
+        encrypted_pseudonym: EncryptedPseudonym | None = None,
+        source: str | None = None,
+        after: Tuple[datetime, UUID] | None = None,
+    ) -> Sequence[ReferralEntity]:
+        """
+        Returns a page of at most `count` referrals of a URA, ordered on (created_at, id)
+
+        :param after: (created_at, id) of the last referral of the previous page
+        """
+        with self.database.get_read_db_session(str(ura_number)) as session:
+            repo = session.get_repository(ReferralRepository)
+            return repo.find_page(
+                ura_number=str(ura_number),
+                count=count,
+                source=source,
+                pseudonym=encrypted_pseudonym.value if encrypted_pseudonym else None,
+                after=after,
+            )
+
+    def stream_many(
+        self,
+        ura_number: UraNumber,
+        encrypted_pseudonym: EncryptedPseudonym | None = None,
+        source: str | None = None,
+    ) -> Iterator[ReferralEntity]:
+        """
+        Yields all referrals of a URA, ordered on (created_at, id), without loading them in memory at once.
+        The session stays open until the iterator is exhausted or closed.
+        """
+        with self.database.get_streaming_db_session(str(ura_number)) as session:
+            repo = session.get_repository(ReferralRepository)
+            yield from repo.stream_many(
+                ura_number=str(ura_number),
+                source=source,
+                pseudonym=encrypted_pseudonym.value if encrypted_pseudonym else None,
+            )
+
     def delete_many(
         self,
         ura_number: UraNumber,
@@ -126,8 +333,52 @@ class ReferralService:
 
             session.commit()
 
+        if encrypted_pseudonym is not None:
+            self._invalidate([encrypted_pseudonym.value])
+        elif affected_rows:
+            self._invalidate_all()
+        if affected_rows:
+            self._refresh_index()
+            self._prune_deletions()
+        self.database.record_write(str(ura_number))
         return affected_rows
 
+    def count(self, ura_number: UraNumber, source: str | None = None) -> int:
+        with self.database.get_read_db_session(str(ura_number)) as session:
+            repo = session.get_repository(ReferralRepository)
+            return repo.count(ura_number=str(ura_number), source=source)
+
+    def delete_many_chunked(
+        self,
+        ura_number: UraNumber,
+        chunk_size: int,
+        source: str | None = None,
+        on_progress: Callable[[int], None] | None = None,
+    ) -> int:
+        """
+        Deletes all referrals of a URA in chunks of `chunk_size`, committing after every chunk so no single
+        transaction holds the row locks of the whole URA
+
+        :param on_progress: called with the total number of deleted referrals after every chunk
+        """
+        deleted_count = 0
+        with self.database.get_db_session() as session:
+            repo = session.get_repository(ReferralRepository)
+            while True:
+                deleted = repo.delete_chunk(ura_number=str(ura_number), chunk_size=chunk_size, source=source)
+                deleted_count += deleted
+                if on_progress is not None:
+                    on_progress(deleted_count)
+                if deleted < chunk_size:
+                    break
+
+        if deleted_count:
+            self._invalidate_all()
+            self._refresh_index()
+            self._prune_deletions()
+        self.database.record_write(str(ura_number))
+        return deleted_count
+
     def delete_one(
         self,
         encrypted_pseudonym: EncryptedPseudonym,
@@ -139,21 +390,118 @@ class ReferralService:
         """
         with self.database.get_db_session() as session:
             referral_repository = session.get_repository(ReferralRepository)
-            referral = referral_repository.find_one(
+            deleted = referral_repository.delete_by_key(
                 pseudonym=encrypted_pseudonym.value,
                 ura_number=str(ura_number),
                 source=source,
             )
-            if referral is None:
+            if deleted is None:
                 raise NotFoundError()
 
-            referral_repository.delete_one(referral)
+        self._removed([deleted])
+        self.database.record_write(str(ura_number))
 
-    def delete_by_id(self, id: UUID) -> None:
+    def delete_by_id(self, id: UUID, ura_number: UraNumber | None = None) -> DeletedReferral:
+        """
+        Deletes a referral by id and returns its id, pseudonym and ura_number
+
+        :param ura_number: only delete the referral when it belongs to this URA, NotFoundError otherwise
+        """
         with self.database.get_db_session() as session:
             repo = session.get_repository(ReferralRepository)
-            target = repo.find_by_id(id)
-            if target is None:
+            deleted = repo.delete_by_id(id, ura_number=str(ura_number) if ura_number else None)
+            if deleted is None:
                 raise NotFoundError()
 
-            repo.delete_one(target)
+        self._removed([deleted])
+        self.database.record_write(deleted.ura_number)
+        return deleted
+
+    def stream_pseudonyms(self) -> Iterator[str]:
+        """
+        Yields the pseudonym of every referral, to build the pseudonym filter from. Read from the primary: a
+        pseudonym a lagging replica misses would be reported absent until the next rebuild.
+        """
+        with self.database.get_streaming_db_session(primary=True) as session:
+            yield from session.get_repository(ReferralRepository).stream_pseudonyms()
+
+    def _might_exist(self, pseudonym: str) -> bool:
+        if self.pseudonym_filter is None or self.pseudonym_filter.might_contain(pseudonym):
+            return True
+
+        get_stats().inc("referral_service.pseudonym_filter.absent")
+        return False
+
+    def _added(self, pseudonyms: Sequence[str], referrals: Sequence[ReferralEntity]) -> None:
+        if self.pseudonym_filter is not None:
+            self.pseudonym_filter.add(pseudonyms)
+        if self.referral_index is not None:
+            self.referral_index.add(referrals)
+        # The pseudonym filters of other instances report a pseudonym of which they missed the publish as absent,
+        # so the write fails when the publish does
+        self._invalidate(pseudonyms, REFERRAL_ADDED_INVALIDATION_KIND, required=self.pseudonym_filter is not None)
+
+    def _removed(self, deleted: Sequence[DeletedReferral]) -> None:
+        if self.referral_index is not None:
+            self.referral_index.remove(deleted)
+        self._invalidate([d.pseudonym for d in deleted])
+        self._prune_deletions()
+
+    def _prune_deletions(self) -> None:
+        """
+        Removes the entries older than deletion_retention from the deletion log the delete trigger fills, whether
+        or not a referral index reads it. At most once per PRUNE_INTERVAL, a failure is only logged: the
+        referrals have been deleted already
+        """
+        now = monotonic()
+        if self._pruned_at is not None and now - self._pruned_at < PRUNE_INTERVAL:
+            return
+
+        self._pruned_at = now
+        try:
+            with self.database.get_db_session() as session:
+                repo = session.get_repository(ReferralRepository)
+                # Relative to the newest entry, so the clocks of the instances do not matter
+                last_deletion = repo.last_deletion()
+                if last_deletion is not None:
+                    pruned = repo.prune_deletions(last_deletion - timedelta(seconds=self.deletion_retention))
+                    logger.debug("Pruned %d entries from the referral deletion log", pruned)
+        except Exception:
+            logger.warning("Could not prune the referral deletion log", exc_info=True)
+
+    def _refresh_index(self) -> None:
+        """
+        Applies deletions of which the referrals are not known from the deletion log, in the background when
+        that fails: the referrals have been deleted already
+        """
+        if self.referral_index is None:
+            return
+
+        try:
+            self.referral_index.refresh()
+        except Exception:
+            logger.warning("Could not refresh the referral index after a delete", exc_info=True)
+            self.referral_index.request_refresh()
+
+    def _invalidate(
+        self, pseudonyms: Sequence[str], kind: str = REFERRAL_INVALIDATION_KIND, required: bool = False
+    ) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(pseudonyms)
+        if self.invalidation is not None:
+            self.invalidation.publish(kind, pseudonyms, required=required)
+
+    def _read_session(self, client_key: str | None, fills_cache: bool) -> DbSession:
+        """
+        A result that is cached is read from the primary: a lagging replica could still return referrals that were
+        just deleted and invalidated, which the cache would then serve for cache_ttl
+        """
+        if fills_cache:
+            return self.database.get_db_session()
+        return self.database.get_read_db_session(client_key)
+
+    def _invalidate_all(self) -> None:
+        if self.cache is not None:
+            self.cache.clear()
+        if self.invalidation is not None:
+            self.invalidation.publish(REFERRAL_INVALIDATION_KIND, [FLUSH_KEY])
@@ -0,0 +1,179 @@
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple
+from uuid import UUID
+
+from app.db.models.referral import ReferralEntity
+from app.db.repository.referral_repository import IndexRow
+
+MAGIC = b"NVIREF01"
+# magic, record count, built at (unix seconds), newest created_at and deleted_at in microseconds (-1 when none),
+# offset and length of the JSON list of sources
+HEADER = struct.Struct("<8sQdqqQQ")
+# pseudonym digest, referral id, URA number, source code, created_at in microseconds
+RECORD = struct.Struct("<16s16sIIq")
+DIGEST_SIZE = 16
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Records sorted in memory before they are written to a run file and merged, about 100 MB
+SORT_CHUNK_SIZE = 1_000_000
+NO_TIMESTAMP = -1
+
+
+def pseudonym_digest(pseudonym: str) -> bytes:
+    return hashlib.blake2b(pseudonym.encode(), digest_size=DIGEST_SIZE).digest()
+
+
+def _to_micros(value: datetime | None) -> int:
+    return NO_TIMESTAMP if value is None else (value - EPOCH) // MICROSECOND
+
+
+def _from_micros(value: int) -> datetime | None:
+    return None if value == NO_TIMESTAMP else EPOCH + value * MICROSECOND
+
+
+def write_snapshot(
+    path: str, rows: Iterable[IndexRow], deleted_since: datetime | None, chunk_size: int = SORT_CHUNK_SIZE
+) -> int:
+    """
+    Writes the referrals to a snapshot file sorted on pseudonym digest and returns their number. Rows are sorted
+    in chunks of chunk_size that are merged from temporary files next to `path`, so memory does not grow with the
+    number of referrals. The file is replaced atomically, workers reading the previous one are not affected.
+
+    :param deleted_since: newest deleted_at in the deletion log, read before the rows
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    sources: Dict[str, int] = {}
+    created_since: datetime | None = None
+    count = 0
+    with tempfile.TemporaryDirectory(dir=directory) as work_directory:
+        runs: List[str] = []
+        chunk: List[bytes] = []
+        for id, pseudonym, ura_number, source, created_at in rows:
+            source_code = sources.setdefault(source, len(sources))
+            chunk.append(
+                RECORD.pack(pseudonym_digest(pseudonym), id.bytes, int(ura_number), source_code, _to_micros(created_at))
+            )
+            if created_since is None or created_at > created_since:
+                created_since = created_at
+            count += 1
+            if len(chunk) >= chunk_size:
+                runs.append(_write_run(work_directory, chunk))
+                chunk = []
+        chunk.sort()
+
+        source_names = json.dumps(sorted(sources, key=sources.__getitem__)).encode()
+        temporary_path = os.path.join(work_directory, "snapshot")
+        with open(temporary_path, "wb") as file:
+            file.write(
+                HEADER.pack(
+                    MAGIC,
+                    count,
+                    time.time(),
+                    _to_micros(created_since),
+                    _to_micros(deleted_since),
+                    HEADER.size + count * RECORD.size,
+                    len(source_names),
+                )
+            )
+            run_files = [open(run, "rb", buffering=1 << 20) for run in runs]
+            try:
+                for record in heapq.merge(chunk, *(_read_run(run_file) for run_file in run_files)):
+                    file.write(record)
+            finally:
+                for run_file in run_files:
+                    run_file.close()
+            file.write(source_names)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    return count
+
+
+def _write_run(directory: str, chunk: List[bytes]) -> str:
+    chunk.sort()
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+        file.write(b"".join(chunk))
+        return file.name
+
+
+def _read_run(file: BinaryIO) -> Iterator[bytes]:
+    while record := file.read(RECORD.size):
+        yield record
+
+
+class ReferralSnapshot:
+    """
+    Read-only view of a snapshot file written by write_snapshot(). The file is memory mapped, so opening it is
+    instant whatever its size and the pages are shared through the page cache by every process that maps it.
+    A lookup is a binary search over the fixed width records.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Binary search touches a few scattered pages, read-ahead would only evict others from the page cache
+        if hasattr(mmap, "MADV_RANDOM"):
+            self._mmap.madvise(mmap.MADV_RANDOM)
+
+        magic, count, built_at, created_since, deleted_since, sources_offset, sources_length = HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != MAGIC or len(self._mmap) != sources_offset + sources_length:
+            raise ValueError(f"{path} is not a complete referral snapshot")
+
+        self.path = path
+        self.count: int = count
+        self.built_at: float = built_at
+        self.created_since = _from_micros(created_since)
+        self.deleted_since = _from_micros(deleted_since)
+        self.sources: List[str] = json.loads(self._mmap[sources_offset : sources_offset + sources_length])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get(self, pseudonym: str) -> List[ReferralEntity]:
+        """
+        Returns the referrals of the pseudonym as transient entities
+        """
+        return [
+            ReferralEntity(
+                id=UUID(bytes=id_bytes),
+                pseudonym=pseudonym,
+                ura_number=f"{ura_number:08d}",
+                source=self.sources[source_code],
+                created_at=EPOCH + created_at * MICROSECOND,
+            )
+            for id_bytes, ura_number, source_code, created_at in self._records(pseudonym)
+        ]
+
+    def contains(self, id: UUID, pseudonym: str) -> bool:
+        return any(record[0] == id.bytes for record in self._records(pseudonym))
+
+    def _records(self, pseudonym: str) -> Iterator[Tuple[bytes, int, int, int]]:
+        digest = pseudonym_digest(pseudonym)
+        data = self._mmap
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            if data[offset : offset + DIGEST_SIZE] < digest:
+                low = middle + 1
+            else:
+                high = middle
+
+        for index in range(low, self.count):
+            record_digest, id_bytes, ura_number, source_code, created_at = RECORD.unpack_from(
+                data, HEADER.size + index * RECORD.size
+            )
+            if record_digest != digest:
+                break
+            yield id_bytes, ura_number, source_code, created_at
@@ -8,3 +8,7 @@ def decode_url_safe_token(token: str) -> Dict[str, str]:
     decoded_token = base64.urlsafe_b64decode(encoded_token)
     data: Dict[str, str] = json.loads(decoded_token)
     return data
+
+
+def encode_url_safe_token(data: Dict[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
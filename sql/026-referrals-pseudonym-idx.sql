@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS referrals_pseudonym_idx ON referrals (pseudonym) INCLUDE (ura_number, source, created_at);
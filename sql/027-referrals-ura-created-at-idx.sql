@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS referrals_ura_created_at_idx ON referrals (ura_number, created_at, id);
@@ -0,0 +1,21 @@
+CREATE INDEX IF NOT EXISTS referrals_created_at_idx ON referrals (created_at);
+
+CREATE TABLE referral_deletions (
+    seq BIGSERIAL PRIMARY KEY,
+    referral_id UUID NOT NULL,
+    pseudonym VARCHAR NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX referral_deletions_deleted_at_idx ON referral_deletions (deleted_at);
+
+CREATE OR REPLACE FUNCTION log_referral_deletions() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO referral_deletions (referral_id, pseudonym) SELECT id, pseudonym FROM deleted_referrals;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER referrals_log_deletions AFTER DELETE ON referrals
+    REFERENCING OLD TABLE AS deleted_referrals
+    FOR EACH STATEMENT EXECUTE FUNCTION log_referral_deletions();
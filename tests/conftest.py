@@ -9,6 +9,7 @@ from app.db.models.key_info import KeyInfoEntity
 from app.db.models.referral import ReferralEntity
 from app.db.repository.key_info_repository import KeyInfoRepository
 from app.db.repository.referral_repository import ReferralRepository
+from app.db.session import get_circuit_breaker
 from app.models.ura import UraNumber
 from app.services.auth.header import AuthHeaderService
 from app.services.http import HttpService
@@ -28,6 +29,12 @@ def database() -> Generator[Database, Any, None]:
         db.engine.dispose()
 
 
+@pytest.fixture(autouse=True)
+def reset_circuit_breaker() -> Generator[None, Any, None]:
+    yield
+    get_circuit_breaker().reset()
+
+
 @pytest.fixture()
 def referral_repository(database: Database) -> ReferralRepository:
     return ReferralRepository(db_session=database.get_db_session())
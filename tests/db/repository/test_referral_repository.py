@@ -1,6 +1,9 @@
+from datetime import timedelta
+from typing import Any, List, Tuple
 from uuid import uuid4
 
 import pytest
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from app.config import ConfigDatabase
@@ -82,6 +85,31 @@ def test_find_many_should_return_two_item(
     assert expected == actual
 
 
+def test_find_by_pseudonyms_returns_referrals_of_all_pseudonyms(
+    referral_repository: ReferralRepository, mock_key_info: KeyInfoEntity
+) -> None:
+    referrals = [
+        ReferralEntity(ura_number=ura, pseudonym=pseudonym, source="Some-Device", key_info=mock_key_info)
+        for ura, pseudonym in [("0000123", "ps-1"), ("0000456", "ps-1"), ("0000123", "ps-2"), ("0000123", "ps-3")]
+    ]
+    with referral_repository.db_session:
+        for referral in referrals:
+            referral_repository.add_one(referral)
+
+        actual = referral_repository.find_by_pseudonyms(["ps-1", "ps-2", "ps-1", "ps-unknown"])
+
+    assert sorted((r.ura_number, r.pseudonym) for r in actual) == [
+        ("0000123", "ps-1"),
+        ("0000123", "ps-2"),
+        ("0000456", "ps-1"),
+    ]
+
+
+def test_find_by_pseudonyms_without_pseudonyms_returns_nothing(referral_repository: ReferralRepository) -> None:
+    with referral_repository.db_session:
+        assert referral_repository.find_by_pseudonyms([]) == []
+
+
 def test_find_many_with_alternative_params_should_succeed(
     referral_repository: ReferralRepository, mock_key_info: KeyInfoEntity
 ) -> None:
@@ -324,3 +352,193 @@ def test_exists_should_return_false_if_record_is_not_there(
         )
 
         assert exist is False
+
+
+def test_find_many_on_pseudonym_should_not_scan_table(
+    database: Database,
+    referral_repository: ReferralRepository,
+    mock_key_info: KeyInfoEntity,
+) -> None:
+    captured: List[Tuple[str, Any]] = []
+
+    def capture(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    with referral_repository.db_session:
+        for i in range(10):
+            referral_repository.add_one(
+                ReferralEntity(ura_number=f"{i:08}", pseudonym=f"ps-{i}", source="SomeDevice", key_info=mock_key_info)
+            )
+
+        event.listen(database.engine, "before_cursor_execute", capture)
+        try:
+            referral_repository.find_many(pseudonym="ps-1")
+        finally:
+            event.remove(database.engine, "before_cursor_execute", capture)
+
+        assert len(captured) == 1
+        statement, parameters = captured[0]
+        with database.engine.connect() as conn:
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+
+    details = [str(row[-1]) for row in plan]
+    assert any("referrals_pseudonym_idx" in d for d in details)
+    assert not any(d.startswith("SCAN referrals") for d in details)
+
+
+def test_insert_one_should_return_new_referral(
+    referral_repository: ReferralRepository,
+    mock_key_info: KeyInfoEntity,
+) -> None:
+    with referral_repository.db_session:
+        referral_repository.db_session.add(mock_key_info)
+        referral_repository.db_session.commit()
+
+        actual = referral_repository.insert_one(
+            pseudonym="ps-1", ura_number="0000123", source="SomeDevice", key_id=mock_key_info.id
+        )
+
+        assert actual is not None
+        assert actual.pseudonym == "ps-1"
+        assert actual.created_at is not None
+        assert referral_repository.find_by_id(actual.id) == actual
+
+
+def test_insert_one_should_return_none_when_referral_already_exists(
+    referral_repository: ReferralRepository,
+    mock_key_info: KeyInfoEntity,
+) -> None:
+    with referral_repository.db_session:
+        referral_repository.db_session.add(mock_key_info)
+        referral_repository.db_session.commit()
+
+        first = referral_repository.insert_one(
+            pseudonym="ps-1", ura_number="0000123", source="SomeDevice", key_id=mock_key_info.id
+        )
+        second = referral_repository.insert_one(
+            pseudonym="ps-1", ura_number="0000123", source="SomeDevice", key_id=mock_key_info.id
+        )
+
+        assert first is not None
+        assert second is None
+        assert len(referral_repository.find_many(pseudonym="ps-1")) == 1
+
+
+def test_add_many_should_return_status_per_row(
+    referral_repository: ReferralRepository,
+    mock_key_info: KeyInfoEntity,
+) -> None:
+    with referral_repository.db_session:
+        referral_repository.db_session.add(mock_key_info)
+        referral_repository.db_session.commit()
+        referral_repository.insert_one(
+            pseudonym="ps-1", ura_number="0000123", source="SomeDevice", key_id=mock_key_info.id
+        )
+
+        actual = referral_repository.add_many(
+            [
+                ReferralEntity(ura_number="0000123", pseudonym=p, source="SomeDevice", key_id=mock_key_info.id)
+                for p in ["ps-1", "ps-2", "ps-3", "ps-2"]
+            ]
+        )
+
+        assert [r.pseudonym if r is not None else None for r in actual] == [None, "ps-2", "ps-3", None]
+        assert len(referral_repository.find_many(ura_number="0000123")) == 3
+
+
+def test_find_page_and_stream_many_walk_ura_in_keyset_order(
+    referral_repository: ReferralRepository, mock_key_info: KeyInfoEntity
+) -> None:
+    with referral_repository.db_session:
+        referral_repository.db_session.add(mock_key_info)
+        referral_repository.db_session.commit()
+        for i in range(5):
+            referral_repository.insert_one(f"pseudonym-{i}", "00000123", "source", mock_key_info.id)
+        referral_repository.insert_one("pseudonym-other", "00000456", "source", mock_key_info.id)
+
+        streamed = list(referral_repository.stream_many(ura_number="00000123"))
+        first = referral_repository.find_page(ura_number="00000123", count=3)
+        last = first[-1]
+        second = referral_repository.find_page(ura_number="00000123", count=3, after=(last.created_at, last.id))
+
+    assert len(streamed) == 5
+    assert [(r.created_at, r.id) for r in streamed] == sorted((r.created_at, r.id) for r in streamed)
+    assert [r.id for r in first] + [r.id for r in second] == [r.id for r in streamed]
+
+
+def test_delete_chunk_deletes_at_most_chunk_size_referrals_of_ura(
+    referral_repository: ReferralRepository, mock_key_info: KeyInfoEntity
+) -> None:
+    with referral_repository.db_session:
+        referral_repository.db_session.add(mock_key_info)
+        referral_repository.db_session.commit()
+        for i in range(3):
+            referral_repository.insert_one(f"pseudonym-{i}", "00000123", "source", mock_key_info.id)
+        referral_repository.insert_one("pseudonym-other", "00000456", "source", mock_key_info.id)
+
+        assert referral_repository.delete_chunk(ura_number="00000123", chunk_size=2) == 2
+        assert referral_repository.count(ura_number="00000123") == 1
+        assert referral_repository.delete_chunk(ura_number="00000123", chunk_size=2) == 1
+        assert referral_repository.count(ura_number="00000123") == 0
+        assert referral_repository.count(ura_number="00000456") == 1
+
+
+def test_delete_by_id_returns_deleted_referral_in_one_statement(
+    database: Database, referral_repository: ReferralRepository, mock_key_info: KeyInfoEntity
+) -> None:
+    captured: List[str] = []
+
+    def capture(_conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+        captured.append(statement)
+
+    with referral_repository.db_session:
+        referral_repository.db_session.add(mock_key_info)
+        referral_repository.db_session.commit()
+        created = referral_repository.insert_one("pseudonym-1", "00000123", "source", mock_key_info.id)
+        assert created is not None
+
+        assert referral_repository.delete_by_id(created.id, ura_number="00000456") is None
+
+        event.listen(database.engine, "before_cursor_execute", capture)
+        try:
+            deleted = referral_repository.delete_by_id(created.id, ura_number="00000123")
+        finally:
+            event.remove(database.engine, "before_cursor_execute", capture)
+
+        assert referral_repository.find_by_id(created.id) is None
+
+    assert deleted == (created.id, "pseudonym-1", "00000123")
+    assert len(captured) == 1
+    assert captured[0].startswith("DELETE FROM referrals")
+
+
+def test_delete_by_key_returns_none_when_not_found(referral_repository: ReferralRepository) -> None:
+    with referral_repository.db_session:
+        assert referral_repository.delete_by_key("pseudonym-1", "00000123", "source") is None
+
+
+def test_deletions_are_logged_by_trigger_and_pruned(
+    referral_repository: ReferralRepository, mock_key_info: KeyInfoEntity
+) -> None:
+    with referral_repository.db_session:
+        referral_repository.db_session.add(mock_key_info)
+        referral_repository.db_session.commit()
+        kept = referral_repository.insert_one("pseudonym-1", "00000123", "source", mock_key_info.id)
+        deleted = referral_repository.insert_one("pseudonym-2", "00000123", "source", mock_key_info.id)
+        assert kept is not None and deleted is not None
+        assert referral_repository.last_deletion() is None
+
+        referral_repository.delete_many(ura_number="00000123", pseudonym="pseudonym-2")
+        referral_repository.db_session.commit()
+
+        deletions = referral_repository.find_deletions_since(None)
+        assert [(d[0], d[1]) for d in deletions] == [(deleted.id, "pseudonym-2")]
+        last_deletion = referral_repository.last_deletion()
+        assert last_deletion == deletions[0][2]
+        assert referral_repository.find_deletions_since(last_deletion) == deletions
+        assert [r[0] for r in referral_repository.find_created_since(kept.created_at)] == [kept.id]
+
+        assert referral_repository.prune_deletions(last_deletion) == 0
+        assert referral_repository.prune_deletions(last_deletion + timedelta(seconds=1)) == 1
+        assert referral_repository.last_deletion() is None
@@ -0,0 +1,119 @@
+from collections.abc import Generator
+from pathlib import Path
+from typing import Any
+
+import pytest
+from sqlalchemy import event
+
+from app.config import ConfigDatabase
+from app.db.db import Database
+from app.db.models.key_info import KeyInfoEntity
+from app.db.models.referral import ReferralEntity
+from app.db.repository.referral_repository import ReferralRepository
+
+
+def _make_database(dsn: str, **kwargs: Any) -> Database:
+    return Database(config_database=ConfigDatabase(dsn=dsn, retry_backoff=[], **kwargs))
+
+
+def _seed(database: Database, pseudonym: str) -> None:
+    key_info = KeyInfoEntity(label=f"label-{pseudonym}", mechanism="AES_CBC")
+    with database.get_db_session() as session:
+        session.add(key_info)
+        session.add(ReferralEntity(ura_number="00000123", pseudonym=pseudonym, source="SomeDevice", key_info=key_info))
+        session.commit()
+
+
+def _read_pseudonyms(database: Database, client_key: str | None = None) -> list[str]:
+    with database.get_read_db_session(client_key) as session:
+        return [r.pseudonym for r in session.get_repository(ReferralRepository).find_many()]
+
+
+@pytest.fixture()
+def replicated_database(tmp_path: Path) -> Generator[Database, Any, None]:
+    primary_dsn = f"sqlite:///{tmp_path}/primary.db"
+    replica_dsn = f"sqlite:///{tmp_path}/replica.db"
+
+    # Two separate files so we can tell which one served a read
+    replica = _make_database(replica_dsn)
+    replica.generate_tables()
+    _seed(replica, "only-on-replica")
+    replica.engine.dispose()
+
+    db = _make_database(primary_dsn, replica_dsns=[replica_dsn], read_your_writes_seconds=60)
+    db.generate_tables()
+    _seed(db, "only-on-primary")
+    try:
+        yield db
+    finally:
+        db.engine.dispose()
+        for engine in db.replica_engines:
+            engine.dispose()
+
+
+def test_read_session_should_use_replica(replicated_database: Database) -> None:
+    assert _read_pseudonyms(replicated_database) == ["only-on-replica"]
+
+
+def test_read_session_should_use_primary_without_replicas(database: Database) -> None:
+    _seed(database, "ps-1")
+
+    assert _read_pseudonyms(database) == ["ps-1"]
+
+
+def test_read_session_should_use_primary_after_client_wrote(replicated_database: Database) -> None:
+    replicated_database.record_write("00000123")
+
+    assert _read_pseudonyms(replicated_database, "00000123") == ["only-on-primary"]
+    assert _read_pseudonyms(replicated_database, "00000456") == ["only-on-replica"]
+
+
+def test_streaming_session_should_use_primary_when_asked(replicated_database: Database) -> None:
+    with replicated_database.get_streaming_db_session(primary=True) as session:
+        assert list(session.get_repository(ReferralRepository).stream_pseudonyms()) == ["only-on-primary"]
+
+
+def test_read_session_should_be_shared_within_request_session(replicated_database: Database) -> None:
+    with replicated_database.request_session() as primary:
+        first = replicated_database.get_read_db_session()
+        second = replicated_database.get_read_db_session()
+
+        assert first is second
+        assert first is not primary
+        assert first._retry_budget is primary._retry_budget is not None
+
+
+def test_release_request_session_should_return_connection_to_pool(database: Database) -> None:
+    _seed(database, "ps-1")
+    checkins: list[Any] = []
+    event.listen(database.engine, "checkin", lambda *args: checkins.append(args))
+
+    with database.request_session() as session:
+        referral = session.get_repository(ReferralRepository).find_many()[0]
+        database.release_request_session()
+
+        assert len(checkins) == 1
+        assert referral.pseudonym == "ps-1"
+        assert [r.pseudonym for r in session.get_repository(ReferralRepository).find_many()] == ["ps-1"]
+
+
+def test_read_session_should_fall_back_to_primary_when_replica_is_down(tmp_path: Path) -> None:
+    db = _make_database(
+        f"sqlite:///{tmp_path}/primary.db",
+        replica_dsns=[f"sqlite:///{tmp_path}/does-not-exist/replica.db"],
+    )
+    db.generate_tables()
+    _seed(db, "only-on-primary")
+
+    assert _read_pseudonyms(db) == ["only-on-primary"]
+    # the replica is now marked unhealthy and skipped without another attempt
+    assert db.get_read_db_session()._fallback_engine is None
+    assert _read_pseudonyms(db) == ["only-on-primary"]
+
+
+def test_replica_dsns_should_be_parsed_from_comma_separated_string() -> None:
+    config = ConfigDatabase.model_validate(
+        {"dsn": "sqlite:///:memory:", "replica_dsns": "postgresql://a/db, postgresql://b/db"}
+    )
+
+    assert config.replica_dsns == ["postgresql://a/db", "postgresql://b/db"]
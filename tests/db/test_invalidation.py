@@ -0,0 +1,131 @@
+import threading
+from types import SimpleNamespace
+from typing import Any, Iterator, List
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app.db.invalidation import FLUSH_KEY, MAX_PAYLOAD_BYTES, InvalidationListener
+from app.services.exceptions import DatabaseUnavailableError
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.keys: List[List[str]] = []
+        self.flushes = 0
+
+    def on_keys(self, keys: List[str]) -> None:
+        self.keys.append(keys)
+
+    def on_flush(self) -> None:
+        self.flushes += 1
+
+
+def make_engine(dialect: str = "postgresql") -> MagicMock:
+    engine = MagicMock()
+    engine.dialect.name = dialect
+    return engine
+
+
+@pytest.fixture()
+def recorder() -> Recorder:
+    return Recorder()
+
+
+def test_dispatch_hands_keys_to_subscribers_of_kind(recorder: Recorder) -> None:
+    listener = InvalidationListener(make_engine(), channel="nvi")
+    listener.subscribe("referral", recorder.on_keys, recorder.on_flush)
+    other = Recorder()
+    listener.subscribe("key_info", other.on_keys, other.on_flush)
+
+    listener.dispatch("referral\nps-1\nps-2")
+    listener.dispatch(f"referral\n{FLUSH_KEY}")
+
+    assert recorder.keys == [["ps-1", "ps-2"]]
+    assert recorder.flushes == 1
+    assert other.keys == [] and other.flushes == 0
+
+
+def test_dispatch_continues_after_failing_callback(recorder: Recorder) -> None:
+    listener = InvalidationListener(make_engine(), channel="nvi")
+    listener.subscribe("referral", MagicMock(side_effect=RuntimeError), recorder.on_flush)
+    listener.subscribe("referral", recorder.on_keys, recorder.on_flush)
+
+    listener.dispatch("referral\nps-1")
+
+    assert recorder.keys == [["ps-1"]]
+
+
+def test_publish_sends_keys_in_payloads_below_limit() -> None:
+    engine = make_engine()
+    listener = InvalidationListener(engine, channel="nvi")
+    keys = [f"{i:0100d}" for i in range(200)]
+
+    listener.publish("referral", keys)
+
+    conn = engine.begin.return_value.__enter__.return_value
+    payloads = [c.args[1]["payload"] for c in conn.execute.call_args_list]
+    assert len(payloads) == 3
+    assert all(len(p) < MAX_PAYLOAD_BYTES for p in payloads)
+    assert [key for p in payloads for key in p.split("\n")[1:]] == keys
+    assert all(p.startswith("referral\n") for p in payloads)
+    assert {c.args[1]["channel"] for c in conn.execute.call_args_list} == {"nvi"}
+
+
+def test_publish_logs_instead_of_raising() -> None:
+    engine = make_engine()
+    engine.begin.side_effect = OperationalError("SELECT", {}, Exception("down"))
+    listener = InvalidationListener(engine, channel="nvi")
+
+    listener.publish("referral", ["ps-1"])
+
+
+def test_publish_raises_when_required() -> None:
+    engine = make_engine()
+    engine.begin.side_effect = OperationalError("SELECT", {}, Exception("down"))
+    listener = InvalidationListener(engine, channel="nvi")
+
+    with pytest.raises(DatabaseUnavailableError):
+        listener.publish("referral_added", ["ps-1"], required=True)
+
+
+def test_publish_and_start_do_nothing_without_postgresql() -> None:
+    engine = make_engine("sqlite")
+    listener = InvalidationListener(engine, channel="nvi")
+
+    listener.publish("referral", ["ps-1"])
+    listener.start()
+
+    engine.begin.assert_not_called()
+    engine.raw_connection.assert_not_called()
+
+
+def test_listener_reconnects_and_flushes_after_missed_window(recorder: Recorder) -> None:
+    engine = make_engine()
+    listener = InvalidationListener(engine, channel="nvi", reconnect_backoff=[0.01], poll_interval=0.01)
+    listener.subscribe("referral", recorder.on_keys, recorder.on_flush)
+    done = threading.Event()
+
+    def notifies(timeout: float) -> Iterator[Any]:
+        if done.is_set():
+            return
+        yield SimpleNamespace(payload="referral\nps-1")
+        done.set()
+
+    connection = MagicMock()
+    connection.driver_connection.notifies.side_effect = notifies
+    engine.raw_connection.side_effect = [OperationalError("LISTEN", {}, Exception("down")), connection]
+
+    listener.start()
+    try:
+        assert done.wait(5)
+    finally:
+        listener.stop()
+
+    assert engine.raw_connection.call_count == 2
+    connection.detach.assert_called_once()
+    connection.close.assert_called_once()
+    # Flushed once when the LISTEN took effect, anything before it was missed
+    assert recorder.flushes == 1
+    assert recorder.keys == [["ps-1"]]
@@ -4,8 +4,9 @@ import pytest
 from pytest_mock import MockerFixture
 from sqlalchemy.exc import DataError, OperationalError
 
-from app.db.session import DbSession
+from app.db.session import CircuitBreaker, CircuitState, DbSession, RetryBudget, get_circuit_breaker
 from app.logging.events import Log
+from app.services.exceptions import DatabaseUnavailableError
 
 
 def _operational_error() -> OperationalError:
@@ -75,3 +76,88 @@ def test_retry_emits_db_schema_error_on_data_error_and_reraises(mocker: MockerFi
     assert kwargs["exception_type"] == "DataError"
     assert kwargs["value_length"] == 11
     assert kwargs["column_limit"] == 8
+
+
+def test_db_session_is_reentrant_and_closes_on_outermost_exit(mocker: MockerFixture) -> None:
+    session_cls = mocker.patch("app.db.session.Session")
+    session = DbSession(engine=MagicMock(), retry_backoff=[])
+
+    with session:
+        with session:
+            pass
+        session_cls.return_value.close.assert_not_called()
+
+    session_cls.assert_called_once()
+    session_cls.return_value.close.assert_called_once()
+
+
+def _failing_op() -> str:
+    raise _operational_error()
+
+
+def test_circuit_breaker_opens_after_threshold_and_fails_fast(mocker: MockerFixture) -> None:
+    mocker.patch("app.db.session.sleep")
+    mocker.patch("app.db.session._CIRCUIT_BREAKER", CircuitBreaker(failure_threshold=2, reset_timeout=30))
+    log_event = mocker.patch("app.db.session.Log.event")
+    session = DbSession(engine=MagicMock(), retry_backoff=[0.1, 0.2, 0.4])
+
+    with pytest.raises(DatabaseUnavailableError):
+        session._retry(_failing_op)
+
+    assert get_circuit_breaker().state == CircuitState.OPEN
+    state_changes = [c for c in log_event.call_args_list if c.args[1] is Log.DB_CIRCUIT_STATE_CHANGED]
+    assert len(state_changes) == 1
+    assert state_changes[0].kwargs["previous_state"] == "closed"
+    assert state_changes[0].kwargs["state"] == "open"
+
+    op = MagicMock(return_value="ok")
+    with pytest.raises(DatabaseUnavailableError):
+        session._retry(op)
+    op.assert_not_called()
+
+
+def test_circuit_breaker_half_opens_after_reset_timeout(mocker: MockerFixture) -> None:
+    now = {"t": 100.0}
+    mocker.patch("app.db.session.monotonic", side_effect=lambda: now["t"])
+    mocker.patch("app.db.session._CIRCUIT_BREAKER", CircuitBreaker(failure_threshold=1, reset_timeout=10))
+    log_event = mocker.patch("app.db.session.Log.event")
+    session = DbSession(engine=MagicMock(), retry_backoff=[0.1])
+
+    with pytest.raises(DatabaseUnavailableError):
+        session._retry(_failing_op)
+
+    now["t"] += 11
+    assert session._retry(lambda: "ok") == "ok"
+
+    assert get_circuit_breaker().state == CircuitState.CLOSED
+    states = [c.kwargs["state"] for c in log_event.call_args_list if c.args[1] is Log.DB_CIRCUIT_STATE_CHANGED]
+    assert states == ["open", "half_open", "closed"]
+
+
+def test_circuit_breaker_reopens_when_trial_call_fails(mocker: MockerFixture) -> None:
+    now = {"t": 100.0}
+    mocker.patch("app.db.session.monotonic", side_effect=lambda: now["t"])
+    mocker.patch("app.db.session._CIRCUIT_BREAKER", CircuitBreaker(failure_threshold=1, reset_timeout=10))
+    session = DbSession(engine=MagicMock(), retry_backoff=[0.1])
+
+    with pytest.raises(DatabaseUnavailableError):
+        session._retry(_failing_op)
+    now["t"] += 11
+    with pytest.raises(DatabaseUnavailableError):
+        session._retry(_failing_op)
+
+    assert get_circuit_breaker().state == CircuitState.OPEN
+
+
+def test_retry_budget_stops_retrying_when_exhausted(mocker: MockerFixture) -> None:
+    sleep = mocker.patch("app.db.session.sleep")
+    session = DbSession(engine=MagicMock(), retry_backoff=[0.1, 0.2, 0.4, 0.8], retry_budget=RetryBudget(0.35))
+
+    with pytest.raises(DatabaseUnavailableError):
+        session._retry(_failing_op)
+
+    assert sleep.call_count == 2
+    # The budget is shared by later calls on the same (request scoped) session
+    with pytest.raises(DatabaseUnavailableError):
+        session._retry(_failing_op)
+    assert sleep.call_count == 2
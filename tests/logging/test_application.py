@@ -5,6 +5,7 @@ import sys
 from unittest.mock import MagicMock
 
 import pytest
+from anyio import to_thread
 from pytest_mock import MockerFixture
 
 from app import application
@@ -63,6 +64,20 @@ def test_lifespan_logs_shutdown_reason_on_exit(use_config: Config, mocker: Mocke
     )
 
 
+def test_lifespan_sizes_worker_threads(use_config: Config, mocker: MockerFixture) -> None:
+    mocker.patch("app.application.Log.event")
+    use_config.app.worker_threads = 7
+    limits = []
+
+    async def _exercise() -> None:
+        async with application._lifespan(MagicMock()):
+            limits.append(to_thread.current_default_thread_limiter().total_tokens)
+
+    asyncio.run(_exercise())
+
+    assert limits == [7]
+
+
 def test_emit_app_started_logs_sys_app_started(use_config: Config, mocker: MockerFixture) -> None:
     mocker.patch("app.application._read_version", return_value="1.2.3")
     log_event = mocker.patch("app.application.Log.event")
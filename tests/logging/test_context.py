@@ -0,0 +1,18 @@
+from contextvars import ContextVar
+
+from app.logging.context import copy_log_context, request_id_var
+
+other_var: ContextVar[str] = ContextVar("other", default="-")
+
+
+def test_copy_log_context_keeps_only_log_fields() -> None:
+    request_token = request_id_var.set("request-1")
+    other_token = other_var.set("other-1")
+    try:
+        context = copy_log_context()
+    finally:
+        request_id_var.reset(request_token)
+        other_var.reset(other_token)
+
+    assert context.run(request_id_var.get) == "request-1"
+    assert context.run(other_var.get) == "-"
@@ -37,6 +37,24 @@ def test_log_event_uses_event_level(caplog: pytest.LogCaptureFixture, event: obj
     assert caplog.records[-1].levelno == expected_level
 
 
+def test_log_events_logs_one_record_per_item(caplog: pytest.LogCaptureFixture) -> None:
+    logger = logging.getLogger("app.test_events_bulk")
+    logger.setLevel(logging.DEBUG)
+    with caplog.at_level(logging.DEBUG, logger="app.test_events_bulk"):
+        Log.events(logger, Log.LOCALIZATION_NO_MATCH, "no match", [{"result_count": 0}, {"result_count": 0}])
+
+    assert [r.event_id for r in caplog.records] == [Log.LOCALIZATION_NO_MATCH.event_id] * 2  # type: ignore
+
+
+def test_log_events_skips_disabled_level(caplog: pytest.LogCaptureFixture) -> None:
+    logger = logging.getLogger("app.test_events_bulk_disabled")
+    logger.setLevel(logging.WARNING)
+    with caplog.at_level(logging.WARNING, logger="app.test_events_bulk_disabled"):
+        Log.events(logger, Log.LOCALIZATION_NO_MATCH, "no match", [{"result_count": 0}])
+
+    assert caplog.records == []
+
+
 def test_log_event_attaches_field_streams_for_routed_events(caplog: pytest.LogCaptureFixture) -> None:
     logger = logging.getLogger("app.test_events_routing")
     logger.setLevel(logging.DEBUG)
@@ -11,12 +11,15 @@ from app.db.db import Database
 from app.debug.crypto_service_api_client_mock import CryptoServiceApiClientMock
 from app.dependencies import (
     get_crypto_service_api_client,
+    get_database,
     get_key_info_service,
+    get_localization_list_service,
     get_referral_service,
 )
 from app.models.auth.context import AuthContext, AuthenticationClaims
 from app.models.auth.data import AuthorizationScope
 from app.models.ura import UraNumber
+from app.services.fhir.localization_list import LocalizationListService
 from app.services.key_info import KeyInfoService
 from app.services.referral_service import ReferralService
 from tests.test_config import get_test_config
@@ -98,9 +101,15 @@ def make_test_client(
     set_config(get_test_config())
     app = setup_fastapi()
 
+    app.dependency_overrides[get_database] = lambda: referral_service.database
     app.dependency_overrides[get_referral_service] = lambda: referral_service
     app.dependency_overrides[get_crypto_service_api_client] = lambda: crypto_client
     app.dependency_overrides[get_key_info_service] = lambda: key_info_service
+    app.dependency_overrides[get_localization_list_service] = lambda: LocalizationListService(
+        referral_service=referral_service,
+        crypto_client=crypto_client,
+        key_info_service=key_info_service,
+    )
 
     def override_auth_ctx(request: Request) -> AuthContext:
         request.state.auth = auth_context
@@ -0,0 +1,222 @@
+import threading
+from typing import Any
+from uuid import UUID
+
+import pytest
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+
+from app.debug.crypto_service_api_client_mock import CryptoServiceApiClientMock
+from app.dependencies import get_localization_list_service
+from app.logging.events import Log
+from app.models.fhir.resources.data import PSEUDONYM_SYSTEM
+from app.models.fhir.resources.localization_list.request import LocalizationListParams
+from app.models.ura import UraNumber
+from app.services.bulk_delete import BulkDeleteService
+from app.services.exceptions import CryptoServiceUnavailableError, DatabaseUnavailableError
+from app.services.fhir.localization_list import LocalizationListService
+from app.services.key_info import KeyInfoService
+from app.services.referral_service import ReferralService
+from app.utils.fhir import encode_url_safe_token
+from tests.routers.conftest import (
+    TEST_URA,
+    make_auth_context,
+    make_localize_auth_context,
+    make_test_client,
+)
+from tests.services.test_bulk_delete import wait_for
+
+
+@pytest.fixture()
+def localize_client(
+    referral_service: ReferralService,
+    crypto_client: CryptoServiceApiClientMock,
+    key_info_service: KeyInfoService,
+) -> TestClient:
+    return make_test_client(referral_service, crypto_client, key_info_service, make_localize_auth_context())
+
+
+@pytest.fixture()
+def seeded(
+    referral_service: ReferralService,
+    crypto_client: CryptoServiceApiClientMock,
+    key_info_service: KeyInfoService,
+) -> None:
+    key_info_service.add_one("nvi-label", "AES_CBC")
+    source_client = make_test_client(referral_service, crypto_client, key_info_service, make_auth_context())
+    for pseudonym in ("pseu-1", "pseu-2", "pseu-3"):
+        response = source_client.post("/registrations", json={"pseudonym": pseudonym, "oprf_key": "k"})
+        assert response.status_code == 200
+
+
+class TestQueryUraListing:
+    @pytest.mark.usefixtures("seeded")
+    def test_streams_bundle_without_count(self, localize_client: TestClient) -> None:
+        response = localize_client.get("/fhir/List")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/fhir+json")
+        bundle = response.json()
+        assert bundle["resourceType"] == "Bundle"
+        assert bundle["type"] == "searchset"
+        assert bundle["total"] == 3
+        assert len(bundle["entry"]) == 3
+        assert all(e["resource"]["resourceType"] == "List" for e in bundle["entry"])
+
+    def test_streams_empty_bundle(self, localize_client: TestClient) -> None:
+        response = localize_client.get("/fhir/List")
+
+        assert response.status_code == 200
+        assert response.json() == {"resourceType": "Bundle", "type": "searchset", "entry": [], "total": 0}
+
+    def test_returns_503_when_database_fails_before_streaming(
+        self, localize_client: TestClient, referral_service: ReferralService, mocker: MockerFixture
+    ) -> None:
+        mocker.patch.object(referral_service, "stream_many", side_effect=DatabaseUnavailableError())
+
+        response = localize_client.get("/fhir/List")
+
+        assert response.status_code == 503
+        assert response.json()["issue"][0]["code"] == "transient"
+
+    @pytest.mark.usefixtures("seeded")
+    def test_logs_query_when_stream_is_not_consumed(
+        self,
+        referral_service: ReferralService,
+        crypto_client: CryptoServiceApiClientMock,
+        key_info_service: KeyInfoService,
+        mocker: MockerFixture,
+    ) -> None:
+        log_event = mocker.patch("app.services.fhir.localization_list.Log.event")
+        service = LocalizationListService(
+            referral_service=referral_service, crypto_client=crypto_client, key_info_service=key_info_service
+        )
+        stream = service.query_stream(LocalizationListParams(), UraNumber(TEST_URA), organization_name="Test Org")
+
+        next(stream)
+        stream.close()  # type: ignore[attr-defined]
+
+        log_event.assert_called_once()
+        assert log_event.call_args.args[1] == Log.REFERRALS_QUERIED
+        assert log_event.call_args.kwargs["result_count"] == 0
+
+    @pytest.mark.usefixtures("seeded")
+    def test_paginates_with_count_and_next_link(self, localize_client: TestClient) -> None:
+        first = localize_client.get("/fhir/List", params={"_count": 2}).json()
+
+        assert len(first["entry"]) == 2
+        next_links = [link["url"] for link in first["link"] if link["relation"] == "next"]
+        assert len(next_links) == 1
+
+        second = localize_client.get(next_links[0]).json()
+
+        assert len(second["entry"]) == 1
+        assert [link["relation"] for link in second["link"]] == ["self"]
+        ids = {e["resource"]["id"] for e in first["entry"] + second["entry"]}
+        assert len(ids) == 3
+
+    def test_rejects_invalid_cursor(self, localize_client: TestClient) -> None:
+        response = localize_client.get("/fhir/List", params={"_count": 2, "_cursor": "not-a-cursor"})
+
+        assert response.status_code == 422
+
+
+class TestDeleteForQuery:
+    @pytest.mark.usefixtures("seeded")
+    def test_deletes_ura_listing_in_request_below_threshold(
+        self,
+        referral_service: ReferralService,
+        crypto_client: CryptoServiceApiClientMock,
+        key_info_service: KeyInfoService,
+    ) -> None:
+        client = make_test_client(referral_service, crypto_client, key_info_service, make_auth_context())
+
+        response = client.delete("/fhir/List")
+
+        assert response.status_code == 201
+        assert referral_service.count(UraNumber(TEST_URA)) == 0
+
+    @pytest.mark.usefixtures("seeded")
+    def test_runs_large_delete_in_background(
+        self,
+        referral_service: ReferralService,
+        crypto_client: CryptoServiceApiClientMock,
+        key_info_service: KeyInfoService,
+        mocker: MockerFixture,
+    ) -> None:
+        # The test database has a single connection, the job may only use it once the request is done with it
+        request_done = threading.Event()
+        delete_many_chunked = referral_service.delete_many_chunked
+
+        def delete_after_request(**kwargs: Any) -> int:
+            request_done.wait(5)
+            return delete_many_chunked(**kwargs)
+
+        mocker.patch.object(referral_service, "delete_many_chunked", side_effect=delete_after_request)
+        bulk_delete_service = BulkDeleteService(referral_service=referral_service, chunk_size=2)
+        client = make_test_client(referral_service, crypto_client, key_info_service, make_auth_context())
+        client.app.dependency_overrides[get_localization_list_service] = (  # type: ignore[attr-defined]
+            lambda: LocalizationListService(
+                referral_service=referral_service,
+                crypto_client=crypto_client,
+                key_info_service=key_info_service,
+                delete_chunk_size=2,
+                bulk_delete_service=bulk_delete_service,
+                background_delete_threshold=2,
+            )
+        )
+
+        try:
+            response = client.delete("/fhir/List")
+            request_done.set()
+
+            assert response.status_code == 202
+            status_url = response.headers["Content-Location"]
+            job_id = UUID(status_url.rsplit("/", 1)[1])
+            wait_for(bulk_delete_service.get(job_id, UraNumber(TEST_URA)))
+
+            status = client.get(status_url)
+            assert status.status_code == 200
+            assert status.json()["issue"][0]["details"]["text"] == "3 resources have been deleted successfully"
+            assert referral_service.count(UraNumber(TEST_URA)) == 0
+        finally:
+            bulk_delete_service.shutdown()
+
+
+class TestDelete:
+    def test_deletes_own_referral_and_hides_other_ura(
+        self,
+        referral_service: ReferralService,
+        crypto_client: CryptoServiceApiClientMock,
+        key_info_service: KeyInfoService,
+    ) -> None:
+        key_info_service.add_one("nvi-label", "AES_CBC")
+        client = make_test_client(referral_service, crypto_client, key_info_service, make_auth_context())
+        other_client = make_test_client(
+            referral_service, crypto_client, key_info_service, make_auth_context(ura="00000002")
+        )
+        client.post("/registrations", json={"pseudonym": "pseu", "oprf_key": "k"})
+        referral_id = referral_service.get_many(ura_number=UraNumber(TEST_URA))[0].id
+
+        assert other_client.delete(f"/fhir/List/{referral_id}").status_code == 404
+        assert client.delete(f"/fhir/List/{referral_id}").status_code == 201
+        assert client.delete(f"/fhir/List/{referral_id}").status_code == 404
+
+
+class TestCryptoServiceUnavailable:
+    def test_localize_returns_503_operation_outcome(
+        self,
+        localize_client: TestClient,
+        crypto_client: CryptoServiceApiClientMock,
+        key_info_service: KeyInfoService,
+        mocker: MockerFixture,
+    ) -> None:
+        key_info_service.add_one("nvi-label", "AES_CBC")
+        mocker.patch.object(crypto_client, "exchange", side_effect=CryptoServiceUnavailableError())
+        token = encode_url_safe_token({"evaluated_output": "jwe", "blind_factor": "bf"})
+
+        response = localize_client.get("/fhir/List", params={"subject:identifier": f"{PSEUDONYM_SYSTEM}|{token}"})
+
+        assert response.status_code == 503
+        assert response.headers["content-type"] == "application/fhir+json"
+        assert response.json()["issue"][0]["code"] == "transient"
@@ -1,7 +1,13 @@
+from typing import Any
+
 import pytest
 from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+from sqlalchemy import event
 
+from app.db.db import Database
 from app.debug.crypto_service_api_client_mock import CryptoServiceApiClientMock
+from app.logging.events import Log
 from app.models.auth.context import AuthContext, AuthenticationClaims
 from app.models.auth.data import AuthorizationScope
 from app.models.ura import UraNumber
@@ -42,6 +48,31 @@ def source_client(
 
 
 class TestLocalize:
+    def test_uses_one_pool_checkout_per_request(
+        self,
+        db: Database,
+        localize_client: TestClient,
+        source_client: TestClient,
+        key_info_service: KeyInfoService,
+    ) -> None:
+        key_info_service.add_one("nvi-label", "AES_CBC")
+        source_client.post("/registrations", json={"pseudonym": "pseu", "oprf_key": "k"})
+
+        checkouts: list[Any] = []
+
+        def on_checkout(*args: Any) -> None:
+            checkouts.append(args)
+
+        event.listen(db.engine, "checkout", on_checkout)
+        try:
+            response = localize_client.post("/localize", json={"pseudonym": "pseu", "oprf_key": "k"})
+        finally:
+            event.remove(db.engine, "checkout", on_checkout)
+
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        assert len(checkouts) == 1
+
     def test_returns_empty_when_no_registrations(
         self, localize_client: TestClient, key_info_service: KeyInfoService
     ) -> None:
@@ -119,3 +150,110 @@ class TestLocalize:
         client = make_test_client(referral_service, crypto_client, key_info_service, ctx_wrong_scope)
         response = client.post("/localize", json={"pseudonym": "pseu", "oprf_key": "k"})
         assert response.status_code == 403
+
+
+class TestLocalizeBatch:
+    def test_returns_results_per_input_index(
+        self,
+        localize_client: TestClient,
+        source_client: TestClient,
+        key_info_service: KeyInfoService,
+    ) -> None:
+        key_info_service.add_one("nvi-label", "AES_CBC")
+        source_client.post("/registrations", json={"pseudonym": "pseu-1", "oprf_key": "k"})
+        source_client.post("/registrations", json={"pseudonym": "pseu-3", "oprf_key": "k"})
+
+        response = localize_client.post(
+            "/localize/batch",
+            json={
+                "localizations": [
+                    {"pseudonym": "pseu-1", "oprf_key": "k"},
+                    {"pseudonym": "pseu-2", "oprf_key": "k"},
+                    {"pseudonym": "pseu-3", "oprf_key": "k"},
+                ]
+            },
+        )
+
+        assert response.status_code == 200
+        body = response.json()
+        assert [r["index"] for r in body["results"]] == [0, 1, 2]
+        assert [r["status"] for r in body["results"]] == ["found", "no-match", "found"]
+        assert body["results"][0]["registrations"][0]["ura_number"] == TEST_URA
+        assert body["results"][1]["registrations"] == []
+        assert (body["found"], body["no_match"], body["invalid"]) == (2, 1, 0)
+
+    def test_queries_referrals_once(
+        self,
+        db: Database,
+        localize_client: TestClient,
+        key_info_service: KeyInfoService,
+    ) -> None:
+        key_info_service.add_one("nvi-label", "AES_CBC")
+        statements: list[str] = []
+
+        def before_execute(_conn: Any, _cursor: Any, statement: str, *args: Any) -> None:
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_execute)
+        try:
+            response = localize_client.post(
+                "/localize/batch",
+                json={"localizations": [{"pseudonym": f"pseu-{i}", "oprf_key": "k"} for i in range(20)]},
+            )
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_execute)
+
+        assert response.status_code == 200
+        assert len([s for s in statements if "FROM referrals" in s]) == 1
+
+    def test_marks_invalid_items(
+        self,
+        localize_client: TestClient,
+        crypto_client: CryptoServiceApiClientMock,
+        key_info_service: KeyInfoService,
+        mocker: MockerFixture,
+    ) -> None:
+        key_info_service.add_one("nvi-label", "AES_CBC")
+        mocker.patch.object(
+            crypto_client,
+            "exchange_many",
+            return_value=[ValueError("Invalid pseudonym or oprf_key"), crypto_client.exchange("p", "k", "l", "m")],
+        )
+
+        response = localize_client.post(
+            "/localize/batch",
+            json={"localizations": [{"pseudonym": "bad", "oprf_key": "k"}, {"pseudonym": "p", "oprf_key": "k"}]},
+        )
+
+        assert response.status_code == 200
+        body = response.json()
+        assert [r["status"] for r in body["results"]] == ["invalid", "no-match"]
+        assert body["results"][0]["error"] == "Invalid pseudonym or oprf_key"
+
+    def test_rejects_empty_batch(self, localize_client: TestClient) -> None:
+        response = localize_client.post("/localize/batch", json={"localizations": []})
+
+        assert response.status_code == 422
+
+    def test_logs_localization_failed(self, localize_client: TestClient, mocker: MockerFixture) -> None:
+        log_event = mocker.patch("app.errors.handlers.Log.event")
+
+        response = localize_client.post("/localize/batch", json={"localizations": []})
+
+        assert response.status_code == 422
+        failures = [c for c in log_event.call_args_list if c.args[1] is Log.LOCALIZATION_FAILED]
+        assert [c.kwargs["http_status"] for c in failures] == [422]
+
+    def test_requires_localize_scope(
+        self,
+        referral_service: ReferralService,
+        crypto_client: CryptoServiceApiClientMock,
+        key_info_service: KeyInfoService,
+    ) -> None:
+        client = make_test_client(
+            referral_service, crypto_client, key_info_service, make_auth_context(scopes=[AuthorizationScope.READ])
+        )
+
+        response = client.post("/localize/batch", json={"localizations": [{"pseudonym": "pseu", "oprf_key": "k"}]})
+
+        assert response.status_code == 403
@@ -1,6 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 
+from app.db.session import get_circuit_breaker
 from app.debug.crypto_service_api_client_mock import CryptoServiceApiClientMock
 from app.models.auth.data import AuthorizationScope
 from app.services.exceptions import InvalidKeyInfoError
@@ -43,6 +44,21 @@ class TestCreateRegistration:
         assert body["source_id"] == TEST_SOURCE_ID
         assert "created_at" in body
 
+    def test_returns_503_when_database_circuit_is_open(
+        self, source_client: TestClient, key_info_service: KeyInfoService
+    ) -> None:
+        key_info_service.add_one("nvi-label", mechanism="AES_CBC")
+        breaker = get_circuit_breaker()
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        response = source_client.post(
+            "/registrations",
+            json={"pseudonym": "pseu", "oprf_key": "key1"},
+        )
+
+        assert response.status_code == 503
+
     def test_creates_should_raise_when_no_key_registerd(self, source_client: TestClient) -> None:
         with pytest.raises(InvalidKeyInfoError):
             source_client.post(
@@ -73,6 +89,59 @@ class TestCreateRegistration:
         assert response.status_code == 400
 
 
+# ---------------------------------------------------------------------------
+# POST /registrations/batch
+# ---------------------------------------------------------------------------
+
+
+class TestCreateRegistrationBatch:
+    def test_creates_registrations_with_per_item_status(
+        self, source_client: TestClient, key_info_service: KeyInfoService
+    ) -> None:
+        key_info_service.add_one("nvi-label", mechanism="AES_CBC")
+        source_client.post("/registrations", json={"pseudonym": "pseu-1", "oprf_key": "key1"})
+
+        response = source_client.post(
+            "/registrations/batch",
+            json={
+                "registrations": [
+                    {"pseudonym": "pseu-1", "oprf_key": "key1"},
+                    {"pseudonym": "pseu-2", "oprf_key": "key1"},
+                    {"pseudonym": "pseu-2", "oprf_key": "key1"},
+                ]
+            },
+        )
+
+        assert response.status_code == 200
+        body = response.json()
+        assert [r["status"] for r in body["results"]] == ["duplicate", "created", "duplicate"]
+        assert [r["index"] for r in body["results"]] == [0, 1, 2]
+        assert body["results"][1]["registration"]["source_id"] == TEST_SOURCE_ID
+        assert body["created"] == 1
+        assert body["duplicates"] == 2
+        assert body["invalid"] == 0
+
+    def test_rejects_empty_batch(self, source_client: TestClient, key_info_service: KeyInfoService) -> None:
+        key_info_service.add_one("nvi-label", mechanism="AES_CBC")
+
+        response = source_client.post("/registrations/batch", json={"registrations": []})
+
+        assert response.status_code == 422
+
+    def test_requires_create_scope(
+        self,
+        referral_service: ReferralService,
+        crypto_client: CryptoServiceApiClientMock,
+        key_info_service: KeyInfoService,
+    ) -> None:
+        ctx = make_auth_context(scopes=[AuthorizationScope.READ])
+        client = make_test_client(referral_service, crypto_client, key_info_service, ctx)
+        response = client.post(
+            "/registrations/batch", json={"registrations": [{"pseudonym": "pseu", "oprf_key": "key1"}]}
+        )
+        assert response.status_code == 403
+
+
 # ---------------------------------------------------------------------------
 # GET /registrations
 # ---------------------------------------------------------------------------
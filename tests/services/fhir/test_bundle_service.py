@@ -1,12 +1,17 @@
-from typing import Any, List, Literal
+import threading
+import time
+from typing import Any, Generator, List, Literal
+from unittest.mock import MagicMock
 from uuid import uuid4
 
 import pytest
 
 from app.models.auth.context import AuthContext, AuthenticationClaims
 from app.models.auth.data import AuthorizationScope
-from app.models.fhir.bundle import BundleEntry, EntryRequest
+from app.models.fhir.bundle import Bundle, BundleEntry, EntryRequest
+from app.models.fhir.resources.data import DEVICE_SYSTEM, PSEUDONYM_SYSTEM
 from app.models.fhir.resources.localization_list.resource import LocalizationList
+from app.models.pseudonym import PseudonymResponse
 from app.models.ura import UraNumber
 from app.services.fhir.bundle import BundleService
 
@@ -34,6 +39,11 @@ class LocalizationListServiceSpy:
 
     def __init__(self) -> None:
         self.calls: List[str] = []
+        self.exchanged: List[List[str]] = []
+
+    def exchange_tokens(self, tokens: List[str]) -> Any:
+        self.exchanged.append(tokens)
+        return [f"pseudonym-of-{token}" for token in tokens]
 
     def create(self, *_args: Any, **_kwargs: Any) -> Any:
         self.calls.append("create")
@@ -316,3 +326,249 @@ class TestManagingRequest:
         message = str(result.response.outcome.model_dump())
         assert "Bundle.entry.2" in message
         assert "source_id" in message
+
+
+def subject_url(pseudonym: str) -> str:
+    return f"List?subject:identifier={PSEUDONYM_SYSTEM}|{pseudonym}&_count=10"
+
+
+def subject_source_url(pseudonym: str) -> str:
+    return f"List?subject:identifier={PSEUDONYM_SYSTEM}|{pseudonym}&source:identifier={DEVICE_SYSTEM}|device"
+
+
+class TestExchangeEntries:
+    def test_exchanges_all_tokens_in_one_call(
+        self,
+        bundle_service: BundleService,
+        service: LocalizationListServiceSpy,
+    ) -> None:
+        entries = [
+            make_entry("GET", subject_url("pseudonym-value")),
+            make_entry("DELETE", ID_URL),
+            make_entry("DELETE", subject_url("other-value")),
+        ]
+
+        results: List[Any] = bundle_service.exchange_entries(make_ctx(ALL_SCOPES), entries)
+
+        assert service.exchanged == [["pseudonym-value", "other-value"]]
+        assert results == ["pseudonym-of-pseudonym-value", None, "pseudonym-of-other-value"]
+
+    def test_skips_entries_that_will_be_denied(
+        self,
+        bundle_service: BundleService,
+        service: LocalizationListServiceSpy,
+    ) -> None:
+        entries = [make_entry("GET", subject_url("pseudonym-value")), make_entry("DELETE", subject_url("other-value"))]
+
+        results: List[Any] = bundle_service.exchange_entries(
+            make_ctx([AuthorizationScope.LOCALIZE], source_id=None), entries
+        )
+
+        assert service.exchanged == [["pseudonym-value"]]
+        assert results == ["pseudonym-of-pseudonym-value", None]
+
+    def test_does_not_call_crypto_service_without_tokens(
+        self,
+        bundle_service: BundleService,
+        service: LocalizationListServiceSpy,
+    ) -> None:
+        results = bundle_service.exchange_entries(make_ctx(ALL_SCOPES), [make_entry("GET", ID_URL)])
+
+        assert service.exchanged == []
+        assert results == [None]
+
+
+class OrderedServiceSpy(LocalizationListServiceSpy):
+    """
+    Exchanges every token to a pseudonym of the same value and makes queries on "slow" take a while, so entries
+    that are not kept in order finish out of order.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.lock = threading.Lock()
+
+    def exchange_tokens(self, tokens: List[str]) -> Any:
+        return [PseudonymResponse(encrypted_pseudonym=token, iv="iv") for token in tokens]
+
+    def query(self, params: Any, *_args: Any, **_kwargs: Any) -> Any:
+        if params.subject == "slow":
+            time.sleep(0.05)
+        with self.lock:
+            self.calls.append(f"query-{params.subject}")
+        return None
+
+    def create(self, resource: Any, *_args: Any, **_kwargs: Any) -> Any:
+        with self.lock:
+            self.calls.append(f"create-{resource.get_encoded_pseudonym()}")
+        return None
+
+    def delete(self, *_args: Any, **_kwargs: Any) -> Any:
+        with self.lock:
+            self.calls.append("delete")
+        return None, 200
+
+
+def make_list(pseudonym: str) -> LocalizationList:
+    resource = MagicMock(spec=LocalizationList)
+    resource.get_encoded_pseudonym.return_value = pseudonym
+    return resource
+
+
+def make_bundle(entries: List[BundleEntry[Any]], type: Literal["searchset", "transaction"]) -> Bundle[Any]:
+    return Bundle[Any](type=type, entry=entries)
+
+
+class TestProcessEntries:
+    @pytest.fixture()
+    def ordered_service(self) -> OrderedServiceSpy:
+        return OrderedServiceSpy()
+
+    @pytest.fixture()
+    def parallel_bundle_service(self, ordered_service: OrderedServiceSpy) -> Generator[BundleService, None, None]:
+        service = BundleService(ordered_service, concurrency=4)  # type: ignore[arg-type]
+        try:
+            yield service
+        finally:
+            service.shutdown()
+
+    def test_keeps_response_order(
+        self, parallel_bundle_service: BundleService, ordered_service: OrderedServiceSpy
+    ) -> None:
+        entries = [
+            make_entry("GET", subject_url("slow")),
+            make_entry("GET", ID_URL),
+            make_entry("GET", subject_source_url("b")),
+        ]
+
+        results = parallel_bundle_service.process_entries(make_ctx(ALL_SCOPES), make_bundle(entries, "searchset"))
+
+        assert len(results) == 3
+        assert [r.response.status if r.response else None for r in results] == ["200", "200", "200"]
+        # The slow first entry did not hold up the others
+        assert ordered_service.calls[-1] == "query-slow"
+
+    def test_transaction_keeps_entries_on_the_same_pseudonym_in_order(
+        self, parallel_bundle_service: BundleService, ordered_service: OrderedServiceSpy
+    ) -> None:
+        entries = [
+            make_entry("GET", subject_url("slow")),
+            make_entry("POST", "List", make_list("slow")),
+            make_entry("GET", subject_source_url("b")),
+        ]
+
+        parallel_bundle_service.process_entries(make_ctx(ALL_SCOPES), make_bundle(entries, "transaction"))
+
+        assert ordered_service.calls.index("query-slow") < ordered_service.calls.index("create-slow")
+        assert ordered_service.calls.index("query-b") < ordered_service.calls.index("query-slow")
+
+    def test_transaction_delete_without_pseudonym_waits_for_earlier_entries(
+        self, parallel_bundle_service: BundleService, ordered_service: OrderedServiceSpy
+    ) -> None:
+        entries = [
+            make_entry("GET", subject_url("slow")),
+            make_entry("DELETE", ID_URL),
+            make_entry("GET", subject_source_url("b")),
+        ]
+
+        parallel_bundle_service.process_entries(make_ctx(ALL_SCOPES), make_bundle(entries, "transaction"))
+
+        assert ordered_service.calls == ["query-slow", "delete", "query-b"]
+
+    def test_transaction_search_without_pseudonym_sees_earlier_writes(
+        self, parallel_bundle_service: BundleService, ordered_service: OrderedServiceSpy
+    ) -> None:
+        created: List[str] = []
+
+        def create(resource: Any, *_args: Any, **_kwargs: Any) -> Any:
+            time.sleep(0.05)
+            created.append(resource.get_encoded_pseudonym())
+            return None
+
+        def query(params: Any, *_args: Any, **_kwargs: Any) -> Any:
+            return Bundle[Any](type="searchset", total=len(created), entry=[])
+
+        ordered_service.create = create  # type: ignore[method-assign]
+        ordered_service.query = query  # type: ignore[method-assign]
+        entries = [
+            make_entry("POST", "List", make_list("a")),
+            make_entry("GET", f"List?source:identifier={DEVICE_SYSTEM}|device&_count=10"),
+        ]
+
+        results = parallel_bundle_service.process_entries(make_ctx(ALL_SCOPES), make_bundle(entries, "transaction"))
+
+        search = results[1].resource
+        assert search is not None and search.total == 1
+
+    def test_isolates_entry_errors(
+        self, parallel_bundle_service: BundleService, ordered_service: OrderedServiceSpy
+    ) -> None:
+        def fail(*_args: Any, **_kwargs: Any) -> Any:
+            raise RuntimeError("boom")
+
+        ordered_service.create = fail  # type: ignore[method-assign]
+        entries = [make_entry("POST", "List", make_list("a")), make_entry("GET", subject_source_url("b"))]
+
+        results = parallel_bundle_service.process_entries(make_ctx(ALL_SCOPES), make_bundle(entries, "searchset"))
+
+        assert [r.response.status if r.response else None for r in results] == ["500", "200"]
+
+
+class GroupedServiceSpy(OrderedServiceSpy):
+    def __init__(self) -> None:
+        super().__init__()
+        self.grouped: List[List[str]] = []
+
+    def query_many(self, pseudonyms: List[PseudonymResponse], *_args: Any, **_kwargs: Any) -> Any:
+        self.grouped.append([p.encrypted_pseudonym for p in pseudonyms])
+        return [Bundle[Any](total=index, entry=[]) for index in range(len(pseudonyms))]
+
+
+class TestQueryEntries:
+    @pytest.fixture()
+    def grouped_service(self) -> GroupedServiceSpy:
+        return GroupedServiceSpy()
+
+    @pytest.fixture()
+    def grouped_bundle_service(self, grouped_service: GroupedServiceSpy) -> BundleService:
+        return BundleService(grouped_service)  # type: ignore[arg-type]
+
+    def test_runs_localization_searches_as_one_query(
+        self, grouped_bundle_service: BundleService, grouped_service: GroupedServiceSpy
+    ) -> None:
+        entries = [
+            make_entry("GET", subject_url("a")),
+            make_entry("GET", subject_source_url("b")),
+            make_entry("GET", subject_url("c")),
+        ]
+
+        results = grouped_bundle_service.process_entries(make_ctx(ALL_SCOPES), make_bundle(entries, "searchset"))
+
+        assert grouped_service.grouped == [["a", "c"]]
+        assert grouped_service.calls == ["query-b"]
+        assert [r.resource.total if r.resource else None for r in results] == [0, None, 1]
+
+    def test_search_after_write_on_same_pseudonym_is_not_grouped(
+        self, grouped_bundle_service: BundleService, grouped_service: GroupedServiceSpy
+    ) -> None:
+        entries = [
+            make_entry("GET", subject_url("a")),
+            make_entry("POST", "List", make_list("c")),
+            make_entry("GET", subject_url("b")),
+            make_entry("GET", subject_url("c")),
+        ]
+
+        grouped_bundle_service.process_entries(make_ctx(ALL_SCOPES), make_bundle(entries, "transaction"))
+
+        assert grouped_service.grouped == [["a", "b"]]
+        assert grouped_service.calls == ["create-c", "query-c"]
+
+    def test_single_search_is_not_grouped(
+        self, grouped_bundle_service: BundleService, grouped_service: GroupedServiceSpy
+    ) -> None:
+        grouped_bundle_service.process_entries(
+            make_ctx(ALL_SCOPES), make_bundle([make_entry("GET", subject_url("a"))], "searchset")
+        )
+
+        assert grouped_service.grouped == []
+        assert grouped_service.calls == ["query-a"]
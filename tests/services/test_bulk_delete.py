@@ -0,0 +1,62 @@
+import time
+from collections.abc import Generator
+from typing import Any
+from uuid import uuid4
+
+import pytest
+
+from app.models.pseudonym import EncryptedPseudonym
+from app.models.ura import UraNumber
+from app.services.bulk_delete import BulkDeleteJob, BulkDeleteService, BulkDeleteStatus
+from app.services.exceptions import NotFoundError
+from app.services.key_info import KeyInfoService
+from app.services.referral_service import ReferralService
+
+
+def wait_for(job: BulkDeleteJob, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while job.status == BulkDeleteStatus.IN_PROGRESS:
+        assert time.monotonic() < deadline, "background delete did not finish"
+        time.sleep(0.01)
+
+
+@pytest.fixture()
+def bulk_delete_service(referral_service: ReferralService) -> Generator[BulkDeleteService, Any, None]:
+    service = BulkDeleteService(referral_service=referral_service, chunk_size=2)
+    yield service
+    service.shutdown()
+
+
+def test_start_deletes_all_referrals_of_ura_in_background(
+    bulk_delete_service: BulkDeleteService,
+    referral_service: ReferralService,
+    key_info_service: KeyInfoService,
+    ura_number: UraNumber,
+) -> None:
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    for i in range(3):
+        referral_service.add_one(
+            encrypted_pseudonym=EncryptedPseudonym(f"ps-{i}", "123"),
+            ura_number=ura_number,
+            source="SomeDevice",
+            organization_name="Test Org",
+            key_id=key_info.id,
+        )
+
+    job = bulk_delete_service.start(ura_number=ura_number, organization_name="Test Org")
+    wait_for(job)
+
+    assert bulk_delete_service.get(job.id, ura_number) is job
+    assert job.status == BulkDeleteStatus.COMPLETED
+    assert job.deleted_count == 3
+    assert referral_service.count(ura_number) == 0
+
+
+def test_get_hides_jobs_of_other_ura(bulk_delete_service: BulkDeleteService, ura_number: UraNumber) -> None:
+    job = bulk_delete_service.start(ura_number=ura_number, organization_name="Test Org")
+    wait_for(job)
+
+    with pytest.raises(NotFoundError):
+        bulk_delete_service.get(job.id, UraNumber("00000456"))
+    with pytest.raises(NotFoundError):
+        bulk_delete_service.get(uuid4(), ura_number)
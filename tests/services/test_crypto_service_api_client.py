@@ -1,11 +1,18 @@
+import threading
+import time
 from json import JSONDecodeError
-from unittest.mock import MagicMock
+from typing import Any, Generator, List
+from unittest.mock import MagicMock, call
 
 import pytest
+from pytest_mock import MockerFixture
 from requests.exceptions import ConnectionError, HTTPError, Timeout
 
+from app.config import ConfigCryptoServiceApi
+from app.db.session import CircuitState
 from app.models.pseudonym import PseudonymResponse
-from app.services.crypto_service_api_client import CryptoServiceApiClient
+from app.services.crypto_service_api_client import BATCH_RETRY_INTERVAL, CryptoServiceApiClient
+from app.services.exceptions import CryptoServiceUnavailableError
 
 
 @pytest.fixture()
@@ -43,6 +50,357 @@ def test_exchange_returns_hashed_pseudonym(crypto_client: CryptoServiceApiClient
     )
 
 
+def test_exchange_calls_before_exchange_first(crypto_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
+    calls: List[str] = []
+
+    def do_request(**_: Any) -> MagicMock:
+        calls.append("request")
+        return make_response({"encrypted_pseudonym": "abc", "iv": "123"})
+
+    crypto_client._before_exchange = lambda: calls.append("before_exchange")
+    http_mock.do_request.side_effect = do_request
+
+    crypto_client.exchange("some-jwe", "some-blind-factor", "some-label", "CBC_AES")
+
+    assert calls == ["before_exchange", "request"]
+
+
+@pytest.fixture()
+def batch_client(http_mock: MagicMock) -> Generator[CryptoServiceApiClient, None, None]:
+    client = CryptoServiceApiClient(
+        ConfigCryptoServiceApi(
+            endpoint="https://crypto.example",
+            exchange_batch_size=2,
+            exchange_concurrency=2,
+        )
+    )
+    client._http = http_mock
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+def make_response(data: Any) -> MagicMock:
+    response = MagicMock()
+    response.json.return_value = data
+    return response
+
+
+def test_exchange_many_sends_one_request_per_batch(batch_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
+    http_mock.do_request.side_effect = [
+        make_response([{"encrypted_pseudonym": "a", "iv": "1"}, {"encrypted_pseudonym": "b", "iv": "2"}]),
+        make_response({"encrypted_pseudonym": "c", "iv": "3"}),
+    ]
+
+    results = batch_client.exchange_many([("j1", "b1"), ("j2", "b2"), ("j3", "b3")], "some-label", "CBC_AES")
+
+    assert results == [
+        PseudonymResponse(encrypted_pseudonym="a", iv="1"),
+        PseudonymResponse(encrypted_pseudonym="b", iv="2"),
+        PseudonymResponse(encrypted_pseudonym="c", iv="3"),
+    ]
+    assert http_mock.do_request.call_count == 2
+    assert http_mock.do_request.call_args_list[0].kwargs["data"] == [
+        {"jwe": "j1", "blind_factor": "b1", "label": "some-label", "mechanism": "CBC_AES"},
+        {"jwe": "j2", "blind_factor": "b2", "label": "some-label", "mechanism": "CBC_AES"},
+    ]
+    # A batch of one is a plain single exchange
+    assert http_mock.do_request.call_args_list[1].kwargs["data"] == {
+        "jwe": "j3",
+        "blind_factor": "b3",
+        "label": "some-label",
+        "mechanism": "CBC_AES",
+    }
+
+
+def test_exchange_many_reports_failed_items(batch_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
+    http_mock.do_request.return_value = make_response([{"encrypted_pseudonym": "a", "iv": "1"}, {"error": "bad"}])
+
+    results = batch_client.exchange_many([("j1", "b1"), ("j2", "b2")], "some-label", "CBC_AES")
+
+    assert results[0] == PseudonymResponse(encrypted_pseudonym="a", iv="1")
+    assert isinstance(results[1], ValueError)
+
+
+def batch_calls(http_mock: MagicMock) -> List[Any]:
+    return [c for c in http_mock.do_request.call_args_list if isinstance(c.kwargs["data"], list)]
+
+
+def test_exchange_many_falls_back_to_single_exchanges(
+    batch_client: CryptoServiceApiClient, http_mock: MagicMock, mocker: MockerFixture
+) -> None:
+    def do_request(method: str, sub_route: str, data: Any) -> MagicMock:
+        if isinstance(data, list):
+            raise HTTPError(response=MagicMock(status_code=404))
+        return make_response({"encrypted_pseudonym": data["jwe"], "iv": "1"})
+
+    http_mock.do_request.side_effect = do_request
+    tokens = [("j1", "b1"), ("j2", "b2"), ("j3", "b3"), ("j4", "b4")]
+
+    results = batch_client.exchange_many(tokens, "some-label", "CBC_AES")
+
+    assert results == [PseudonymResponse(encrypted_pseudonym=jwe, iv="1") for jwe, _ in tokens]
+    # Only the first batch is tried, the fallback is remembered for the second one
+    assert len(batch_calls(http_mock)) == 1
+
+    mocker.patch(
+        "app.services.crypto_service_api_client.monotonic", return_value=time.monotonic() + BATCH_RETRY_INTERVAL
+    )
+    batch_client.exchange_many(tokens[:2], "some-label", "CBC_AES")
+
+    # Batches are tried again after the retry interval
+    assert len(batch_calls(http_mock)) == 2
+
+
+def test_exchange_many_exchanges_invalid_batch_one_by_one(
+    batch_client: CryptoServiceApiClient, http_mock: MagicMock
+) -> None:
+    def do_request(method: str, sub_route: str, data: Any) -> MagicMock:
+        if isinstance(data, list):
+            raise HTTPError(response=MagicMock(status_code=422))
+        if data["jwe"] == "bad":
+            raise HTTPError(response=MagicMock(status_code=422))
+        return make_response({"encrypted_pseudonym": data["jwe"], "iv": "1"})
+
+    http_mock.do_request.side_effect = do_request
+    tokens = [("j1", "b1"), ("bad", "b2"), ("j3", "b3"), ("j4", "b4")]
+
+    results = batch_client.exchange_many(tokens, "some-label", "CBC_AES")
+
+    assert results[0] == PseudonymResponse(encrypted_pseudonym="j1", iv="1")
+    assert isinstance(results[1], ValueError)
+    # A batch with one bad item does not turn batches off for the next one
+    assert len(batch_calls(http_mock)) == 2
+    assert batch_client._batch_supported()
+
+
+def test_exchange_many_reports_connection_errors(batch_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
+    http_mock.do_request.side_effect = ConnectionError
+
+    results = batch_client.exchange_many([("j1", "b1"), ("j2", "b2")], "some-label", "CBC_AES")
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+def test_exchange_many_reports_server_errors_without_falling_back(
+    batch_client: CryptoServiceApiClient, http_mock: MagicMock
+) -> None:
+    http_mock.do_request.side_effect = HTTPError(response=MagicMock(status_code=503))
+
+    results = batch_client.exchange_many([("j1", "b1"), ("j2", "b2")], "some-label", "CBC_AES")
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert http_mock.do_request.call_count == 1
+    assert batch_client._batch_supported()
+
+
+@pytest.fixture()
+def hedged_client(http_mock: MagicMock) -> Generator[CryptoServiceApiClient, None, None]:
+    client = CryptoServiceApiClient(
+        ConfigCryptoServiceApi(
+            endpoint="https://crypto.example",
+            hedge_percentile=95,
+            hedge_min_delay=0.05,
+            hedge_budget_percent=100,
+        )
+    )
+    client._http = http_mock
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+def test_hedged_exchange_uses_fastest_answer(
+    hedged_client: CryptoServiceApiClient, http_mock: MagicMock, mocker: MockerFixture
+) -> None:
+    stats = mocker.patch("app.services.crypto_service_api_client.get_stats").return_value
+    calls: List[int] = []
+
+    def do_request(method: str, sub_route: str, data: Any) -> MagicMock:
+        calls.append(len(calls))
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return make_response({"encrypted_pseudonym": "slow", "iv": "1"})
+        return make_response({"encrypted_pseudonym": "fast", "iv": "1"})
+
+    http_mock.do_request.side_effect = do_request
+    start = time.monotonic()
+
+    result = hedged_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert time.monotonic() - start < 0.4
+    assert result == PseudonymResponse(encrypted_pseudonym="fast", iv="1")
+    assert len(calls) == 2
+    stats.inc.assert_any_call("crypto_service_api.hedge.fired")
+    stats.inc.assert_any_call("crypto_service_api.hedge.won")
+
+
+def test_hedged_exchange_counts_won_only_when_hedge_answers_first(
+    hedged_client: CryptoServiceApiClient, http_mock: MagicMock, mocker: MockerFixture
+) -> None:
+    stats = mocker.patch("app.services.crypto_service_api_client.get_stats").return_value
+    calls: List[int] = []
+
+    def do_request(method: str, sub_route: str, data: Any) -> MagicMock:
+        calls.append(len(calls))
+        number = len(calls)
+        time.sleep(0.1 if number == 1 else 0.5)
+        return make_response({"encrypted_pseudonym": f"answer-{number}", "iv": "1"})
+
+    http_mock.do_request.side_effect = do_request
+
+    result = hedged_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert result == PseudonymResponse(encrypted_pseudonym="answer-1", iv="1")
+    stats.inc.assert_any_call("crypto_service_api.hedge.fired")
+    assert call("crypto_service_api.hedge.won") not in stats.inc.call_args_list
+
+
+def test_hedged_exchange_does_not_hedge_fast_answer(
+    hedged_client: CryptoServiceApiClient, http_mock: MagicMock
+) -> None:
+    http_mock.do_request.return_value = make_response({"encrypted_pseudonym": "abc", "iv": "1"})
+
+    result = hedged_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert result == PseudonymResponse(encrypted_pseudonym="abc", iv="1")
+    assert http_mock.do_request.call_count == 1
+
+
+def test_hedged_exchange_falls_back_to_other_answer_on_error(
+    hedged_client: CryptoServiceApiClient, http_mock: MagicMock
+) -> None:
+    calls: List[int] = []
+
+    def do_request(method: str, sub_route: str, data: Any) -> MagicMock:
+        calls.append(len(calls))
+        if len(calls) == 1:
+            time.sleep(0.2)
+            return make_response({"encrypted_pseudonym": "slow", "iv": "1"})
+        raise ConnectionError
+
+    http_mock.do_request.side_effect = do_request
+
+    result = hedged_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert result == PseudonymResponse(encrypted_pseudonym="slow", iv="1")
+
+
+def test_hedged_exchange_respects_budget(hedged_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
+    assert hedged_client._hedge is not None
+    hedged_client._hedge.budget_ratio = 0
+
+    def do_request(method: str, sub_route: str, data: Any) -> MagicMock:
+        time.sleep(0.1)
+        return make_response({"encrypted_pseudonym": "abc", "iv": "1"})
+
+    http_mock.do_request.side_effect = do_request
+
+    hedged_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert http_mock.do_request.call_count == 1
+
+
+@pytest.fixture()
+def guarded_client(http_mock: MagicMock) -> Generator[CryptoServiceApiClient, None, None]:
+    client = CryptoServiceApiClient(
+        ConfigCryptoServiceApi(
+            endpoint="https://crypto.example",
+            exchange_batch_size=2,
+            circuit_breaker_failure_threshold=2,
+            circuit_breaker_reset_timeout=30,
+            max_in_flight=1,
+            bulkhead_timeout=0.05,
+        )
+    )
+    client._http = http_mock
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+def test_exchange_fails_fast_when_circuit_is_open(guarded_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
+    http_mock.do_request.side_effect = Timeout()
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            guarded_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    with pytest.raises(CryptoServiceUnavailableError):
+        guarded_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert http_mock.do_request.call_count == 2
+
+
+def test_client_errors_do_not_open_circuit(guarded_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
+    http_mock.do_request.side_effect = HTTPError(response=MagicMock(status_code=400))
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            guarded_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert http_mock.do_request.call_count == 3
+
+
+def test_circuit_closes_after_successful_trial(guarded_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
+    http_mock.do_request.side_effect = HTTPError(response=MagicMock(status_code=503))
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            guarded_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert guarded_client._breaker is not None
+    guarded_client._breaker.reset_timeout = 0
+    http_mock.do_request.side_effect = None
+    http_mock.do_request.return_value = make_response({"encrypted_pseudonym": "abc", "iv": "1"})
+
+    result = guarded_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+
+    assert result == PseudonymResponse(encrypted_pseudonym="abc", iv="1")
+    assert guarded_client._breaker.state == CircuitState.CLOSED
+
+
+def test_exchange_many_reports_open_circuit_per_token(
+    guarded_client: CryptoServiceApiClient, http_mock: MagicMock
+) -> None:
+    assert guarded_client._breaker is not None
+    for _ in range(2):
+        guarded_client._breaker.record_failure()
+
+    results = guarded_client.exchange_many([("j1", "b1"), ("j2", "b2")], "some-label", "CBC_AES")
+
+    assert all(isinstance(result, CryptoServiceUnavailableError) for result in results)
+    http_mock.do_request.assert_not_called()
+
+
+def test_bulkhead_rejects_exchanges_over_max_in_flight(
+    guarded_client: CryptoServiceApiClient, http_mock: MagicMock, mocker: MockerFixture
+) -> None:
+    stats = mocker.patch("app.services.crypto_service_api_client.get_stats").return_value
+    started = threading.Event()
+    release = threading.Event()
+
+    def do_request(method: str, sub_route: str, data: Any) -> MagicMock:
+        started.set()
+        release.wait(5)
+        return make_response({"encrypted_pseudonym": "abc", "iv": "1"})
+
+    http_mock.do_request.side_effect = do_request
+    slow = threading.Thread(target=guarded_client.exchange, args=("jwe", "bf", "some-label", "CBC_AES"))
+    slow.start()
+    try:
+        assert started.wait(5)
+        with pytest.raises(CryptoServiceUnavailableError):
+            guarded_client.exchange("jwe", "bf", "some-label", "CBC_AES")
+    finally:
+        release.set()
+        slow.join()
+
+    stats.inc.assert_called_once_with("crypto_service_api.bulkhead.rejected")
+    assert http_mock.do_request.call_count == 1
+    assert guarded_client.exchange("jwe", "bf", "some-label", "CBC_AES").encrypted_pseudonym == "abc"
+
+
 def test_exchange_raises_on_connection_error(crypto_client: CryptoServiceApiClient, http_mock: MagicMock) -> None:
     http_mock.do_request.side_effect = ConnectionError
 
@@ -0,0 +1,46 @@
+import pytest
+
+from app.services.hedging import MIN_SAMPLES, HedgePolicy
+
+
+def test_delay_is_min_delay_until_enough_latencies() -> None:
+    policy = HedgePolicy(percentile=90, min_delay=0.05, budget_percent=5)
+    for _ in range(MIN_SAMPLES - 1):
+        policy.record_latency(1.0)
+
+    assert policy.delay() == 0.05
+
+
+def test_delay_is_latency_percentile() -> None:
+    policy = HedgePolicy(percentile=90, min_delay=0.0, budget_percent=5)
+    for i in range(MIN_SAMPLES):
+        policy.record_latency(i / 100)
+
+    assert policy.delay() == pytest.approx(0.18)
+
+
+def test_delay_is_at_least_min_delay() -> None:
+    policy = HedgePolicy(percentile=90, min_delay=0.5, budget_percent=5)
+    for _ in range(MIN_SAMPLES):
+        policy.record_latency(0.01)
+
+    assert policy.delay() == 0.5
+
+
+def test_budget_caps_hedges_to_percentage_of_requests() -> None:
+    policy = HedgePolicy(percentile=90, min_delay=0.0, budget_percent=10)
+
+    hedges = 0
+    for _ in range(100):
+        policy.record_request()
+        hedges += policy.try_acquire()
+
+    assert hedges == 10
+
+
+def test_zero_budget_never_hedges() -> None:
+    policy = HedgePolicy(percentile=90, min_delay=0.0, budget_percent=0)
+    for _ in range(100):
+        policy.record_request()
+
+    assert policy.try_acquire() is False
@@ -1,3 +1,7 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Generator, List
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -5,7 +9,7 @@ from requests.exceptions import HTTPError, Timeout
 
 from app.services.http import HttpService
 
-PATCHED_MODULE = "app.services.http.request"
+PATCHED_MODULE = "app.services.http.Session.request"
 
 
 @patch(PATCHED_MODULE)
@@ -43,3 +47,179 @@ def test_do_request_raise_excetion_with_general_http_error(response: MagicMock,
     response.return_value = mock_response
     with pytest.raises(HTTPError):
         http_service.do_request("GET")
+
+
+def test_do_request_reuses_pooled_session(http_service: HttpService) -> None:
+    with patch.object(http_service._session, "request") as session_request:
+        session_request.return_value = MagicMock(status_code=200)
+
+        http_service.do_request("GET")
+        http_service.do_request("POST", sub_route="process", data={"a": "b"})
+
+    assert session_request.call_count == 2
+    adapter = http_service._session.get_adapter("https://example.com")
+    assert adapter._pool_maxsize == 10  # type: ignore[attr-defined]
+
+
+def test_requests_use_mtls_cert_over_environment_and_close(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("REQUESTS_CA_BUNDLE", "other-ca.pem")
+    service = HttpService(
+        endpoint="https://example.com",
+        timeout=1,
+        mtls_cert="cert.pem",
+        mtls_key="key.pem",
+        verify_ca="ca.pem",
+        pool_size=2,
+        connect_timeout=0.5,
+    )
+
+    with patch.object(service._session, "request") as session_request:
+        session_request.return_value = MagicMock(status_code=200)
+        service.do_request("GET")
+
+    assert session_request.call_args.kwargs["timeout"] == (0.5, 1)
+    assert session_request.call_args.kwargs["cert"] == ("cert.pem", "key.pem")
+    assert session_request.call_args.kwargs["verify"] == "ca.pem"
+    with patch.object(service._session, "close") as close:
+        service.close()
+    close.assert_called_once()
+
+
+class StubServer:
+    """
+    Local HTTP server standing in for one instance of a service, answers every request with status
+    """
+
+    def __init__(self) -> None:
+        self.status = 200
+        self.requests: List[str] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                stub.requests.append(self.path)
+                self.send_response(stub.status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *_args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    def traffic(self) -> int:
+        return len([path for path in self.requests if path != "/health"])
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture()
+def stub_servers() -> Generator[List[StubServer], Any, None]:
+    servers = [StubServer() for _ in range(3)]
+    try:
+        yield servers
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def make_balanced_service(servers: List[StubServer]) -> HttpService:
+    return HttpService(
+        endpoint=[server.url for server in servers],
+        timeout=1,
+        mtls_cert=None,
+        mtls_key=None,
+        verify_ca=False,
+        eject_after_failures=2,
+        health_route="health",
+        probe_interval=0.05,
+    )
+
+
+def test_requests_are_spread_over_endpoints(stub_servers: List[StubServer]) -> None:
+    service = make_balanced_service(stub_servers)
+    try:
+        for _ in range(60):
+            service.do_request("GET", sub_route="exchange")
+    finally:
+        service.close()
+
+    assert sum(server.traffic() for server in stub_servers) == 60
+    assert all(server.traffic() > 0 for server in stub_servers)
+
+
+def test_failing_endpoint_is_ejected(stub_servers: List[StubServer]) -> None:
+    failing = stub_servers[0]
+    failing.status = 503
+    service = make_balanced_service(stub_servers)
+    try:
+        for _ in range(30):
+            try:
+                service.do_request("GET", sub_route="exchange")
+            except HTTPError:
+                pass
+        seen = failing.traffic()
+        for _ in range(30):
+            service.do_request("GET", sub_route="exchange")
+    finally:
+        service.close()
+
+    assert seen == 2
+    assert failing.traffic() == 2
+
+
+def test_client_errors_do_not_eject(stub_servers: List[StubServer]) -> None:
+    for server in stub_servers:
+        server.status = 404
+    service = make_balanced_service(stub_servers)
+    try:
+        for _ in range(10):
+            with pytest.raises(HTTPError):
+                service.do_request("GET", sub_route="exchange")
+    finally:
+        service.close()
+
+    assert not any(endpoint.ejected for endpoint in service._endpoints)
+
+
+def test_recovered_endpoint_is_reinstated_after_health_probe(stub_servers: List[StubServer]) -> None:
+    failing = stub_servers[0]
+    failing.status = 503
+    service = make_balanced_service(stub_servers)
+    try:
+        while not service._endpoints[0].ejected:
+            try:
+                service.do_request("GET", sub_route="exchange")
+            except HTTPError:
+                pass
+
+        failing.status = 200
+        deadline = time.monotonic() + 5
+        while service._endpoints[0].ejected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        before = failing.traffic()
+        for _ in range(60):
+            service.do_request("GET", sub_route="exchange")
+    finally:
+        service.close()
+
+    assert "/health" in failing.requests
+    assert failing.traffic() > before
+
+
+def test_single_endpoint_is_never_ejected(stub_servers: List[StubServer]) -> None:
+    stub_servers[0].status = 503
+    service = make_balanced_service(stub_servers[:1])
+    try:
+        for _ in range(5):
+            with pytest.raises(HTTPError):
+                service.do_request("GET", sub_route="exchange")
+    finally:
+        service.close()
+
+    assert stub_servers[0].traffic() == 5
+    assert not service._endpoints[0].ejected
@@ -1,11 +1,17 @@
+import time
+from typing import Any, List
+from unittest.mock import MagicMock
+
 import pytest
+from pytest_mock import MockerFixture
+from sqlalchemy import event
 
 from app.db.db import Database
 from app.db.models.key_info import KeyInfoEntity
 from app.db.models.referral import ReferralEntity
 from app.db.repository.key_info_repository import KeyInfoRepository
-from app.services.exceptions import ConflictError, ForbiddedError, NotFoundError
-from app.services.key_info import KeyInfoService
+from app.services.exceptions import ConflictError, ForbiddedError, InvalidKeyInfoError, NotFoundError
+from app.services.key_info import KEY_INFO_INVALIDATION_KIND, KeyInfoService
 
 
 def test_add_one_should_succeed(key_info_service: KeyInfoService, mock_key_info: KeyInfoEntity) -> None:
@@ -102,3 +108,90 @@ def test_delete_should_raise_when_key_has_referrals(
 
     with pytest.raises(ForbiddedError):
         key_info_service.delete_one(updated_key.label)
+
+
+@pytest.fixture()
+def cached_key_info_service(database: Database) -> KeyInfoService:
+    return KeyInfoService(database, cache_ttl=60)
+
+
+def count_queries(database: Database) -> List[str]:
+    statements: List[str] = []
+
+    def before_execute(_conn: Any, _cursor: Any, statement: str, *args: Any) -> None:
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", before_execute)
+    return statements
+
+
+def test_get_active_key_is_served_from_cache(database: Database, cached_key_info_service: KeyInfoService) -> None:
+    expected = cached_key_info_service.add_one("label-1", "AES_CBC")
+    cached_key_info_service.get_active_key()
+    statements = count_queries(database)
+
+    actual = cached_key_info_service.get_active_key()
+
+    assert statements == []
+    assert (actual.id, actual.label, actual.mechanism) == (expected.id, expected.label, expected.mechanism)
+
+
+def test_get_active_key_reloads_after_ttl(
+    database: Database, cached_key_info_service: KeyInfoService, mocker: MockerFixture
+) -> None:
+    cached_key_info_service.add_one("label-1", "AES_CBC")
+    cached_key_info_service.get_active_key()
+    statements = count_queries(database)
+
+    mocker.patch("app.services.key_info.monotonic", return_value=time.monotonic() + 61)
+    cached_key_info_service.get_active_key()
+
+    assert len(statements) == 1
+
+
+def test_cached_active_key_is_read_from_primary(cached_key_info_service: KeyInfoService, mocker: MockerFixture) -> None:
+    cached_key_info_service.add_one("label-1", "AES_CBC")
+    read_session = mocker.spy(cached_key_info_service.database, "get_read_db_session")
+
+    assert cached_key_info_service.get_active_key().label == "label-1"
+
+    read_session.assert_not_called()
+
+
+def test_delete_one_invalidates_cached_key(cached_key_info_service: KeyInfoService) -> None:
+    cached_key_info_service.add_one("label-1", "AES_CBC")
+    cached_key_info_service.get_active_key()
+
+    cached_key_info_service.delete_one("label-1")
+
+    with pytest.raises(InvalidKeyInfoError):
+        cached_key_info_service.get_active_key()
+
+
+def test_warm_loads_active_key(database: Database, cached_key_info_service: KeyInfoService) -> None:
+    cached_key_info_service.add_one("label-1", "AES_CBC")
+    cached_key_info_service.warm()
+    statements = count_queries(database)
+
+    assert cached_key_info_service.get_active_key().label == "label-1"
+    assert statements == []
+
+
+def test_warm_without_active_key_does_not_raise(cached_key_info_service: KeyInfoService) -> None:
+    cached_key_info_service.warm()
+
+    with pytest.raises(InvalidKeyInfoError):
+        cached_key_info_service.get_active_key()
+
+
+def test_writes_publish_invalidation(database: Database) -> None:
+    invalidation = MagicMock()
+    service = KeyInfoService(database, cache_ttl=60, invalidation=invalidation)
+
+    key_info = service.add_one("label-1", "AES_CBC")
+    service.delete_one("label-1")
+
+    assert [c.args for c in invalidation.publish.call_args_list] == [
+        (KEY_INFO_INVALIDATION_KIND, [str(key_info.id)]),
+        (KEY_INFO_INVALIDATION_KIND, [str(key_info.id)]),
+    ]
@@ -0,0 +1,99 @@
+from datetime import datetime
+from uuid import uuid4
+
+from pytest_mock import MockerFixture
+
+from app.db.models.referral import ReferralEntity
+from app.services.localization_cache import LocalizationCache
+
+
+def make_referral(pseudonym: str, source: str = "SomeDevice") -> ReferralEntity:
+    return ReferralEntity(
+        id=uuid4(),
+        pseudonym=pseudonym,
+        ura_number="00000123",
+        source=source,
+        created_at=datetime(2024, 1, 1),
+    )
+
+
+def test_get_returns_cached_referrals() -> None:
+    cache = LocalizationCache(max_entries=10, ttl=60)
+    referral = make_referral("ps-1")
+    cache.put("ps-1", [referral], cache.generation())
+
+    actual = cache.get("ps-1")
+
+    assert actual is not None
+    assert [(r.id, r.pseudonym, r.ura_number, r.source, r.created_at) for r in actual] == [
+        (referral.id, "ps-1", "00000123", "SomeDevice", datetime(2024, 1, 1))
+    ]
+
+
+def test_caches_empty_result() -> None:
+    cache = LocalizationCache(max_entries=10, ttl=60)
+    cache.put("ps-1", [], cache.generation())
+
+    assert cache.get("ps-1") == []
+    assert cache.get("ps-2") is None
+
+
+def test_expired_entry_is_a_miss(mocker: MockerFixture) -> None:
+    clock = mocker.patch("app.services.localization_cache.monotonic", return_value=100.0)
+    cache = LocalizationCache(max_entries=10, ttl=60)
+    cache.put("ps-1", [make_referral("ps-1")], cache.generation())
+
+    clock.return_value = 160.0
+
+    assert cache.get("ps-1") is None
+    assert len(cache) == 0
+
+
+def test_evicts_least_recently_used(mocker: MockerFixture) -> None:
+    stats = mocker.patch("app.services.localization_cache.get_stats").return_value
+    cache = LocalizationCache(max_entries=2, ttl=60)
+    cache.put("ps-1", [make_referral("ps-1")], cache.generation())
+    cache.put("ps-2", [make_referral("ps-2")], cache.generation())
+    cache.get("ps-1")
+
+    cache.put("ps-3", [make_referral("ps-3")], cache.generation())
+
+    assert cache.get("ps-2") is None
+    assert cache.get("ps-1") is not None
+    assert cache.get("ps-3") is not None
+    stats.inc.assert_any_call("referral_service.localization_cache.eviction", 1)
+
+
+def test_counts_hits_and_misses(mocker: MockerFixture) -> None:
+    stats = mocker.patch("app.services.localization_cache.get_stats").return_value
+    cache = LocalizationCache(max_entries=10, ttl=60)
+    cache.put("ps-1", [], cache.generation())
+
+    cache.get("ps-1")
+    cache.get("ps-2")
+
+    assert [c.args for c in stats.inc.call_args_list] == [
+        ("referral_service.localization_cache.hit",),
+        ("referral_service.localization_cache.miss",),
+    ]
+
+
+def test_invalidate_drops_entry_and_rejects_racing_put() -> None:
+    cache = LocalizationCache(max_entries=10, ttl=60)
+    cache.put("ps-1", [make_referral("ps-1")], cache.generation())
+    generation = cache.generation()
+
+    cache.invalidate(["ps-1"])
+    cache.put("ps-1", [make_referral("ps-1")], generation)
+
+    assert cache.get("ps-1") is None
+
+
+def test_clear_drops_all_entries() -> None:
+    cache = LocalizationCache(max_entries=10, ttl=60)
+    cache.put("ps-1", [], cache.generation())
+    cache.put("ps-2", [], cache.generation())
+
+    cache.clear()
+
+    assert len(cache) == 0
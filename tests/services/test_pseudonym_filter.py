@@ -0,0 +1,120 @@
+import threading
+from typing import Iterator, List
+
+import pytest
+
+from app.services.pseudonym_filter import BloomFilter, PseudonymFilter
+
+
+def test_bloom_filter_has_no_false_negatives() -> None:
+    bloom_filter = BloomFilter(capacity=1000, fp_rate=0.01)
+    values = [f"pseudonym-{i}" for i in range(1000)]
+    for value in values:
+        bloom_filter.add(value)
+
+    assert all(value in bloom_filter for value in values)
+    assert bloom_filter.count == 1000
+
+
+def test_bloom_filter_keeps_false_positive_rate_at_capacity() -> None:
+    bloom_filter = BloomFilter(capacity=10000, fp_rate=0.01)
+    for i in range(10000):
+        bloom_filter.add(f"present-{i}")
+
+    false_positives = sum(f"absent-{i}" in bloom_filter for i in range(20000))
+
+    assert false_positives / 20000 < 0.02
+
+
+def test_bloom_filter_is_sized_from_capacity_and_rate() -> None:
+    bloom_filter = BloomFilter(capacity=1_000_000, fp_rate=0.01)
+
+    # About 9.6 bits and 7 hash functions per item at 1%
+    assert 9_500_000 < bloom_filter.size < 9_700_000
+    assert bloom_filter.hash_count == 7
+
+
+def test_filter_answers_might_contain_until_built() -> None:
+    pseudonym_filter = PseudonymFilter(capacity=100, fp_rate=0.01, rebuild_interval=3600)
+
+    assert not pseudonym_filter.ready
+    assert pseudonym_filter.might_contain("anything")
+
+    pseudonym_filter.build(lambda: ["ps-1"])
+
+    assert pseudonym_filter.ready
+    assert pseudonym_filter.might_contain("ps-1")
+    assert not pseudonym_filter.might_contain("ps-2")
+
+
+def test_filter_keeps_pseudonyms_added_during_build() -> None:
+    pseudonym_filter = PseudonymFilter(capacity=100, fp_rate=0.01, rebuild_interval=3600)
+
+    def load() -> Iterator[str]:
+        yield "ps-1"
+        pseudonym_filter.add(["ps-2"])
+
+    pseudonym_filter.build(load)
+
+    assert pseudonym_filter.might_contain("ps-1")
+    assert pseudonym_filter.might_contain("ps-2")
+
+
+def test_invalidate_discards_build_that_started_before_it() -> None:
+    pseudonym_filter = PseudonymFilter(capacity=100, fp_rate=0.01, rebuild_interval=3600)
+
+    def load() -> Iterator[str]:
+        yield "ps-1"
+        pseudonym_filter.invalidate()
+
+    pseudonym_filter.build(load)
+
+    assert not pseudonym_filter.ready
+
+
+def test_failed_build_keeps_current_filter() -> None:
+    pseudonym_filter = PseudonymFilter(capacity=100, fp_rate=0.01, rebuild_interval=3600)
+    pseudonym_filter.build(lambda: ["ps-1"])
+
+    def load() -> Iterator[str]:
+        yield "ps-2"
+        raise RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError):
+        pseudonym_filter.build(load)
+
+    assert pseudonym_filter.might_contain("ps-1")
+    assert not pseudonym_filter.might_contain("ps-2")
+    pseudonym_filter.add(["ps-3"])
+    assert pseudonym_filter.might_contain("ps-3")
+
+
+def test_build_grows_capacity_when_over() -> None:
+    pseudonym_filter = PseudonymFilter(capacity=10, fp_rate=0.01, rebuild_interval=3600)
+
+    pseudonym_filter.build(lambda: [f"ps-{i}" for i in range(100)])
+
+    assert pseudonym_filter.capacity == 120
+
+
+def test_background_thread_rebuilds_after_invalidate() -> None:
+    pseudonym_filter = PseudonymFilter(capacity=100, fp_rate=0.01, rebuild_interval=3600)
+    builds: List[int] = []
+    built = threading.Event()
+
+    def load() -> List[str]:
+        builds.append(1)
+        if len(builds) == 2:
+            built.set()
+        return ["ps-1"]
+
+    pseudonym_filter.start(load)
+    try:
+        while not pseudonym_filter.ready:
+            threading.Event().wait(0.01)
+        pseudonym_filter.invalidate()
+        assert built.wait(5)
+    finally:
+        pseudonym_filter.stop()
+
+    assert len(builds) == 2
@@ -0,0 +1,150 @@
+from datetime import datetime
+from uuid import UUID, uuid4
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.db.db import Database
+from app.db.models.referral import ReferralEntity
+from app.models.pseudonym import EncryptedPseudonym
+from app.models.ura import UraNumber
+from app.services.key_info import KeyInfoService
+from app.services.referral_index import ReferralIndex, ReferralTable
+from app.services.referral_service import ReferralService
+
+
+@pytest.fixture()
+def referral_index(database: Database) -> ReferralIndex:
+    return ReferralIndex(database, refresh_interval=5, overlap=60, deletion_retention=86400)
+
+
+@pytest.fixture()
+def key_id(key_info_service: KeyInfoService) -> UUID:
+    return key_info_service.add_one("some-label", "AES_CBC").id
+
+
+def add_referral(
+    service: ReferralService, key_id: UUID, pseudonym: str, ura_number: str = "00000123", source: str = "SomeDevice"
+) -> ReferralEntity:
+    return service.add_one(
+        encrypted_pseudonym=EncryptedPseudonym(pseudonym, "123"),
+        ura_number=UraNumber(ura_number),
+        source=source,
+        organization_name="Test Org",
+        key_id=key_id,
+    )
+
+
+def test_table_returns_referrals_of_pseudonym() -> None:
+    table = ReferralTable()
+    first, second = uuid4(), uuid4()
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678901)
+    table.add(first, "ps-1", "00000123", "SomeDevice", created_at)
+    table.add(second, "ps-1", "00000456", "OtherDevice", created_at)
+    table.add(uuid4(), "ps-2", "00000123", "SomeDevice", created_at)
+
+    referrals = table.get("ps-1")
+
+    assert {(r.id, r.pseudonym, r.ura_number, r.source, r.created_at) for r in referrals} == {
+        (first, "ps-1", "00000123", "SomeDevice", created_at),
+        (second, "ps-1", "00000456", "OtherDevice", created_at),
+    }
+    assert table.get("ps-unknown") == []
+    assert len(table) == 3
+
+
+def test_table_ignores_known_id_and_removes() -> None:
+    table = ReferralTable()
+    id = uuid4()
+
+    assert table.add(id, "ps-1", "00000123", "SomeDevice", datetime.now())
+    assert not table.add(id, "ps-1", "00000123", "SomeDevice", datetime.now())
+    assert table.remove(id, "ps-1")
+    assert not table.remove(id, "ps-1")
+    assert not table.remove(uuid4(), "ps-2")
+    assert table.get("ps-1") == []
+    assert len(table) == 0
+
+
+def test_table_grows_and_stays_compact() -> None:
+    table = ReferralTable()
+    for i in range(5000):
+        table.add(uuid4(), f"ps-{i}", "00000123", f"source-{i % 3}", datetime.now())
+
+    assert all(len(table.get(f"ps-{i}")) == 1 for i in range(5000))
+    assert table.nbytes() / len(table) < 80
+
+
+def test_index_is_not_ready_before_load(referral_index: ReferralIndex) -> None:
+    assert not referral_index.ready
+    assert referral_index.get("123ps-1") is None
+
+    referral_index.refresh()
+
+    assert not referral_index.ready
+
+
+def test_index_loads_and_refreshes_writes_of_other_instances(
+    database: Database, referral_index: ReferralIndex, key_id: UUID
+) -> None:
+    other_instance = ReferralService(database=database)
+    loaded = add_referral(other_instance, key_id, "ps-1")
+    deleted = add_referral(other_instance, key_id, "ps-2")
+    referral_index.load()
+
+    assert [r.id for r in referral_index.get("123ps-1") or []] == [loaded.id]
+
+    added = add_referral(other_instance, key_id, "ps-1", ura_number="00000456")
+    other_instance.delete_by_id(deleted.id)
+    referral_index.refresh()
+
+    assert {r.id for r in referral_index.get("123ps-1") or []} == {loaded.id, added.id}
+    assert referral_index.get("123ps-2") == []
+    assert len(referral_index) == 2
+
+
+def test_index_applies_bulk_deletes_from_the_log(
+    database: Database, referral_index: ReferralIndex, key_id: UUID
+) -> None:
+    other_instance = ReferralService(database=database)
+    add_referral(other_instance, key_id, "ps-1")
+    add_referral(other_instance, key_id, "ps-2")
+    kept = add_referral(other_instance, key_id, "ps-2", ura_number="00000456")
+    referral_index.load()
+
+    other_instance.delete_many_chunked(UraNumber("00000123"), chunk_size=1)
+    referral_index.refresh()
+
+    assert referral_index.get("123ps-1") == []
+    assert [r.id for r in referral_index.get("123ps-2") or []] == [kept.id]
+
+
+def test_service_answers_from_index(
+    database: Database, referral_index: ReferralIndex, key_id: UUID, mocker: MockerFixture
+) -> None:
+    service = ReferralService(database=database, referral_index=referral_index)
+    referral_index.load()
+    first = add_referral(service, key_id, "ps-1")
+    second = add_referral(service, key_id, "ps-1", ura_number="00000456")
+    read_session = mocker.spy(database, "get_read_db_session")
+
+    assert {r.id for r in service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-1", "123"))} == {
+        first.id,
+        second.id,
+    }
+    assert [
+        r.id
+        for r in service.get_many(
+            encrypted_pseudonym=EncryptedPseudonym("ps-1", "123"), ura_number=UraNumber("00000456")
+        )
+    ] == [second.id]
+    assert list(
+        service.get_many_by_pseudonyms([EncryptedPseudonym("ps-1", "123"), EncryptedPseudonym("ps-2", "123")])
+    ) == ["123ps-1"]
+    read_session.assert_not_called()
+
+    service.delete_one(EncryptedPseudonym("ps-1", "123"), UraNumber("00000123"), "SomeDevice")
+    service.delete_many(UraNumber("00000456"))
+
+    assert service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-1", "123")) == []
+    read_session.assert_not_called()
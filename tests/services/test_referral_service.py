@@ -1,17 +1,24 @@
 from typing import List
+from unittest.mock import MagicMock
 from uuid import UUID, uuid4
 
 import pytest
+from pytest_mock import MockerFixture
 
+from app.db.db import Database
+from app.db.invalidation import FLUSH_KEY
 from app.db.models.referral import ReferralEntity
+from app.db.repository.referral_repository import ReferralRepository
 from app.models.pseudonym import EncryptedPseudonym
 from app.models.ura import UraNumber
 from app.services.exceptions import (
     ConflictError,
+    DatabaseUnavailableError,
     NotFoundError,
 )
 from app.services.key_info import KeyInfoService
-from app.services.referral_service import ReferralService
+from app.services.pseudonym_filter import PseudonymFilter
+from app.services.referral_service import REFERRAL_ADDED_INVALIDATION_KIND, REFERRAL_INVALIDATION_KIND, ReferralService
 
 
 def assert_eq(
@@ -194,6 +201,30 @@ def test_get_one_should_succeed(
     assert_eq(expected, actual)
 
 
+def test_get_many_by_pseudonyms_groups_referrals_by_pseudonym(
+    referral_service: ReferralService,
+    key_info_service: KeyInfoService,
+    ura_number: UraNumber,
+) -> None:
+    key_info = key_info_service.add_one("label-1", "AES_CBC")
+    first = EncryptedPseudonym("ps-1", "123")
+    second = EncryptedPseudonym("ps-2", "123")
+    for pseudonym, source in [(first, "DeviceA"), (first, "DeviceB"), (second, "DeviceA")]:
+        referral_service.add_one(
+            encrypted_pseudonym=pseudonym,
+            ura_number=ura_number,
+            source=source,
+            organization_name="Test Org",
+            key_id=key_info.id,
+        )
+
+    actual = referral_service.get_many_by_pseudonyms([first, second, EncryptedPseudonym("ps-3", "123")])
+
+    assert sorted(actual.keys()) == [first.value, second.value]
+    assert sorted(r.source for r in actual[first.value]) == ["DeviceA", "DeviceB"]
+    assert [r.source for r in actual[second.value]] == ["DeviceA"]
+
+
 def test_get_one_should_return_none_when_not_found(referral_service: ReferralService, ura_number: UraNumber) -> None:
     pseudonym = EncryptedPseudonym("ps-1", "123")
     actual = referral_service.get_one(
@@ -203,3 +234,216 @@ def test_get_one_should_return_none_when_not_found(referral_service: ReferralSer
     )
 
     assert actual is None
+
+
+def test_delete_many_chunked_deletes_all_referrals_of_ura_in_chunks(
+    referral_service: ReferralService,
+    key_info_service: KeyInfoService,
+    ura_number: UraNumber,
+) -> None:
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    for i in range(5):
+        referral_service.add_one(
+            encrypted_pseudonym=EncryptedPseudonym(f"ps-{i}", "123"),
+            ura_number=ura_number,
+            source="SomeDevice",
+            organization_name="Test Org",
+            key_id=key_info.id,
+        )
+    referral_service.add_one(
+        encrypted_pseudonym=EncryptedPseudonym("ps-other", "123"),
+        ura_number=UraNumber("00000456"),
+        source="SomeDevice",
+        organization_name="Test Org",
+        key_id=key_info.id,
+    )
+    progress: List[int] = []
+
+    deleted = referral_service.delete_many_chunked(ura_number=ura_number, chunk_size=2, on_progress=progress.append)
+
+    assert deleted == 5
+    assert progress == [2, 4, 5]
+    assert referral_service.count(ura_number) == 0
+    assert referral_service.count(UraNumber("00000456")) == 1
+
+
+@pytest.fixture()
+def cached_referral_service(database: Database) -> ReferralService:
+    return ReferralService(database=database, cache_size=10, cache_ttl=60)
+
+
+def add_referral(service: ReferralService, key_id: UUID, pseudonym: str, source: str = "SomeDevice") -> ReferralEntity:
+    return service.add_one(
+        encrypted_pseudonym=EncryptedPseudonym(pseudonym, "123"),
+        ura_number=UraNumber("00000123"),
+        source=source,
+        organization_name="Test Org",
+        key_id=key_id,
+    )
+
+
+def test_get_many_serves_localization_from_cache(
+    cached_referral_service: ReferralService, key_info_service: KeyInfoService, mocker: MockerFixture
+) -> None:
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    referral = add_referral(cached_referral_service, key_info.id, "ps-1")
+    cached_referral_service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-1", "123"))
+    read_session = mocker.spy(cached_referral_service.database, "get_read_db_session")
+
+    actual = cached_referral_service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-1", "123"))
+
+    assert [(r.id, r.source) for r in actual] == [(referral.id, "SomeDevice")]
+    read_session.assert_not_called()
+
+
+def test_cache_is_filled_from_primary(
+    cached_referral_service: ReferralService, key_info_service: KeyInfoService, mocker: MockerFixture
+) -> None:
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    add_referral(cached_referral_service, key_info.id, "ps-1")
+    read_session = mocker.spy(cached_referral_service.database, "get_read_db_session")
+
+    cached_referral_service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-1", "123"))
+    cached_referral_service.get_many_by_pseudonyms([EncryptedPseudonym("ps-2", "123")])
+
+    read_session.assert_not_called()
+
+
+def test_pseudonym_filter_is_built_from_primary(referral_service: ReferralService, mocker: MockerFixture) -> None:
+    streaming_session = mocker.spy(referral_service.database, "get_streaming_db_session")
+
+    list(referral_service.stream_pseudonyms())
+
+    streaming_session.assert_called_once_with(primary=True)
+
+
+def test_get_many_with_filters_bypasses_cache(
+    cached_referral_service: ReferralService, key_info_service: KeyInfoService
+) -> None:
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    add_referral(cached_referral_service, key_info.id, "ps-1")
+
+    cached_referral_service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-1", "123"), source="SomeDevice")
+
+    assert cached_referral_service.cache is not None
+    assert len(cached_referral_service.cache) == 0
+
+
+def test_writes_invalidate_cached_localization(
+    cached_referral_service: ReferralService, key_info_service: KeyInfoService
+) -> None:
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    pseudonym = EncryptedPseudonym("ps-1", "123")
+    first = add_referral(cached_referral_service, key_info.id, "ps-1", source="DeviceA")
+    assert len(cached_referral_service.get_many(encrypted_pseudonym=pseudonym)) == 1
+
+    add_referral(cached_referral_service, key_info.id, "ps-1", source="DeviceB")
+    assert len(cached_referral_service.get_many(encrypted_pseudonym=pseudonym)) == 2
+
+    cached_referral_service.delete_by_id(first.id)
+    assert [r.source for r in cached_referral_service.get_many(encrypted_pseudonym=pseudonym)] == ["DeviceB"]
+
+    cached_referral_service.delete_one(pseudonym, UraNumber("00000123"), "DeviceB")
+    assert cached_referral_service.get_many(encrypted_pseudonym=pseudonym) == []
+
+    add_referral(cached_referral_service, key_info.id, "ps-1")
+    assert len(cached_referral_service.get_many(encrypted_pseudonym=pseudonym)) == 1
+
+    cached_referral_service.delete_many(UraNumber("00000123"))
+    assert cached_referral_service.get_many(encrypted_pseudonym=pseudonym) == []
+
+
+def test_get_many_by_pseudonyms_queries_only_cache_misses(
+    cached_referral_service: ReferralService, key_info_service: KeyInfoService, mocker: MockerFixture
+) -> None:
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    add_referral(cached_referral_service, key_info.id, "ps-1")
+    add_referral(cached_referral_service, key_info.id, "ps-2")
+    cached_referral_service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-1", "123"))
+    find = mocker.spy(ReferralRepository, "find_by_pseudonyms")
+
+    actual = cached_referral_service.get_many_by_pseudonyms(
+        [EncryptedPseudonym("ps-1", "123"), EncryptedPseudonym("ps-2", "123"), EncryptedPseudonym("ps-3", "123")]
+    )
+
+    assert sorted(actual.keys()) == ["123ps-1", "123ps-2"]
+    assert find.call_args.args[1] == ["123ps-2", "123ps-3"]
+    assert cached_referral_service.get_many_by_pseudonyms([EncryptedPseudonym("ps-3", "123")]) == {}
+    assert find.call_count == 1
+
+
+def test_writes_publish_invalidation(database: Database, key_info_service: KeyInfoService) -> None:
+    invalidation = MagicMock()
+    service = ReferralService(database=database, invalidation=invalidation)
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+
+    referral = add_referral(service, key_info.id, "ps-1")
+    service.delete_by_id(referral.id)
+    service.delete_many(UraNumber("00000123"))
+    add_referral(service, key_info.id, "ps-2")
+    service.delete_many(UraNumber("00000123"))
+
+    assert [c.args for c in invalidation.publish.call_args_list] == [
+        (REFERRAL_ADDED_INVALIDATION_KIND, ["123ps-1"]),
+        (REFERRAL_INVALIDATION_KIND, ["123ps-1"]),
+        (REFERRAL_ADDED_INVALIDATION_KIND, ["123ps-2"]),
+        (REFERRAL_INVALIDATION_KIND, [FLUSH_KEY]),
+    ]
+
+
+def test_registration_fails_when_filtered_pseudonym_is_not_published(
+    database: Database, key_info_service: KeyInfoService
+) -> None:
+    invalidation = MagicMock()
+    invalidation.publish.side_effect = DatabaseUnavailableError()
+    pseudonym_filter = PseudonymFilter(capacity=100, fp_rate=0.01, rebuild_interval=3600)
+    service = ReferralService(database=database, invalidation=invalidation, pseudonym_filter=pseudonym_filter)
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+
+    with pytest.raises(DatabaseUnavailableError):
+        add_referral(service, key_info.id, "ps-1")
+
+    invalidation.publish.side_effect = None
+    with pytest.raises(ConflictError):
+        add_referral(service, key_info.id, "ps-1")
+
+    invalidation.publish.assert_called_with(REFERRAL_ADDED_INVALIDATION_KIND, ["123ps-1"], required=True)
+
+
+def test_deletes_prune_deletion_log_without_index(database: Database, key_info_service: KeyInfoService) -> None:
+    service = ReferralService(database=database, deletion_retention=0)
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    first = add_referral(service, key_info.id, "ps-1")
+    second = add_referral(service, key_info.id, "ps-2")
+
+    service.delete_by_id(first.id)
+    service._pruned_at = None
+    service.delete_by_id(second.id)
+
+    with database.get_db_session() as session:
+        deletions = session.get_repository(ReferralRepository).find_deletions_since(None)
+    assert [deletion[0] for deletion in deletions] == [second.id]
+
+
+def test_get_many_skips_query_for_pseudonym_absent_from_filter(
+    database: Database, key_info_service: KeyInfoService, mocker: MockerFixture
+) -> None:
+    pseudonym_filter = PseudonymFilter(capacity=100, fp_rate=0.01, rebuild_interval=3600)
+    service = ReferralService(database=database, pseudonym_filter=pseudonym_filter)
+    key_info = key_info_service.add_one("some-label", "AES_CBC")
+    add_referral(service, key_info.id, "ps-1")
+    pseudonym_filter.build(service.stream_pseudonyms)
+    add_referral(service, key_info.id, "ps-2")
+    read_session = mocker.spy(database, "get_read_db_session")
+
+    assert service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-unknown", "123")) == []
+    assert service.get_many_by_pseudonyms([EncryptedPseudonym("ps-unknown", "123")]) == {}
+    read_session.assert_not_called()
+
+    assert len(service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-1", "123"))) == 1
+    assert len(service.get_many(encrypted_pseudonym=EncryptedPseudonym("ps-2", "123"))) == 1
+    assert sorted(
+        service.get_many_by_pseudonyms(
+            [EncryptedPseudonym("ps-1", "123"), EncryptedPseudonym("ps-2", "123"), EncryptedPseudonym("x", "123")]
+        )
+    ) == ["123ps-1", "123ps-2"]
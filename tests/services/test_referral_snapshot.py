@@ -0,0 +1,103 @@
+import time
+from datetime import datetime
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import pytest
+
+from app.build_referral_snapshot import build_referral_snapshot
+from app.db.db import Database
+from app.models.pseudonym import EncryptedPseudonym
+from app.models.ura import UraNumber
+from app.services.key_info import KeyInfoService
+from app.services.referral_index import ReferralIndex
+from app.services.referral_service import ReferralService
+from app.services.referral_snapshot import ReferralSnapshot, write_snapshot
+
+
+@pytest.fixture()
+def key_id(key_info_service: KeyInfoService) -> UUID:
+    return key_info_service.add_one("some-label", "AES_CBC").id
+
+
+def add_referral(service: ReferralService, key_id: UUID, pseudonym: str, ura_number: str = "00000123") -> UUID:
+    return service.add_one(
+        encrypted_pseudonym=EncryptedPseudonym(pseudonym, "123"),
+        ura_number=UraNumber(ura_number),
+        source="SomeDevice",
+        organization_name="Test Org",
+        key_id=key_id,
+    ).id
+
+
+def test_snapshot_is_sorted_across_runs_and_found_by_pseudonym(tmp_path: Path) -> None:
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678901)
+    deleted_since = datetime(2026, 1, 1)
+    rows = [(uuid4(), f"ps-{i % 40}", f"{i:08d}", f"source-{i % 3}", created_at) for i in range(100)]
+    path = str(tmp_path / "referrals.snapshot")
+
+    assert write_snapshot(path, rows, deleted_since, chunk_size=7) == 100
+
+    snapshot = ReferralSnapshot(path)
+    assert len(snapshot) == 100
+    assert snapshot.created_since == created_at
+    assert snapshot.deleted_since == deleted_since
+    for i in range(40):
+        expected = {(row[0], row[2], row[3]) for row in rows if row[1] == f"ps-{i}"}
+        referrals = snapshot.get(f"ps-{i}")
+        assert {(r.id, r.ura_number, r.source) for r in referrals} == expected
+        assert all(r.pseudonym == f"ps-{i}" and r.created_at == created_at for r in referrals)
+    assert snapshot.get("ps-unknown") == []
+    assert snapshot.contains(rows[0][0], rows[0][1])
+    assert not snapshot.contains(rows[0][0], "ps-unknown")
+
+
+def test_snapshot_rejects_incomplete_file(tmp_path: Path) -> None:
+    path = tmp_path / "referrals.snapshot"
+    write_snapshot(str(path), [(uuid4(), "ps-1", "00000123", "SomeDevice", datetime.now())], None)
+    path.write_bytes(path.read_bytes()[:-1])
+
+    with pytest.raises(ValueError):
+        ReferralSnapshot(str(path))
+
+
+def test_index_maps_snapshot_and_overlays_later_writes(database: Database, key_id: UUID, tmp_path: Path) -> None:
+    other_instance = ReferralService(database=database)
+    kept = add_referral(other_instance, key_id, "ps-1")
+    deleted = add_referral(other_instance, key_id, "ps-2")
+    path = str(tmp_path / "referrals.snapshot")
+    assert build_referral_snapshot(database, path) == 2
+    referral_index = ReferralIndex(
+        database, refresh_interval=5, overlap=60, deletion_retention=86400, snapshot_path=path
+    )
+    referral_index.load()
+
+    assert referral_index.nbytes() < 1000
+    assert [r.id for r in referral_index.get("123ps-1") or []] == [kept]
+
+    added = add_referral(other_instance, key_id, "ps-1", ura_number="00000456")
+    other_instance.delete_by_id(deleted)
+    referral_index.refresh()
+
+    assert {r.id for r in referral_index.get("123ps-1") or []} == {kept, added}
+    assert referral_index.get("123ps-2") == []
+    assert len(referral_index) == 2
+    assert not referral_index._snapshot_replaced()
+
+    build_referral_snapshot(database, path)
+
+    assert referral_index._snapshot_replaced()
+
+
+def test_index_loads_from_database_when_snapshot_is_too_old(database: Database, key_id: UUID, tmp_path: Path) -> None:
+    referral = add_referral(ReferralService(database=database), key_id, "ps-1")
+    path = str(tmp_path / "referrals.snapshot")
+    write_snapshot(path, [], None)
+    referral_index = ReferralIndex(
+        database, refresh_interval=5, overlap=60, deletion_retention=0.001, snapshot_path=path
+    )
+    time.sleep(0.01)
+
+    referral_index.load()
+
+    assert [r.id for r in referral_index.get("123ps-1") or []] == [referral]
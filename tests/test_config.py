@@ -1,3 +1,6 @@
+import pytest
+from pydantic import ValidationError
+
 from app.config import (
     Config,
     ConfigApp,
@@ -53,3 +56,10 @@ def get_test_config() -> Config:
             expected_audiences=["test-audience"],
         ),
     )
+
+
+def test_pseudonym_filter_needs_invalidation_channel() -> None:
+    with pytest.raises(ValidationError):
+        ConfigDatabase(dsn="sqlite:///:memory:", pseudonym_filter_capacity=1000)
+
+    assert ConfigDatabase(dsn="sqlite:///:memory:", pseudonym_filter_capacity=1000, invalidation_channel="nvi")
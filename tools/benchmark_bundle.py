@@ -0,0 +1,96 @@
+"""
+Benchmark of POST /fhir Bundle processing, serial against parallel entries.
+
+The LocalizationListService is replaced by a stand-in that sleeps for --latency seconds per entry, the time an entry
+spends waiting on the database and the crypto service. The numbers show how much of that waiting the parallel path
+overlaps, not the throughput of a real deployment.
+
+Usage:
+
+    python -m tools.benchmark_bundle --entries 1000 --latency 0.002 --concurrency 1 4 8 16
+"""
+
+import argparse
+import time
+from typing import Any, List
+
+from app.models.auth.context import AuthContext, AuthenticationClaims
+from app.models.auth.data import AuthorizationScope
+from app.models.fhir.bundle import Bundle, BundleEntry, EntryRequest
+from app.models.fhir.resources.data import PSEUDONYM_SYSTEM
+from app.models.pseudonym import PseudonymResponse
+from app.models.ura import UraNumber
+from app.services.fhir.bundle import BundleService
+
+
+class LatencyLocalizationListService:
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+
+    def exchange_tokens(self, tokens: List[str]) -> List[PseudonymResponse]:
+        return [PseudonymResponse(encrypted_pseudonym=token, iv="0123456789abcdef") for token in tokens]
+
+    def query(self, *_args: Any, **_kwargs: Any) -> None:
+        time.sleep(self.latency)
+
+
+def make_bundle(entries: int, pseudonyms: int) -> Bundle[Any]:
+    return Bundle[Any](
+        type="transaction",
+        entry=[
+            BundleEntry(
+                request=EntryRequest(
+                    method="GET",
+                    url=f"List?subject:identifier={PSEUDONYM_SYSTEM}|pseudonym-{i % pseudonyms}&_count=10",
+                )
+            )
+            for i in range(entries)
+        ],
+    )
+
+
+def make_ctx() -> AuthContext:
+    return AuthContext(
+        claims=AuthenticationClaims(
+            ura_number=UraNumber("00000001"),
+            organization_name="Benchmark",
+            source_id=None,
+            oin="00000000000000000001",
+        ),
+        scope=[AuthorizationScope.LOCALIZE],
+        audience="nvi.service",
+    )
+
+
+def run(bundle: Bundle[Any], latency: float, concurrency: int) -> float:
+    service = BundleService(LatencyLocalizationListService(latency), concurrency=concurrency)  # type: ignore[arg-type]
+    try:
+        start = time.perf_counter()
+        results = service.process_entries(make_ctx(), bundle)
+        elapsed = time.perf_counter() - start
+    finally:
+        service.shutdown()
+
+    assert len(results) == len(bundle.entry)
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--pseudonyms", type=int, default=250, help="distinct pseudonyms among the entries")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds of I/O per entry")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    bundle = make_bundle(args.entries, args.pseudonyms)
+    serial = None
+    print(f"{args.entries} entries, {args.pseudonyms} pseudonyms, {args.latency * 1000:.1f} ms per entry")
+    for concurrency in args.concurrency:
+        elapsed = run(bundle, args.latency, concurrency)
+        serial = serial or elapsed
+        print(f"concurrency={concurrency:<3} wall={elapsed:.3f}s speedup={serial / elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark of the in-memory referral index: bytes per referral and lookup latency.
+
+The index is filled with --rows synthetic referrals, --per-pseudonym referrals per pseudonym spread over --uras
+URAs and --sources sources, without a database. Lookups are timed one by one for pseudonyms that are present and
+for pseudonyms that are not, the latter being the common case of a localization.
+
+At the default of 50 million rows the index needs about 2.8 GB and filling it takes about ten minutes.
+
+With --snapshot the referrals are written to a snapshot file at that path instead, which is then memory mapped the
+way workers do, and the lookups are timed against it.
+
+Usage:
+
+    python -m tools.benchmark_referral_index --rows 50000000 --lookups 100000
+    python -m tools.benchmark_referral_index --rows 50000000 --snapshot /tmp/referrals.snapshot
+"""
+
+import argparse
+import os
+import random
+import resource
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, List
+from uuid import UUID
+
+from app.db.repository.referral_repository import IndexRow
+from app.services.referral_index import ReferralTable
+from app.services.referral_snapshot import ReferralSnapshot, write_snapshot
+
+
+def synthetic_rows(rows: int, per_pseudonym: int, uras: int, sources: int) -> Iterator[IndexRow]:
+    created_at = datetime(2026, 1, 1)
+    for i in range(rows):
+        yield (
+            UUID(int=i + 1),
+            f"pseudonym-{i // per_pseudonym}",
+            f"{i % uras + 1:08d}",
+            f"source-{i % sources}",
+            created_at + timedelta(milliseconds=i),
+        )
+
+
+def time_lookups(get: Callable[[str], object], pseudonyms: List[str]) -> List[float]:
+    latencies = []
+    for pseudonym in pseudonyms:
+        start = time.perf_counter()
+        get(pseudonym)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def percentile(ordered: List[float], percent: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--per-pseudonym", type=int, default=2, help="referrals per pseudonym")
+    parser.add_argument("--uras", type=int, default=5000)
+    parser.add_argument("--sources", type=int, default=20)
+    parser.add_argument("--lookups", type=int, default=100_000, help="lookups of present and of absent pseudonyms")
+    parser.add_argument("--snapshot", help="path of a snapshot file to write and map instead of filling a table")
+    args = parser.parse_args()
+
+    pseudonyms = -(-args.rows // args.per_pseudonym)
+    rows = synthetic_rows(args.rows, args.per_pseudonym, args.uras, args.sources)
+    get: Callable[[str], object]
+    if args.snapshot:
+        start = time.perf_counter()
+        write_snapshot(args.snapshot, rows, None)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        snapshot = ReferralSnapshot(args.snapshot)
+        opened = time.perf_counter() - start
+        get = snapshot.get
+
+        print(f"{args.rows} referrals, {pseudonyms} pseudonyms, written in {elapsed:.1f}s, mapped in {opened * 1e3:.2f}ms")
+        print(f"bytes/referral={os.path.getsize(args.snapshot) / args.rows:.1f} (file, shared by all workers)")
+    else:
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        table = ReferralTable(capacity=pseudonyms)
+        start = time.perf_counter()
+        for row in rows:
+            table.add(*row)
+        elapsed = time.perf_counter() - start
+        # ru_maxrss is in kilobytes on Linux
+        rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024
+        get = table.get
+
+        print(f"{args.rows} referrals, {pseudonyms} pseudonyms, filled in {elapsed:.1f}s")
+        print(f"bytes/referral={table.nbytes() / args.rows:.1f} rss/referral={rss / args.rows:.1f}")
+
+    present = [f"pseudonym-{random.randrange(pseudonyms)}" for _ in range(args.lookups)]
+    absent = [f"absent-{i}" for i in range(args.lookups)]
+    for name, sample in (("present", present), ("absent", absent)):
+        latencies = time_lookups(get, sample)
+        print(
+            f"{name:<8} p50={percentile(latencies, 50) * 1e6:.1f}us p99={percentile(latencies, 99) * 1e6:.1f}us "
+            f"max={latencies[-1] * 1e6:.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()